@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import hashlib
 import json
 import os
 import sys
+import time
 
 # Standard library imports
 from fnmatch import fnmatch
@@ -64,6 +66,10 @@ class AutoCpenv(DeadlineEventListener):
         job_plugin = job.JobPlugin
         plugin_mapping = self.GetConfigEntry("plugin_mapping")
 
+        pin_requirements = self.GetBooleanConfigEntryWithDefault(
+            "pin_requirements", False
+        )
+
         self.log("Checking job ExtraInfo for requirements...")
         requirements = job.GetJobExtraInfoKeyValue("cpenv_requirements")
         if requirements:
@@ -71,6 +77,12 @@ class AutoCpenv(DeadlineEventListener):
             self.log("Found {} requirements...".format(len(requirements)))
             for requirement in requirements:
                 self.log("  " + requirement)
+
+            if pin_requirements:
+                configure_autocpenv(self.log)
+                if self.pin_requirements(job, requirements):
+                    self.log("Saving Job.")
+                    RepositoryUtils.SaveJob(job)
             return
 
         # read config and setup cpenv
@@ -110,9 +122,31 @@ class AutoCpenv(DeadlineEventListener):
         self.log("Setting JobExtranInfo cpenv_requirements")
         job.SetJobExtraInfoKeyValue("cpenv_requirements", " ".join(requirements))
 
+        if pin_requirements:
+            self.pin_requirements(job, requirements)
+
         self.log("Saving Job.")
         RepositoryUtils.SaveJob(job)
 
+    def pin_requirements(self, job, requirements):
+        """Resolve requirements and store the resolved modules in the job's
+        cpenv_pinned ExtraInfo key.
+
+        Workers activate the pinned modules without resolving requirements
+        again, so every task uses the same module versions.
+        """
+
+        self.log("Pinning requirements...")
+        try:
+            module_specs = cpenv.resolve(requirements)
+        except cpenv.ResolveError as e:
+            self.log(f"  Failed to pin requirements: {e}")
+            return False
+
+        self.log("Setting JobExtraInfo cpenv_pinned")
+        job.SetJobExtraInfoKeyValue("cpenv_pinned", pin_module_specs(module_specs))
+        return True
+
     def collect_from_job_extra_info(self, job):
         """Checks to see if the job was submitted with cpenv_requirements."""
 
@@ -254,6 +288,102 @@ def combine_requirements(a, b):
     return results
 
 
+def pin_module_specs(module_specs):
+    """Encode a list of ModuleSpecs as compact json for the cpenv_pinned key.
+
+    Each module is stored as [name, version, repo name, path].
+    """
+
+    return json.dumps(
+        [
+            [spec.name, spec.version.string, spec.repo.name, spec.path]
+            for spec in module_specs
+        ],
+        separators=(",", ":"),
+    )
+
+
+def unpin_module_specs(pinned, ignore_missing=False):
+    """Decode the cpenv_pinned key into a list of ModuleSpecs.
+
+    Modules whose repo isn't configured on this worker, or whose local path
+    doesn't exist, are looked up by their exact name and version in the
+    configured repos instead. Modules that were resolved from a path outside
+    of any repo are read from that path when it exists.
+
+    Raises a ResolveError when a pinned module can not be found, so the job
+    never runs with different modules than the ones it was submitted with.
+    When ignore_missing is True missing modules are skipped instead.
+    """
+
+    module_specs = []
+    for name, version, repo_name, path in json.loads(pinned):
+        repo = cpenv.get_repo(repo_name)
+        if repo and (not isinstance(repo, cpenv.LocalRepo) or os.path.isdir(path)):
+            module_specs.append(
+                cpenv.ModuleSpec(
+                    name=name,
+                    qual_name=name + "-" + version,
+                    version=cpenv.parse_version(version),
+                    path=path,
+                    repo=repo,
+                )
+            )
+            continue
+
+        try:
+            if os.path.isdir(path) and not is_in_repo(path):
+                module_specs.append(read_pinned_module_spec(name, version, path))
+            else:
+                module_specs.append(find_pinned_module_spec(name, version))
+        except cpenv.ResolveError:
+            if not ignore_missing:
+                raise
+
+    return module_specs
+
+
+def is_in_repo(path):
+    """Returns True if path is within one of the configured LocalRepos."""
+
+    path = os.path.normcase(os.path.abspath(path))
+    for repo in cpenv.get_repos():
+        if not isinstance(repo, cpenv.LocalRepo):
+            continue
+        repo_path = os.path.normcase(os.path.abspath(repo.path))
+        if path.startswith(repo_path.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+def read_pinned_module_spec(name, version, path):
+    """Read the ModuleSpec of a module pinned by its path."""
+
+    try:
+        module_spec = cpenv.Module(path).to_spec()
+    except Exception as e:
+        raise cpenv.ResolveError("Pinned module %s is invalid: %s" % (path, e))
+
+    if module_spec.name != name or module_spec.version.string != version:
+        raise cpenv.ResolveError(
+            "Pinned module %s-%s was replaced by %s at %s."
+            % (name, version, module_spec.qual_name, path)
+        )
+    return module_spec
+
+
+def find_pinned_module_spec(name, version):
+    """Find the ModuleSpec named name with exactly the given version string."""
+
+    qual_name = name + "-" + version
+    for repo in cpenv.get_repos():
+        for module_spec in repo.find(qual_name):
+            if module_spec.name == name and module_spec.version.string == version:
+                return module_spec
+
+    raise cpenv.ResolveError("Pinned module %s could not be found." % qual_name)
+
+
 def return_first_result(*funcs):
     for func, args in funcs:
         result = func(*args)
@@ -313,6 +443,12 @@ def get_config(log=None, worker=None):
         "forced_plugin_mapping": plugin_mapping_str_to_dict(
             plugin_config.GetConfigEntry("forced_plugin_mapping")
         ),
+        "env_cache_ttl": plugin_config.GetIntegerConfigEntryWithDefault(
+            "env_cache_ttl", 0
+        ),
+        "localize_workers": plugin_config.GetIntegerConfigEntryWithDefault(
+            "localize_workers", 1
+        ),
     }
 
     if not worker:
@@ -392,6 +528,76 @@ def configure_autocpenv(log=None, worker=None):
     return config
 
 
+def get_environment_cache_key(requirements, config, worker_groups, pinned=None):
+    """Return a key identifying a resolved environment on a worker.
+
+    Requirements keep their order as it determines the order modules are
+    combined in.
+    """
+
+    data = json.dumps(
+        {
+            "requirements": list(requirements),
+            "pinned": pinned,
+            "home_path": config.get("home_path"),
+            "repos": config.get("repos", []),
+            "ignore_missing": config.get("ignore_missing", False),
+            "worker_groups": sorted(worker_groups),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def get_environment_cache_path(key):
+    """Return the path to a cached environment file."""
+
+    return cpenv.get_cache_path("autocpenv", key + ".json")
+
+
+def read_cached_environment(key, ttl):
+    """Read a cached environment.
+
+    Returns None when the cache is missing, older than ttl seconds, or when
+    one of the cached modules was modified or removed since it was written.
+    """
+
+    cache_path = get_environment_cache_path(key)
+    try:
+        with open(cache_path, "r") as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return
+
+    if time.time() - data["created"] > ttl:
+        return
+
+    for config_path, mtime in data["modules"]:
+        try:
+            if os.path.getmtime(config_path) != mtime:
+                return
+        except OSError:
+            return
+
+    return data["environment"]
+
+
+def write_cached_environment(key, environment, modules):
+    """Cache the combined environment of a list of localized modules."""
+
+    data = {
+        "created": time.time(),
+        "environment": environment,
+        "modules": [
+            [module.config_path, os.path.getmtime(module.config_path)]
+            for module in modules
+        ],
+    }
+    cache_path = get_environment_cache_path(key)
+    cpenv.paths.ensure_path_exists(os.path.dirname(cache_path))
+    cpenv.paths.atomic_write(cache_path, json.dumps(data))
+
+
 def match_any(value, patterns):
     """Uses fnmatch to match a value against multiple glob-style patterns."""
 
@@ -452,13 +658,48 @@ def GlobalJobPreLoad(plugin):
         plugin.LogInfo("Skipping: Job has no cpenv requirements.")
         return
 
+    # Modules resolved when the job was submitted
+    pinned = job.GetJobExtraInfoKeyValue("cpenv_pinned")
+
     # Read config from autocpenv EventPlugin
     config = configure_autocpenv(plugin.LogInfo, worker)
+    requirements = requirements.split()
 
-    # Use cpenv to resolve our requirements and get the combined environment variables
-    resolved = cpenv.resolve(requirements.split(), config.get("ignore_missing", False))
-    localized = cpenv.Localizer().localize(resolved)
-    environment = cpenv.Activator().combine_modules(localized)
+    # Reuse the environment resolved by a previous task on this worker
+    environment = None
+    cache_key = None
+    cache_ttl = config.get("env_cache_ttl", 0)
+    if cache_ttl:
+        settings = RepositoryUtils.GetSlaveSettings(worker, True)
+        cache_key = get_environment_cache_key(
+            requirements,
+            config,
+            list(settings.SlaveGroups),
+            pinned,
+        )
+        environment = read_cached_environment(cache_key, cache_ttl)
+        if environment is not None:
+            plugin.LogInfo(f"Using cached environment {cache_key}...")
+
+    if environment is None:
+        # Use cpenv to resolve our requirements and get the combined environment
+        ignore_missing = config.get("ignore_missing", False)
+        if pinned:
+            plugin.LogInfo("Using modules pinned at submission...")
+            resolved = unpin_module_specs(pinned, ignore_missing)
+            for module_spec in resolved:
+                plugin.LogInfo(f"  {module_spec.qual_name} - {module_spec.path}")
+        else:
+            resolved = cpenv.resolve(requirements, ignore_missing)
+        localizer = cpenv.Localizer(max_workers=config.get("localize_workers", 1))
+        localized = localizer.localize(resolved)
+        environment = cpenv.Activator().combine_modules(localized)
+
+        if cache_key:
+            try:
+                write_cached_environment(cache_key, environment, localized)
+            except Exception as e:
+                plugin.LogInfo(f"Failed to cache environment: {e}")
 
     plugin.LogInfo("Collecting process and job environment variables...")
     proc_environment = {}
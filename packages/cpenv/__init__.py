@@ -22,7 +22,12 @@ from . import compat
 from . import mappings
 
 
-# Initialize cpenv
-from .api import _init
+def __getattr__(name):
+    # Lazily import ShotgunRepo, see cpenv.repos.registry
+    if name == "ShotgunRepo":
+        return repos.ShotgunRepo
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
-_init()
+
+if not compat.has_module_getattr:
+    from .repos import ShotgunRepo
@@ -3,6 +3,7 @@ from __future__ import absolute_import, print_function
 
 # Standard library imports
 import os
+import threading
 import warnings
 from bisect import bisect
 from collections import OrderedDict
@@ -46,13 +47,37 @@ _registry = {
     "repos": OrderedDict(),
 }
 _active_modules = []
+_initialized = {
+    "repos": False,
+    "active_modules": False,
+}
+_init_lock = threading.RLock()
 missing = object()
 
 
-def resolve(requirements, ignore_unresolved=False):
-    """Resolve a list of module requirements."""
+def resolve(requirements, ignore_unresolved=False, transitive=None):
+    """Resolve a list of module requirements.
+
+    When transitive is True, the requirements of resolved modules are
+    resolved as well. Defaults to $CPENV_RESOLVE_REQUIRES. See
+    Resolver.resolve_requires.
+
+    When $CPENV_DAEMON is set, requirements are resolved by a running cpenv
+    daemon if possible. See cpenv.daemon.
+    """
+
+    from . import daemon
+
+    resolver = Resolver(get_repos(), transitive)
+    if daemon.is_enabled():
+        module_specs = daemon.resolve(
+            requirements,
+            ignore_unresolved,
+            resolver.transitive,
+        )
+        if module_specs is not None:
+            return module_specs
 
-    resolver = Resolver(get_repos())
     return resolver.resolve(requirements, ignore_unresolved)
 
 
@@ -62,8 +87,7 @@ def localize(requirements, to_repo="home", overwrite=False, ignore_unresolved=Fa
     to_repo = get_repo(to_repo)
 
     # Resolve modules
-    resolver = Resolver(get_repos())
-    module_specs = resolver.resolve(requirements, ignore_unresolved)
+    module_specs = resolve(requirements, ignore_unresolved)
 
     # Localize modules from remote repos
     localizer = Localizer(to_repo)
@@ -86,8 +110,7 @@ def activate(requirements, ignore_unresolved=False):
     """
 
     # Resolve modules
-    resolver = Resolver(get_repos())
-    module_specs = resolver.resolve(requirements, ignore_unresolved)
+    module_specs = resolve(requirements, ignore_unresolved)
 
     # Activate modules
     activator = Activator()
@@ -221,7 +244,7 @@ def clone(module, from_repo=None, where=None, overwrite=False):
 
     if not isinstance(module, (Module, ModuleSpec)):
         if from_repo is None:
-            resolver = Resolver(get_repos())
+            resolver = Resolver(get_repos(), transitive=False)
             module_spec = resolver.resolve([module])[0]
         else:
             from_repo = get_repo(from_repo)
@@ -242,7 +265,7 @@ def publish(module, to_repo="home", overwrite=False):
     to_repo = get_repo(to_repo)
 
     if isinstance(module, compat.string_types):
-        resolver = Resolver(get_repos())
+        resolver = Resolver(get_repos(), transitive=False)
         module = resolver.resolve([module])[0]
 
     if isinstance(module, ModuleSpec):
@@ -262,7 +285,7 @@ def copy(module, from_repo, to_repo, overwrite=False):
     to_repo = get_repo(to_repo)
 
     # Resolve module
-    resolver = Resolver([from_repo])
+    resolver = Resolver([from_repo], transitive=False)
     module_spec = resolver.resolve([module])[0]
 
     copier = Copier(to_repo)
@@ -273,6 +296,7 @@ def copy(module, from_repo, to_repo, overwrite=False):
 def get_active_modules():
     """Returns a list of active :class:`Module` s"""
 
+    _init_active_modules()
     return _active_modules
 
 
@@ -283,6 +307,7 @@ def add_active_module(module):
         module (Module): Module to add to CPENV_ACTIVE_MODULES
     """
 
+    _init_active_modules()
     if module not in _active_modules:
         _active_modules.append(module)
 
@@ -297,6 +322,7 @@ def remove_active_module(module):
         module (Module): Module to remove from CPENV_ACTIVE_MODULES
     """
 
+    _init_active_modules()
     if module in _active_modules:
         _active_modules.remove(module)
 
@@ -473,9 +499,15 @@ def add_module_path(path):
 def get_modules(*requirements):
     """Returns a list of available modules."""
 
+    from . import daemon
+
     if requirements:
-        resolver = Resolver(get_repos())
-        return sort_modules(resolver.resolve(requirements))
+        return sort_modules(resolve(requirements))
+
+    if daemon.is_enabled():
+        modules = daemon.list()
+        if modules is not None:
+            return sort_modules(modules)
 
     modules = []
 
@@ -488,6 +520,7 @@ def get_modules(*requirements):
 def update_repo(repo):
     """Update a registered repo."""
 
+    _init_repos()
     _registry["repos"].update({repo.name: repo})
 
 
@@ -498,6 +531,7 @@ def add_repo(repo, priority=None):
         priority (int): Override the Repos priority when adding.
     """
 
+    _init_repos()
     if priority is not None:
         repo.priority = priority
 
@@ -514,6 +548,7 @@ def add_repo(repo, priority=None):
 def remove_repo(repo):
     """Unregister a Repo."""
 
+    _init_repos()
     _registry["repos"].pop(repo.name, None)
 
 
@@ -533,6 +568,7 @@ def get_repo(name, **query):
 def get_repos():
     """Get a list of all registered Repos."""
 
+    _init_repos()
     return list(_registry["repos"].values())
 
 
@@ -595,7 +631,50 @@ def write_config(*args):
 
 
 def _init():
-    """Responsible for initially configuraing cpenv."""
+    """Responsible for initially configuraing cpenv.
+
+    Importing cpenv does not call _init. The repo registry is initialized the
+    first time it's accessed and CPENV_ACTIVE_MODULES is resolved the first
+    time the active modules are accessed.
+    """
+
+    _init_repos()
+    _init_active_modules()
+
+
+def _init_once(key, init_func):
+    """Call init_func once per process.
+
+    Other threads wait for init_func to finish, while calls made by
+    init_func itself return immediately.
+    """
+
+    if _initialized[key]:
+        return
+
+    with _init_lock:
+        if _initialized[key] is not False:
+            return
+
+        _initialized[key] = None
+        try:
+            init_func()
+        except Exception:
+            _initialized[key] = False
+            raise
+        _initialized[key] = True
+
+
+def _init_repos():
+    _init_once("repos", _register_repos)
+
+
+def _init_active_modules():
+    _init_once("active_modules", _resolve_active_modules)
+
+
+def _register_repos():
+    """Create cpenv's home and user folders and register all repos."""
 
     _init_home_path(get_home_path())
     _init_user_path(get_user_path())
@@ -641,14 +720,17 @@ def _init():
                 )
             )
 
-    # Set _active_modules from CPENV_ACTIVE_MODULES
+
+def _resolve_active_modules():
+    """Set _active_modules from CPENV_ACTIVE_MODULES."""
+
     unresolved = []
-    resolver = Resolver(get_repos())
     active_modules = os.getenv("CPENV_ACTIVE_MODULES", "").split(os.pathsep)
     for module in active_modules:
         if module:
             try:
-                resolved = resolver.resolve([module])[0]
+                # Active modules were already resolved with their requires
+                resolved = resolve([module], transitive=False)[0]
                 _active_modules.append(resolved)
             except ResolveError:
                 unresolved.append(module)
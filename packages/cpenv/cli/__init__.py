@@ -7,11 +7,13 @@ from cpenv.cli import (
     copy,
     core,
     create,
+    daemon,
     edit,
     env,
     info,
     list,
     localize,
+    prune,
     publish,
     remove,
     repo,
@@ -38,11 +40,13 @@ class CpenvCLI(core.CLI):
             clone.Clone(self),
             copy.Copy(self),
             create.Create(self),
+            daemon.Daemon(self),
             info.Info(self),
             edit.Edit(self),
             env.Env(self),
             list.List(self),
             localize.Localize(self),
+            prune.Prune(self),
             publish.Publish(self),
             remove.Remove(self),
             repo.Repo(self),
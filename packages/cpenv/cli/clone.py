@@ -44,7 +44,7 @@ class Clone(core.CLI):
 
         try:
             if not args.from_repo:
-                module_spec = api.resolve([args.module])[0]
+                module_spec = api.resolve([args.module], transitive=False)[0]
             else:
                 from_repo = api.get_repo(args.from_repo)
                 module_spec = from_repo.find(args.module)[0]
@@ -0,0 +1,48 @@
+from cpenv import daemon
+from cpenv.cli import core
+
+
+class Daemon(core.CLI):
+    """Run a local daemon that serves resolve requests.
+
+    The daemon keeps repos and recent resolve results in memory so that new
+    processes with $CPENV_DAEMON=1 can resolve modules without scanning or
+    querying repos themselves. Runs until stopped with --stop.
+    """
+
+    def setup_parser(self, parser):
+        parser.add_argument(
+            "--socket",
+            help="Path of the unix socket. ($CPENV_DAEMON_SOCKET)",
+            default=None,
+        )
+        parser.add_argument(
+            "--ttl",
+            help="Seconds to cache resolve results. ($CPENV_DAEMON_TTL or 10)",
+            type=int,
+            default=None,
+        )
+        parser.add_argument(
+            "--stop",
+            help="Stop the running daemon.",
+            action="store_true",
+        )
+
+    def run(self, args):
+
+        if args.stop:
+            if not daemon.shutdown(args.socket):
+                core.echo("Daemon is not running.")
+                core.exit(1)
+            core.echo("Stopped daemon.")
+            return
+
+        socket_path = args.socket or daemon.get_socket_path()
+        core.echo("- Serving resolve requests on %s" % socket_path)
+        try:
+            daemon.serve(socket_path, args.ttl)
+        except daemon.DaemonError as e:
+            core.echo("Error: " + str(e))
+            core.exit(1)
+        except KeyboardInterrupt:
+            pass
@@ -34,7 +34,10 @@ class Edit(core.CLI):
             return self.run_env(args.module_or_environment)
 
         try:
-            module_spec = api.resolve([args.module_or_environment])[0]
+            module_spec = api.resolve(
+                [args.module_or_environment],
+                transitive=False,
+            )[0]
         except ResolveError:
             sys.exit(1)
 
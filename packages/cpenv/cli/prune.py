@@ -0,0 +1,18 @@
+from cpenv import api
+from cpenv.cli import core
+from cpenv.store import ObjectStore
+
+
+class Prune(core.CLI):
+    """Remove unused files from the object store.
+
+    LocalRepos with the cas localize_mode store the files of downloaded
+    modules once in $CPENV_HOME/cache/objects. Files stay in the store after
+    the modules using them are removed, until they are pruned.
+    """
+
+    def run(self, args):
+
+        store = ObjectStore(api.get_cache_path("objects"))
+        removed = store.prune()
+        core.echo("Removed %d unused objects from %s" % (removed, store.root))
@@ -11,10 +11,15 @@ is_py3 = py_ver == 3
 if is_py2:
     string_types = (str, basestring, unicode)
     numeric_types = (int, long, float)
+    intern = intern
 
 if is_py3:
     string_types = (str, bytes)
     numeric_types = (int, float)
+    intern = sys.intern
+
+# Module level __getattr__ functions, used for lazy imports, need python 3.7
+has_module_getattr = sys.version_info >= (3, 7)
 
 
 platform = sys.platform.rstrip("1234567890").lower()
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+"""
+A local daemon that keeps repos warm for short lived cpenv processes.
+
+Every new python process pays for scanning repos and querying remote repos
+before it can resolve modules. The daemon holds the registered repos, their
+caches and recent resolve results in memory and serves resolve, find and
+list requests over a unix socket.
+
+Start a daemon with `cpenv daemon` then set CPENV_DAEMON=1 to have cpenv.resolve
+and cpenv.get_modules use it. When the daemon is not running, or can not serve
+a client because it was started with a different CPENV_HOME or CPENV_MODULES
+or has different repos registered, requests fall back to resolving in process.
+Requests are handled in the client's working directory.
+
+The socket is created in a directory only the current user can access, and
+clients refuse to connect to sockets owned by another user or accessible by
+other users.
+
+LocalRepos are rescanned by mtime when a result is not cached, remote repos
+use their own caches. Resolve results are cached for ttl seconds.
+"""
+from __future__ import absolute_import
+
+# Standard library imports
+import contextlib
+import json
+import logging
+import os
+import socket
+import stat
+import sys
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# Local imports
+from . import api, paths
+from .module import ModuleSpec
+from .reporter import Reporter, get_reporter
+from .repos import LocalRepo
+from .resolver import ResolveError, Resolver
+from .vendor.cachetools import LRUCache, TTLCache
+from .versions import parse_version
+
+__all__ = [
+    "DaemonError",
+    "DaemonServer",
+    "check_socket",
+    "get_socket_dir",
+    "get_socket_path",
+    "is_enabled",
+    "request",
+    "resolve",
+    "find",
+    "list",
+    "serve",
+    "shutdown",
+]
+_log = logging.getLogger(__name__)
+_serving = False
+_builtin_list = list
+
+
+class DaemonError(Exception):
+    """Raised when the daemon fails to handle a request."""
+
+
+def get_socket_dir():
+    """Return the per-user directory of the daemon's unix socket.
+
+    Defaults to $XDG_RUNTIME_DIR/cpenv or daemon-<uid> in the cpenv home
+    directory.
+    """
+
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return paths.normalize(runtime_dir, "cpenv")
+
+    uid = os.getuid() if hasattr(os, "getuid") else os.getenv("USERNAME", "user")
+    return paths.normalize(api.get_home_path(), "daemon-%s" % uid)
+
+
+def get_socket_path():
+    """Return the path of the daemon's unix socket.
+
+    Defaults to $CPENV_DAEMON_SOCKET or daemon.sock in get_socket_dir().
+    """
+
+    socket_path = os.getenv("CPENV_DAEMON_SOCKET")
+    if socket_path:
+        return socket_path
+
+    return paths.normalize(get_socket_dir(), "daemon.sock")
+
+
+def _check_private(path, stat_result):
+    """Raise DaemonError unless stat_result is owned by the current user and
+    gives no access to group or others."""
+
+    if not hasattr(os, "getuid"):
+        return
+
+    if stat_result.st_uid != os.getuid():
+        raise DaemonError("%s is owned by another user." % path)
+
+    if stat_result.st_mode & 0o077:
+        raise DaemonError("%s is accessible by other users." % path)
+
+
+def ensure_socket_dir(socket_path):
+    """Create the directory of a socket, accessible only by the current user.
+
+    Raises:
+        DaemonError when an existing directory is not private.
+    """
+
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.isdir(socket_dir):
+        os.makedirs(socket_dir, 0o700)
+        os.chmod(socket_dir, 0o700)
+    _check_private(socket_dir, os.stat(socket_dir))
+
+
+def check_socket(socket_path):
+    """Check that a socket and its directory belong to the current user.
+
+    Raises:
+        OSError when the socket does not exist.
+        DaemonError when the socket or its directory is not private.
+    """
+
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    _check_private(socket_dir, os.stat(socket_dir))
+
+    stat_result = os.lstat(socket_path)
+    if not stat.S_ISSOCK(stat_result.st_mode):
+        raise DaemonError("%s is not a socket." % socket_path)
+    _check_private(socket_path, stat_result)
+
+
+def is_enabled():
+    """Returns True when $CPENV_DAEMON is set and unix sockets are supported.
+
+    Values like 0, false, no and off disable the daemon.
+    """
+
+    value = os.getenv("CPENV_DAEMON", "").strip().lower()
+    return (
+        not _serving
+        and hasattr(socket, "AF_UNIX")
+        and value not in ("", "0", "false", "no", "off")
+    )
+
+
+def get_context():
+    """Return the settings a daemon must share with a client to serve it.
+
+    This includes the client's registered repos, so a daemon does not serve
+    clients that added or removed repos at runtime.
+    """
+
+    return {
+        "home": api.get_home_path(),
+        "user": api.get_user_modules_path(),
+        "modules": os.getenv("CPENV_MODULES", ""),
+        "platform": sys.platform,
+        "repos": describe_repos(api.get_repos()),
+    }
+
+
+def describe_repos(repos):
+    """Return the name, type and path of each repo."""
+
+    return [
+        [repo.name, type(repo).__name__, getattr(repo, "path", None)]
+        for repo in repos
+    ]
+
+
+@contextlib.contextmanager
+def _working_directory(path):
+    """Temporarily change the working directory of the daemon."""
+
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def spec_to_dict(module_spec):
+    return {
+        "name": module_spec.name,
+        "qual_name": module_spec.qual_name,
+        "version": module_spec.version.string,
+        "path": module_spec.path,
+        "repo": module_spec.repo.name,
+    }
+
+
+def spec_from_dict(data):
+    """Create a ModuleSpec from the data returned by a daemon.
+
+    Raises:
+        LookupError when the client has no repo with a matching name.
+    """
+
+    repo = api.get_repo(data["repo"])
+    if repo is None:
+        raise LookupError("No repo named %s" % data["repo"])
+
+    return ModuleSpec(
+        name=data["name"],
+        qual_name=data["qual_name"],
+        version=parse_version(data["version"]),
+        path=data["path"],
+        repo=repo,
+    )
+
+
+class _RecordingReporter(Reporter):
+    """Records the requirements matched during a resolve."""
+
+    def __init__(self):
+        self.matches = []
+        self.unresolved = []
+
+    def resolve_requirement(self, requirement, module_spec):
+        self.matches.append((requirement, module_spec))
+
+    def end_resolve(self, resolved, unresolved):
+        self.unresolved = _builtin_list(unresolved)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line.decode("utf-8"))
+                response = {"result": self.server.handle_request_data(data)}
+            except Exception as e:
+                _log.debug("Failed to handle request: %s", e, exc_info=True)
+                response = {"error": "%s: %s" % (type(e).__name__, e)}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves resolve, find and list requests using this process's repos.
+
+    Requests are handled one at a time because repos are not guaranteed to
+    be thread-safe.
+
+    Arguments:
+        socket_path (str): Path of the unix socket to listen on.
+        ttl (int): Seconds to cache resolve results. Defaults to 10.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, ttl=10):
+        self.socket_path = socket_path or get_socket_path()
+        self.context = get_context()
+        self.context.pop("repos")
+        self.results = TTLCache(maxsize=1024, ttl=ttl)
+        self.cwd_repos = LRUCache(maxsize=32)
+        self.lock = threading.Lock()
+        self._config_mtime = self._get_config_mtime()
+        configured = [c.get("name", n) for n, c in api.read_config("repos", {}).items()]
+        self.configured_repos = [r for r in api.get_repos() if r.name in configured]
+
+        # Only replace sockets of this user, another user's daemon would be
+        # able to answer requests with any module.
+        ensure_socket_dir(self.socket_path)
+        if os.path.lexists(self.socket_path):
+            check_socket(self.socket_path)
+            if request("ping", socket_path=self.socket_path) is not None:
+                raise DaemonError("Daemon already running at %s" % self.socket_path)
+            os.remove(self.socket_path)
+
+        socketserver.UnixStreamServer.__init__(
+            self,
+            self.socket_path,
+            _RequestHandler,
+        )
+        os.chmod(self.socket_path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def _get_config_mtime(self):
+        try:
+            return os.path.getmtime(api.get_config_path())
+        except OSError:
+            return None
+
+    def reload_if_config_changed(self):
+        """Register configured repos again when the config file is modified."""
+
+        config_mtime = self._get_config_mtime()
+        if config_mtime == self._config_mtime:
+            return
+
+        _log.debug("Config modified, reloading repos.")
+        self._config_mtime = config_mtime
+        for repo in self.configured_repos:
+            api.remove_repo(repo)
+
+        self.configured_repos = []
+        for name, config in api.read_config("repos", {}).items():
+            repo_cls = api.repos.registry[config.pop("type")]
+            try:
+                repo = repo_cls(**config)
+            except Exception as e:
+                _log.warning("Failed to create repo named %s: %s", name, e)
+                continue
+            api.add_repo(repo)
+            self.configured_repos.append(repo)
+
+        self.results.clear()
+
+    def _get_cwd_repos(self, cwd):
+        """Return the repos a client in cwd would have registered."""
+
+        repos = [repo for repo in api.get_repos() if repo.name != "cwd"]
+        if cwd not in [repo.path for repo in repos]:
+            cwd_repo = self.cwd_repos.get(cwd)
+            if cwd_repo is None:
+                cwd_repo = self.cwd_repos[cwd] = LocalRepo("cwd", cwd)
+            repos.insert(0, cwd_repo)
+        return repos
+
+    def get_repos(self, cwd):
+        """Return the repos a client in cwd would have registered, with
+        their caches refreshed."""
+
+        repos = self._get_cwd_repos(cwd)
+
+        # Rescan local repos, unchanged directories are skipped by their index
+        for repo in repos:
+            if isinstance(repo, LocalRepo):
+                repo.clear_cache()
+
+        return repos
+
+    def handle_request_data(self, data):
+        method = data["method"]
+        params = data.get("params", {})
+
+        if method == "ping":
+            return True
+
+        if method == "shutdown":
+            threading.Thread(target=self.shutdown).start()
+            return True
+
+        context = dict(data.get("context") or {})
+        client_repos = context.pop("repos", None)
+        if context != self.context:
+            raise DaemonError("Client context does not match daemon context.")
+
+        # Requests are handled in the client's working directory so relative
+        # paths in requirements resolve like they would in the client.
+        with self.lock, _working_directory(data["cwd"]):
+            self.reload_if_config_changed()
+
+            repos = describe_repos(self._get_cwd_repos(data["cwd"]))
+            if client_repos != repos:
+                raise DaemonError("Client repos do not match daemon repos.")
+
+            if method == "resolve":
+                transitive = params.get("transitive", False)
+                key = (data["cwd"], tuple(params["requirements"]), transitive)
+                result = self.results.get(key)
+                if result is None:
+                    result = self.resolve(
+                        data["cwd"],
+                        params["requirements"],
+                        transitive,
+                    )
+                    self.results[key] = result
+                return result
+
+            if method == "find":
+                return [
+                    spec_to_dict(module_spec)
+                    for repo in self.get_repos(data["cwd"])
+                    for module_spec in repo.find(params["requirement"])
+                ]
+
+            if method == "list":
+                return [
+                    spec_to_dict(module_spec)
+                    for repo in self.get_repos(data["cwd"])
+                    for module_spec in repo.list()
+                ]
+
+        raise DaemonError("Unknown method: %s" % method)
+
+    def resolve(self, cwd, requirements, transitive=False):
+        resolver = Resolver(self.get_repos(cwd), transitive)
+        resolver.reporter = _RecordingReporter()
+        resolved = resolver.resolve(requirements, ignore_unresolved=True)
+        return {
+            "resolved": [spec_to_dict(spec) for spec in resolved],
+            "matches": [
+                (requirement, spec_to_dict(spec))
+                for requirement, spec in resolver.reporter.matches
+            ],
+            "unresolved": resolver.reporter.unresolved,
+        }
+
+
+def serve(socket_path=None, ttl=None):
+    """Run a daemon until it receives a shutdown request.
+
+    Arguments:
+        socket_path (str): Defaults to get_socket_path().
+        ttl (int): Seconds to cache resolve results. Defaults to
+            $CPENV_DAEMON_TTL or 10.
+    """
+
+    global _serving
+    if ttl is None:
+        ttl = int(os.getenv("CPENV_DAEMON_TTL", 10))
+    _serving = True
+
+    server = DaemonServer(socket_path, ttl)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        _serving = False
+
+
+def request(method, socket_path=None, timeout=None, **params):
+    """Send a request to the daemon.
+
+    Sockets that are owned by another user, or accessible by other users,
+    are treated like an unavailable daemon.
+
+    Returns:
+        The result of the request or None when the daemon is not available.
+
+    Raises:
+        DaemonError when the daemon failed to handle the request.
+    """
+
+    socket_path = socket_path or get_socket_path()
+    try:
+        check_socket(socket_path)
+    except (IOError, OSError) as e:
+        _log.debug("Daemon unavailable: %s", e)
+        return
+    except DaemonError as e:
+        _log.warning("Refusing to use daemon socket: %s", e)
+        return
+
+    if timeout is None:
+        timeout = float(os.getenv("CPENV_DAEMON_TIMEOUT", 30))
+
+    data = {
+        "method": method,
+        "params": params,
+        "context": get_context(),
+        "cwd": paths.normalize(os.getcwd()),
+    }
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(data).encode("utf-8") + b"\n")
+        response = sock.makefile("rb").readline()
+    except (IOError, OSError) as e:
+        _log.debug("Daemon unavailable: %s", e)
+        return
+    finally:
+        sock.close()
+
+    if not response:
+        return
+
+    response = json.loads(response.decode("utf-8"))
+    if "error" in response:
+        raise DaemonError(response["error"])
+    return response["result"]
+
+
+def _request_or_none(method, **params):
+    try:
+        return request(method, **params)
+    except DaemonError as e:
+        _log.debug("Daemon failed to handle %s: %s", method, e)
+
+
+def resolve(requirements, ignore_unresolved=False, transitive=False):
+    """Resolve requirements using the daemon. Reports progress and raises
+    ResolveError like Resolver.resolve.
+
+    Returns:
+        list of ModuleSpecs or None when the daemon is not available.
+    """
+
+    result = _request_or_none(
+        "resolve",
+        requirements=_builtin_list(requirements),
+        transitive=transitive,
+    )
+    if result is None:
+        return
+
+    try:
+        resolved = [spec_from_dict(data) for data in result["resolved"]]
+        matches = [
+            (requirement, spec_from_dict(data))
+            for requirement, data in result["matches"]
+        ]
+    except LookupError as e:
+        _log.debug("Can not use daemon results: %s", e)
+        return
+
+    reporter = get_reporter()
+    reporter.start_resolve(requirements)
+    for requirement, module_spec in matches:
+        reporter.find_requirement(requirement)
+        reporter.resolve_requirement(requirement, module_spec)
+    reporter.end_resolve(resolved, result["unresolved"])
+
+    if result["unresolved"] and not ignore_unresolved:
+        raise ResolveError("Could not resolve: " + " ".join(result["unresolved"]))
+
+    return resolved
+
+
+def find(requirement):
+    """Find ModuleSpecs matching a requirement in all repos using the daemon.
+
+    Returns:
+        list of ModuleSpecs or None when the daemon is not available.
+    """
+
+    result = _request_or_none("find", requirement=requirement)
+    if result is None:
+        return
+
+    try:
+        return [spec_from_dict(data) for data in result]
+    except LookupError:
+        return
+
+
+def list():
+    """List the ModuleSpecs in all repos using the daemon.
+
+    Returns:
+        list of ModuleSpecs or None when the daemon is not available.
+    """
+
+    result = _request_or_none("list")
+    if result is None:
+        return
+
+    try:
+        return [spec_from_dict(data) for data in result]
+    except LookupError:
+        return
+
+
+def shutdown(socket_path=None):
+    """Ask a running daemon to exit. Returns True if a daemon was running."""
+
+    return bool(request("shutdown", socket_path=socket_path))
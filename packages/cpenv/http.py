@@ -1,22 +1,508 @@
 # -*- coding: utf-8 -*-
 # Standard library imports
+import logging
 import os
+import re
+import socket
 import ssl
+import threading
+from json import dumps as json_dumps
+from json import load as json_load_file
 from json import loads as json_load
+from multiprocessing.pool import ThreadPool
+
+# Local imports
+from . import paths
 
 try:
-    from urllib2 import urlopen, HTTPError, URLError
-    from httplib import HTTPException
+    from urllib2 import Request, urlopen, HTTPError
+    from urllib import getproxies, proxy_bypass
+    from urlparse import urljoin, urlsplit
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
 except ImportError:
-    from urllib.request import urlopen
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib.error import HTTPError
+    from urllib.parse import urljoin, urlsplit
+    from urllib.request import Request, getproxies, proxy_bypass, urlopen
+
+_log = logging.getLogger(__name__)
+content_range_re = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+)")
+redirect_codes = (301, 302, 303, 307, 308)
+max_redirects = 10
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def get_timeout():
+    """Return the timeout of blocking socket operations in seconds.
+
+    Defaults to $CPENV_HTTP_TIMEOUT or 60.
+    """
+
+    return float(os.getenv("CPENV_HTTP_TIMEOUT", 60))
+
+
+def get_ssl_context():
+    """Return the SSL context shared by all requests."""
+
+    global _ssl_context
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context(cafile=ca_certs())
+        return _ssl_context
+
+
+class ConnectionPool(object):
+    """Keeps idle keep-alive connections by scheme and host.
+
+    A connection is only used by one request at a time. It's returned to the
+    pool once its response has been read completely.
+
+    Arguments:
+        max_idle (int): Maximum number of idle connections kept per host.
+    """
+
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, netloc, timeout):
+        """Returns a (connection, reused) tuple.
+
+        Arguments:
+            scheme (str): http or https.
+            netloc (str): Host and optional port.
+            timeout (float): Timeout of blocking socket operations in seconds.
+        """
+
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            connection = idle.pop() if idle else None
+
+        if connection is not None:
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return connection, True
+
+        if scheme == "https":
+            connection = HTTPSConnection(
+                netloc,
+                timeout=timeout,
+                context=get_ssl_context(),
+            )
+            return connection, False
+        return HTTPConnection(netloc, timeout=timeout), False
+
+    def release(self, scheme, netloc, connection):
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Close all idle connections."""
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+pool = ConnectionPool()
+
+
+class PooledResponse(object):
+    """Wraps an HTTPResponse so its connection is returned to the pool once
+    the response has been read. Provides the parts of the urlopen response
+    interface used by cpenv."""
+
+    def __init__(self, url, response, connection, scheme, netloc):
+        self.url = url
+        self._response = response
+        self._connection = connection
+        self._scheme = scheme
+        self._netloc = netloc
+
+    def _release(self, reuse):
+        if self._connection is None:
+            return
+
+        connection, self._connection = self._connection, None
+        if reuse and not self._response.will_close:
+            pool.release(self._scheme, self._netloc, connection)
+        else:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+        if self._response.isclosed():
+            self._release(reuse=True)
+        return data
+
+    def close(self):
+        if self._response.isclosed():
+            self._release(reuse=True)
+        else:
+            # Drop the connection instead of reading the rest of the body
+            self._response.close()
+            self._release(reuse=False)
+
+    def info(self):
+        return self._response.msg
+
+    def getcode(self):
+        return self._response.status
+
+    def geturl(self):
+        return self.url
+
+
+def _use_proxy(url):
+    """Returns True if requests to url should be made through a proxy."""
+
+    scheme, netloc = urlsplit(url)[:2]
+    return scheme in getproxies() and not proxy_bypass(netloc.split(":")[0])
+
+
+def _request(scheme, netloc, target, headers, timeout):
+    """Send a GET request on a pooled connection.
+
+    Idle connections may have been closed by the server, so requests that
+    fail on a reused connection are retried on another connection. Requests
+    that time out are not retried.
+    """
+
+    while True:
+        connection, reused = pool.acquire(scheme, netloc, timeout)
+        try:
+            connection.request("GET", target, headers=headers)
+            return connection, connection.getresponse()
+        except socket.timeout:
+            connection.close()
+            raise
+        except (socket.error, HTTPException):
+            connection.close()
+            if not reused:
+                raise
+
+
+def get(url, headers=None, timeout=None):
+    """Make a get request.
+
+    Requests share an SSL context and keep-alive connections by host, see
+    ConnectionPool. Redirects are followed. Requests are made using urlopen
+    when a proxy is configured for the url.
+
+    Arguments:
+        url (str): Url to request.
+        headers (dict): Request headers.
+        timeout (float): Timeout of blocking socket operations in seconds,
+            including each read of the response. Defaults to get_timeout().
+
+    Raises:
+        HTTPError when the response status is 400 or greater.
+        socket.timeout when the server does not respond in time.
+    """
+
+    if timeout is None:
+        timeout = get_timeout()
+
+    if _use_proxy(url):
+        if headers:
+            url = Request(url, headers=headers)
+        return urlopen(url, timeout=timeout, context=get_ssl_context())
+
+    headers = dict(headers or {})
+    headers.setdefault("User-Agent", "cpenv")
+    for _ in range(max_redirects + 1):
+        scheme, netloc, path, query, _ = urlsplit(url)
+        target = (path or "/") + ("?" + query if query else "")
+        connection, response = _request(scheme, netloc, target, headers, timeout)
+        pooled_response = PooledResponse(url, response, connection, scheme, netloc)
+        if response.status in redirect_codes and response.getheader("Location"):
+            location = urljoin(url, response.getheader("Location"))
+            pooled_response.read()
+            pooled_response.close()
+
+            # Do not send credentials to other hosts
+            if urlsplit(location)[1] != netloc:
+                headers.pop("Cookie", None)
+                headers.pop("Authorization", None)
+            url = location
+            continue
+
+        if response.status >= 400:
+            raise HTTPError(
+                url,
+                response.status,
+                response.reason,
+                response.msg,
+                pooled_response,
+            )
+        return pooled_response
+
+    raise HTTPError(url, response.status, "Too many redirects", response.msg, None)
+
+
+def download(
+    url,
+    path,
+    chunk_size=None,
+    progress_cb=None,
+    max_workers=None,
+    range_size=None,
+    retries=3,
+):
+    """Download a url to a file.
+
+    When the server supports Range requests the file is fetched in byte
+    ranges by a pool of threads, each writing directly into a preallocated
+    file. Failed ranges are retried from the last byte received. Completed
+    ranges are recorded in a "<path>.part" file so an interrupted download
+    can be resumed by calling download again with the same path. Raises
+    ContentChanged if the url's ETag or Last-Modified validator changes
+    during the download.
+
+    Otherwise the response is streamed to the file. In both cases only
+    chunk_size bytes per thread are held in memory at a time.
+
+    Arguments:
+        url (str): Url to download.
+        path (str): Destination file path.
+        chunk_size (int): Bytes read per chunk. Defaults to
+            $CPENV_DOWNLOAD_CHUNK_SIZE or 1MB.
+        progress_cb (callable): Called with the size of each chunk written.
+        max_workers (int): Number of concurrent range requests. Defaults to
+            $CPENV_DOWNLOAD_WORKERS or 4. Use 1 to disable ranged downloads.
+        range_size (int): Bytes per range request. Defaults to
+            $CPENV_DOWNLOAD_RANGE_SIZE or 16MB.
+        retries (int): Attempts per range before giving up.
+
+    Returns:
+        Number of bytes written.
+    """
+
+    if chunk_size is None:
+        chunk_size = int(os.getenv("CPENV_DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+    if max_workers is None:
+        max_workers = int(os.getenv("CPENV_DOWNLOAD_WORKERS", 4))
+    if range_size is None:
+        range_size = int(os.getenv("CPENV_DOWNLOAD_RANGE_SIZE", 16 * 1024 * 1024))
+
+    if max_workers < 2:
+        return _download_stream(get(url), path, chunk_size, progress_cb)
+
+    # Probe for range support. Servers without it respond with the full
+    # content which is streamed as usual.
+    response = get(url, headers={"Range": "bytes=0-0"})
+    match = content_range_re.match(response.info().get("Content-Range") or "")
+    if response.getcode() != 206 or not match:
+        return _download_stream(response, path, chunk_size, progress_cb)
+
+    response.close()
+    size = int(match.group(3))
+    etag = response.info().get("ETag")
+    if etag and etag.startswith("W/"):
+        # Weak entity tags can not be used in If-Range headers
+        etag = None
+    validator = etag or response.info().get("Last-Modified")
+    if size <= range_size:
+        return _download_stream(get(url), path, chunk_size, progress_cb)
+
+    return _RangedDownload(
+        url,
+        path,
+        size,
+        validator,
+        chunk_size,
+        progress_cb,
+        max_workers,
+        range_size,
+        retries,
+    ).run()
+
+
+def _download_stream(response, path, chunk_size, progress_cb):
+    """Stream a response to a file."""
+
+    total = 0
+    try:
+        with open(path, "wb") as f:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                total += len(chunk)
+                if progress_cb:
+                    progress_cb(len(chunk))
+    finally:
+        response.close()
+    return total
+
+
+class ContentChanged(Exception):
+    """Raised when a url changes during a ranged download."""
+
+
+class _RangedDownload(object):
+    """Downloads a url in byte ranges using a pool of threads.
+
+    Range requests include an If-Range header with the ETag or Last-Modified
+    validator recorded when the download started, so ranges of a different
+    version of the content are never mixed into the file. See download for
+    details.
+    """
+
+    def __init__(
+        self,
+        url,
+        path,
+        size,
+        validator,
+        chunk_size,
+        progress_cb,
+        max_workers,
+        range_size,
+        retries,
+    ):
+        self.url = url
+        self.path = path
+        self.state_path = path + ".part"
+        self.size = size
+        self.validator = validator
+        self.chunk_size = chunk_size
+        self.progress_cb = progress_cb
+        self.max_workers = max_workers
+        self.range_size = range_size
+        self.retries = retries
+        self.done = set()
+        self._lock = threading.Lock()
+
+    def load_state(self):
+        """Load completed ranges of a previous attempt to download the url."""
+
+        if not os.path.isfile(self.path):
+            return
+
+        try:
+            with open(self.state_path, "r") as f:
+                state = json_load_file(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        if (
+            state.get("size") == self.size
+            and state.get("validator") == self.validator
+            and state.get("range_size") == self.range_size
+            and os.path.getsize(self.path) == self.size
+        ):
+            self.done = set(state["done"])
+
+    def save_state(self):
+        data = json_dumps(
+            {
+                "size": self.size,
+                "validator": self.validator,
+                "range_size": self.range_size,
+                "done": sorted(self.done),
+            }
+        )
+        paths.atomic_write(self.state_path, data)
+
+    def run(self):
+        self.load_state()
+        if self.done:
+            _log.debug("Resuming download of %s", self.path)
+            self._progress(sum([self._range_length(start) for start in self.done]))
+        else:
+            # Preallocate the file so ranges can be written in any order
+            with open(self.path, "wb") as f:
+                f.truncate(self.size)
+            self.save_state()
+
+        starts = [
+            start
+            for start in range(0, self.size, self.range_size)
+            if start not in self.done
+        ]
+        pool = ThreadPool(min(self.max_workers, len(starts)) or 1)
+        try:
+            for _ in pool.imap_unordered(self._fetch_range, starts):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+        os.remove(self.state_path)
+        return self.size
+
+    def _range_length(self, start):
+        return min(self.range_size, self.size - start)
+
+    def _progress(self, size):
+        if self.progress_cb:
+            with self._lock:
+                self.progress_cb(size)
 
+    def _fetch_range(self, start):
+        """Fetch a single range, retrying from the last byte received."""
 
-def get(url):
-    """Make a get request."""
+        end = start + self._range_length(start) - 1
+        offset = start
+        attempt = 0
+        with open(self.path, "r+b") as f:
+            while offset <= end:
+                try:
+                    headers = {"Range": "bytes=%d-%d" % (offset, end)}
+                    if self.validator:
+                        headers["If-Range"] = self.validator
+                    response = get(self.url, headers=headers)
+                    try:
+                        if response.getcode() == 200 and self.validator:
+                            raise ContentChanged(
+                                "%s changed while downloading." % self.url
+                            )
+                        if response.getcode() != 206:
+                            raise HTTPException(
+                                "Expected 206 response got %s" % response.getcode()
+                            )
+                        f.seek(offset)
+                        while offset <= end:
+                            read_size = min(self.chunk_size, end - offset + 1)
+                            chunk = response.read(read_size)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            offset += len(chunk)
+                            self._progress(len(chunk))
+                    finally:
+                        response.close()
+                    if offset <= end:
+                        raise HTTPException("Connection closed before range ended")
+                except (IOError, OSError, HTTPException) as e:
+                    attempt += 1
+                    if attempt >= self.retries:
+                        raise
+                    _log.debug("Retrying %s from byte %d: %s", self.path, offset, e)
 
-    context = ssl.create_default_context(cafile=ca_certs())
-    response = urlopen(url, context=context)
-    return response
+        with self._lock:
+            self.done.add(start)
+            self.save_state()
 
 
 def json(response):
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Module manifests used to transfer only the files that changed.
+
+A manifest maps the relative path of each file in a module to a list
+containing its size, mtime and sha256 digest. The digest may be None when
+a manifest is built without hashing files.
+"""
+
+# Standard library imports
+import hashlib
+import json
+import os
+
+# Local imports
+from . import paths
+
+__all__ = [
+    "manifest_filename",
+    "hash_file",
+    "build_manifest",
+    "read_manifest",
+    "write_manifest",
+    "load_manifest",
+    "hash_manifest",
+    "diff_manifests",
+    "plan_sync",
+    "sync_manifest",
+]
+manifest_filename = ".cpenv_manifest.json"
+format_version = 1
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file's contents."""
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def build_manifest(folder, hashes=True, links=False):
+    """Build a manifest of the files in a folder.
+
+    Arguments:
+        folder (str): Folder to build a manifest for.
+        hashes (bool): Hash the contents of each file. Defaults to True.
+        links (bool): Include symlinks, see paths.list_file_stats. Defaults
+            to False.
+    """
+
+    manifest = {}
+    for rel_path, file_stat in paths.list_file_stats(folder, links):
+        if rel_path == manifest_filename:
+            continue
+        digest = hash_file(os.path.join(folder, rel_path)) if hashes else None
+        manifest[rel_path] = [file_stat.st_size, file_stat.st_mtime, digest]
+    return manifest
+
+
+def read_manifest(folder):
+    """Read the manifest file stored in a folder. Returns None if the folder
+    has no valid manifest."""
+
+    try:
+        with open(os.path.join(folder, manifest_filename), "r") as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return
+
+    if data.get("format_version") != format_version:
+        return
+
+    return data["files"]
+
+
+def write_manifest(folder, manifest):
+    """Write a manifest file to a folder."""
+
+    data = json.dumps(
+        {"format_version": format_version, "files": manifest},
+        separators=(",", ":"),
+    )
+    paths.atomic_write(os.path.join(folder, manifest_filename), data)
+
+
+def load_manifest(folder, links=False):
+    """Return a manifest of a folder's current contents.
+
+    Digests are reused from the folder's manifest file for files whose size
+    and mtime still match, other files are not hashed.
+
+    Arguments:
+        folder (str): Folder to load a manifest for.
+        links (bool): Include symlinks, see paths.list_file_stats. Defaults
+            to False.
+    """
+
+    recorded = read_manifest(folder) or {}
+    manifest = build_manifest(folder, hashes=False, links=links)
+    for rel_path, entry in manifest.items():
+        recorded_entry = recorded.get(rel_path)
+        if recorded_entry and recorded_entry[:2] == entry[:2]:
+            entry[2] = recorded_entry[2]
+    return manifest
+
+
+def hash_manifest(folder, manifest):
+    """Hash the files in a manifest that have no digest yet."""
+
+    for rel_path, entry in manifest.items():
+        if not entry[2]:
+            entry[2] = hash_file(os.path.join(folder, rel_path))
+    return manifest
+
+
+def diff_manifests(src, dst):
+    """Compare two manifests.
+
+    Files are compared by digest when both manifests have one, otherwise by
+    size and mtime.
+
+    Returns:
+        (changed, removed) - Paths in src that are new or differ from dst, and
+        paths in dst that are not in src.
+    """
+
+    changed = []
+    for rel_path, (size, mtime, digest) in src.items():
+        entry = dst.get(rel_path)
+        if entry is None:
+            changed.append(rel_path)
+        elif digest and entry[2]:
+            if digest != entry[2] or size != entry[0]:
+                changed.append(rel_path)
+        elif size != entry[0] or mtime != entry[1]:
+            changed.append(rel_path)
+
+    removed = [rel_path for rel_path in dst if rel_path not in src]
+    return sorted(changed), sorted(removed)
+
+
+def plan_sync(src_manifest, dst):
+    """Plan the transfer of files in src_manifest to the folder dst.
+
+    Symlinks in dst, like those of a symlink-tree, are compared by the file
+    they point to. Broken symlinks are replaced or removed.
+
+    Returns:
+        (files, removed, dst_manifest) - (relative path, size) tuples of files
+        to copy, as accepted by paths.copy_tree, relative paths to remove from
+        dst, and the current manifest of dst.
+    """
+
+    if os.path.isdir(dst):
+        dst_manifest = load_manifest(dst, links=True)
+        changed, removed = diff_manifests(src_manifest, dst_manifest)
+    else:
+        dst_manifest = {}
+        changed, removed = sorted(src_manifest), []
+
+    files = [(rel_path, src_manifest[rel_path][0]) for rel_path in changed]
+    return files, removed, dst_manifest
+
+
+def sync_manifest(src_manifest, dst, dst_manifest, copied):
+    """Return the manifest of dst once the files in copied were transferred.
+
+    Copied files record their mtime in dst rather than in the source. They
+    differ when files are linked to a shared object, like the objects of an
+    ObjectStore, so the next load_manifest of dst can still reuse digests.
+
+    Arguments:
+        src_manifest (dict): Manifest of the source folder.
+        dst (str): Destination folder.
+        dst_manifest (dict): Manifest of dst before the transfer.
+        copied (set): Relative paths of the files copied to dst.
+    """
+
+    manifest = {}
+    for rel_path, (size, mtime, digest) in src_manifest.items():
+        entry = dst_manifest.get(rel_path)
+        if rel_path in copied or entry is None:
+            mtime = os.path.getmtime(os.path.join(dst, rel_path))
+            manifest[rel_path] = [size, mtime, digest]
+        else:
+            manifest[rel_path] = [entry[0], entry[1], entry[2] or digest]
+    return manifest
@@ -2,20 +2,34 @@
 from __future__ import absolute_import, print_function
 
 # Standard library imports
+import hashlib
+import marshal
 import os
+import re
 import sys
+import threading
+from bisect import bisect_left
 from collections import namedtuple
+from functools import partial
 from string import Template
 
 # Local imports
 from . import compat, paths
 from .hooks import HookFinder, get_global_hook_path
 from .vendor import yaml
-from .versions import ParseError, Version, default_version, parse_version
+from .vendor.cachetools import LRUCache, cached
+from .versions import (
+    ParseError,
+    Version,
+    default_version,
+    parse_constraint,
+    parse_version,
+)
 
 __all__ = [
     "Module",
     "ModuleSpec",
+    "VersionIndex",
 ]
 
 
@@ -31,12 +45,38 @@ module_header = """
 """
 
 
-ModuleSpec = namedtuple(
+ModuleSpecBase = namedtuple(
     "ModuleSpec",
     ["name", "qual_name", "version", "path", "repo"],
 )
 
 
+class ModuleSpec(ModuleSpecBase):
+    """Describes a Module in a Repo.
+
+    Repos can list many thousands of ModuleSpecs, and list the same modules
+    again each time their cache is refreshed. Names and paths are interned,
+    so ModuleSpecs of the same module share their strings.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, name, qual_name, version, path, repo):
+        if isinstance(name, str):
+            name = compat.intern(name)
+        if isinstance(path, str):
+            path = compat.intern(path)
+
+        return super(ModuleSpec, cls).__new__(
+            cls,
+            name,
+            qual_name,
+            version,
+            path,
+            repo,
+        )
+
+
 class Module(object):
     def __init__(self, path, name=None, version=None, repo=None):
 
@@ -48,12 +88,9 @@ class Module(object):
         else:
             self.repo = repo
 
-        # Create HookFinder for this module
+        # HookFinder for this module is created on first use
         self.hook_path = self.relative_path("hooks")
-        self.hook_finder = HookFinder(
-            self.hook_path,
-            get_global_hook_path(),
-        )
+        self._hook_finder = None
 
         # Setup config
         self.config_path = self.relative_path("module.yml")
@@ -75,19 +112,11 @@ class Module(object):
 
         else:
 
-            # Check config
-            if self.exists:
-                name = self.config.get("name", None)
-                version = self.config.get("version", None)
-                if version:
-                    version = parse_version(version)
-
-            # Last resort parse module path
-            if name is None or version is None:
-                name, version = parse_module_path(self.path)
-
-            self.name = name
-            self.version = version
+            # Read from config, last resort parse module path
+            self.name, self.version = read_module_header(
+                self.path,
+                self.config_vars,
+            )
 
         self.qual_name = self.name + "-" + self.version.string
 
@@ -135,6 +164,13 @@ class Module(object):
 
         return paths.normalize(self.path, *args)
 
+    @property
+    def hook_finder(self):
+        if self._hook_finder is None:
+            self._hook_finder = HookFinder(self.hook_path, get_global_hook_path())
+
+        return self._hook_finder
+
     def run_hook(self, hook_name):
         """Run a module hook by name, fallback to global hook location."""
 
@@ -186,15 +222,7 @@ class Module(object):
     def config(self):
         if self._config is None:
 
-            if not self.raw_config:
-                self._config = {}
-                return self._config
-
-            self._config = read_config(
-                self.config_path,
-                self.config_vars,
-                self._raw_config,
-            )
+            self._config = read_config(self.config_path, self.config_vars) or {}
 
         return self._config
 
@@ -220,7 +248,7 @@ class Module(object):
 
     @property
     def requires(self):
-        return self.config.get("email", [])
+        return self.config.get("requires") or []
 
     @property
     def icon(self):
@@ -231,6 +259,10 @@ class Module(object):
         return os.path.isfile(self.icon)
 
 
+_config_cache = LRUCache(maxsize=4096)
+_config_cache_lock = threading.Lock()
+
+
 def read_raw_config(module_file):
     """'Read the raw text data of a module.yml file"""
 
@@ -239,7 +271,15 @@ def read_raw_config(module_file):
 
 
 def read_config(module_file, config_vars=None, data=None):
-    """Read and formats a module.yml file"""
+    """Read and formats a module.yml file
+
+    Parsed configs are cached by the path, mtime and size of module_file and
+    the config_vars used to format it. When $CPENV_CONFIG_CACHE is set, they
+    are also cached on disk in $CPENV_HOME/cache/configs so new processes can
+    skip parsing YAML. Each call returns a new copy of the config.
+
+    The cache is not used when data is provided.
+    """
 
     if config_vars is None:
         config_vars = {
@@ -248,17 +288,188 @@ def read_config(module_file, config_vars=None, data=None):
             "PYVER": sys.version[:3],
         }
 
-    if data is None:
-        with open(module_file, "r") as f:
+    if data is not None:
+        return load_config(Template(data).safe_substitute(config_vars))
+
+    stat = os.stat(module_file)
+    key = (
+        module_file,
+        stat.st_mtime,
+        stat.st_size,
+        tuple(sorted(config_vars.items())),
+    )
+    with _config_cache_lock:
+        marshalled = _config_cache.get(key)
+
+    if marshalled is None:
+        marshalled = _read_config_cache_file(key)
+
+        if marshalled is None:
+            with open(module_file, "r") as f:
+                data = f.read()
+            config = load_config(Template(data).safe_substitute(config_vars))
+            try:
+                marshalled = marshal.dumps(config)
+            except ValueError:
+                # Values like dates can not be marshalled
+                return config
+            _write_config_cache_file(key, marshalled)
+
+        with _config_cache_lock:
+            _config_cache[key] = marshalled
+
+    return marshal.loads(marshalled)
+
+
+_safe_load = None
+
+
+def load_config(data):
+    """Parse the YAML data of a module.yml file.
+
+    Uses the host PyYAML's LibYAML based CSafeLoader when it is available,
+    falling back to the vendored yaml.safe_load. The host's PyYAML is used as
+    a whole, its C parser is not compatible with the vendored constructors.
+    """
+
+    global _safe_load
+    if _safe_load is None:
+        try:
+            import yaml as host_yaml
+
+            _safe_load = partial(host_yaml.load, Loader=host_yaml.CSafeLoader)
+        except (ImportError, AttributeError):
+            _safe_load = yaml.safe_load
+    return _safe_load(data)
+
+
+def _get_config_cache_file(key):
+    """Returns the path of the on-disk cache file for a read_config key or
+    None when the on-disk cache is disabled."""
+
+    if not os.getenv("CPENV_CONFIG_CACHE"):
+        return
+
+    from .api import get_cache_path
+
+    # Marshal's format is specific to the python version
+    module_file, _, _, config_vars = key
+    name = repr((module_file, config_vars, sys.version_info[:2], marshal.version))
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+    return get_cache_path("configs", digest + ".marshal")
+
+
+def _read_config_cache_file(key):
+    cache_file = _get_config_cache_file(key)
+    if not cache_file:
+        return
+
+    try:
+        with open(cache_file, "rb") as f:
+            mtime, size, marshalled = marshal.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return
+
+    if (mtime, size) == key[1:3]:
+        return marshalled
+
+
+def _write_config_cache_file(key, marshalled):
+    cache_file = _get_config_cache_file(key)
+    if not cache_file:
+        return
+
+    try:
+        paths.ensure_path_exists(os.path.dirname(cache_file))
+        paths.atomic_write(
+            cache_file,
+            marshal.dumps((key[1], key[2], marshalled)),
+            mode="wb",
+        )
+    except (IOError, OSError):
+        pass
+
+
+constraint_operator_re = re.compile(r"[<>=!~]")
+header_re = re.compile(r"^(name|version)[ \t]*:[ \t]*(.*?)[ \t]*$", re.M)
+header_quoted_re = re.compile(
+    r"""^(?:'((?:[^']|'')*)'|"([^"\\]*)")[ \t]*(?:#.*)?$"""
+)
+header_plain_indicators = "[]{}&*!|>%@`#,?:-\"'"
+header_resolver = yaml.resolver.Resolver()
+
+
+def _parse_header_value(value):
+    """Parse a scalar value of a top-level key in a module.yml file.
+
+    Returns None unless the value is a string that is safe to read without
+    a YAML parser.
+    """
+
+    if not value or "$" in value:
+        return
+
+    if value[0] in "'\"":
+        match = header_quoted_re.match(value)
+        if not match:
+            return
+        if match.group(1) is not None:
+            return match.group(1).replace("''", "'")
+        return match.group(2)
+
+    if value[0] in header_plain_indicators:
+        return
+
+    value = value.split(" #")[0].rstrip()
+    tag = header_resolver.resolve(yaml.ScalarNode, value, (True, False))
+    if tag == "tag:yaml.org,2002:str":
+        return value
+
+
+def read_module_header(module_path, config_vars=None):
+    """Return the name and version of the module at module_path.
+
+    Only the top-level name and version keys of the module's module.yml are
+    read. The whole config is parsed when their values are not simple
+    strings. Like Module, the name and version are parsed from module_path
+    when they are missing.
+    """
+
+    config_path = paths.normalize(module_path, "module.yml")
+    try:
+        with open(config_path, "r") as f:
             data = f.read()
+    except (IOError, OSError):
+        return parse_module_path(module_path)
+
+    header = {}
+    for key, value in header_re.findall(data):
+        header[key] = _parse_header_value(value)
+
+    name = header.get("name")
+    version = header.get("version")
+    if name is None or version is None:
+        config = read_config(config_path, config_vars) or {}
+        name = config.get("name", None)
+        version = config.get("version", None)
 
-    return yaml.safe_load(Template(data).safe_substitute(config_vars))
+    if version:
+        version = parse_version(version)
+
+    if name is None or version is None:
+        return parse_module_path(module_path)
+
+    return name, version
 
 
 def sort_modules(modules, reverse=False):
     """Sort a list of Modules or ModuleSpecs by version."""
 
-    return sorted(modules, key=lambda m: (m.qual_name, m.version), reverse=reverse)
+    return sorted(
+        modules,
+        key=lambda m: (m.qual_name, m.version.sort_key),
+        reverse=reverse,
+    )
 
 
 def is_module(path):
@@ -290,21 +501,33 @@ def parse_module_path(path, default_version=default_version):
     return name, version
 
 
+@cached(LRUCache(maxsize=4096))
 def parse_module_requirement(requirement, default_version=None):
-    """Given a requirement, return a name and version."""
+    """Given a requirement, return a name and version.
+
+    Requirements with a version constraint like "name>=1.2,<2" may match
+    many versions, so they are returned with the default_version. Use
+    parse_module_constraint to get their constraint.
+
+    Results are memoized as requirements are parsed repeatedly during
+    resolution.
+    """
 
     if "\\" in requirement or "/" in requirement:
         # Probably a system path - lets parse it.
         return parse_module_path(requirement, default_version=default_version)
 
+    name, constraint = parse_module_constraint(requirement)
     try:
+        if constraint:
+            raise ParseError("%s has a version constraint." % requirement)
         version = parse_version(requirement)
     except ParseError:
         if callable(default_version):
             default = default_version()
         else:
             default = default_version
-        return requirement, default
+        return name, default
 
     name = requirement
     head = requirement.replace(version.string, "")
@@ -314,16 +537,66 @@ def parse_module_requirement(requirement, default_version=None):
     return name, version
 
 
+def parse_module_constraint(requirement):
+    """Given a requirement, return a name and VersionConstraint.
+
+    Returns the requirement and None when the requirement does not have a
+    valid version constraint.
+
+    Examples:
+        >>> parse_module_constraint("name>=1.2,<2")
+        ('name', VersionConstraint('>=1.2,<2'))
+        >>> parse_module_constraint("name-1.2.0")
+        ('name-1.2.0', None)
+    """
+
+    if not constraint_operator_re.search(requirement):
+        return requirement, None
+    return _parse_module_constraint(requirement)
+
+
+@cached(LRUCache(maxsize=4096))
+def _parse_module_constraint(requirement):
+    match = constraint_operator_re.search(requirement)
+    if "\\" in requirement or "/" in requirement:
+        return requirement, None
+
+    name = requirement[: match.start()].rstrip().rstrip("-_")
+    if not name:
+        return requirement, None
+
+    try:
+        return name, parse_constraint(requirement[match.start() :])
+    except ParseError:
+        return requirement, None
+
+
 def is_exact_match(requirement, module_spec):
     """Is the module_spec an exact match for the provided requirement?"""
 
     name, version = parse_module_requirement(requirement)
+    return _is_exact_match(requirement, name, version, module_spec)
+
+
+def _is_exact_match(requirement, name, version, module_spec):
+    """Like is_exact_match but uses an already parsed name and version."""
+
     return (
         module_spec.qual_name == requirement
         or (version and module_spec.name == name and module_spec.version == version)
     )
 
 
+def has_exact_match(requirement, module_specs):
+    """Is any of the module_specs an exact match for the provided requirement?"""
+
+    name, version = parse_module_requirement(requirement)
+    for module_spec in module_specs:
+        if _is_exact_match(requirement, name, version, module_spec):
+            return True
+    return False
+
+
 def is_partial_match(requirement, module_spec):
     """Is the module_spec a partial match for the provided requirement?"""
 
@@ -333,13 +606,24 @@ def is_partial_match(requirement, module_spec):
 
 def best_match(requirement, module_specs):
 
+    name, constraint = parse_module_constraint(requirement)
+    if constraint:
+        # Highest version that satisfies the constraint
+        best_match = None
+        for module_spec in module_specs:
+            if module_spec.version in constraint and (
+                not best_match or best_match.version < module_spec.version
+            ):
+                best_match = module_spec
+        return best_match
+
     name, version = parse_module_requirement(
         requirement, Version(0, 0, 0, None, None, "*")
     )
 
     best_match = None
     for module_spec in module_specs:
-        if is_exact_match(requirement, module_spec):
+        if _is_exact_match(requirement, name, version, module_spec):
             return module_spec
         if version < module_spec.version:
             if not best_match:
@@ -349,3 +633,81 @@ def best_match(requirement, module_specs):
                 best_match = module_spec
 
     return best_match
+
+
+class VersionIndex(object):
+    """Lookup ModuleSpecs by name and version.
+
+    ModuleSpecs are grouped by name and sorted by version, so finding the
+    matches for a requirement is a dict lookup plus a bisect rather than a
+    scan over every ModuleSpec.
+
+    Arguments:
+        module_specs (list): ModuleSpecs to index.
+    """
+
+    def __init__(self, module_specs):
+        self._specs = {}
+        self._versions = {}
+        self._qual_names = {}
+
+        for module_spec in module_specs:
+            self._specs.setdefault(module_spec.name, []).append(module_spec)
+            self._qual_names.setdefault(module_spec.qual_name, []).append(module_spec)
+
+        for name, specs in self._specs.items():
+            specs.sort(key=lambda spec: spec.version.sort_key)
+            self._versions[name] = [spec.version.sort_key for spec in specs]
+
+    def get(self, name):
+        """Return all ModuleSpecs named name sorted by version."""
+
+        return list(self._specs.get(name, []))
+
+    def get_exact(self, name, version):
+        """Return the ModuleSpecs matching name and version exactly."""
+
+        versions = self._versions.get(name)
+        if not versions or not version:
+            return []
+
+        specs = self._specs[name]
+        matches = []
+        i = bisect_left(versions, version.sort_key)
+        while i < len(versions) and versions[i] == version.sort_key:
+            if specs[i].version == version:
+                matches.append(specs[i])
+            i += 1
+        return matches
+
+    def find(self, requirement):
+        """Given a requirement, return a list of ModuleSpecs that match.
+
+        Exact matches come first, followed by all other ModuleSpecs with a
+        matching name from highest to lowest version. For requirements with
+        a version constraint, only the ModuleSpecs that satisfy it are
+        returned from highest to lowest version.
+        """
+
+        name, constraint = parse_module_constraint(requirement)
+        if constraint:
+            # Only the ModuleSpecs within the constraint's bounds are checked
+            specs = self._specs.get(name, [])
+            start, stop = constraint.bounds(self._versions.get(name, []))
+            return [
+                spec
+                for spec in reversed(specs[start:stop])
+                if spec.version in constraint
+            ]
+
+        name, version = parse_module_requirement(requirement)
+
+        exact = list(self._qual_names.get(requirement, []))
+        for module_spec in self.get_exact(name, version):
+            if module_spec not in exact:
+                exact.append(module_spec)
+
+        partial = [
+            spec for spec in reversed(self._specs.get(name, [])) if spec not in exact
+        ]
+        return exact + partial
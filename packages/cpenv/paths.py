@@ -7,8 +7,21 @@ Tools for working with paths and files.
 import os
 import shutil
 import stat
+import sys
+import threading
+import time
 import zipfile
 from fnmatch import fnmatch
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request used to clone a file on linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
 
 
 def normalize(*parts):
@@ -88,6 +101,34 @@ def touch(filepath):
         os.utime(filepath, None)
 
 
+def atomic_write(filepath, data, mode="w"):
+    """Write data to a temporary file then move it into place.
+
+    Readers will either see the previous contents of filepath or the new
+    contents, never a partially written file.
+    """
+
+    # Unique to this process and thread so concurrent writers never share it
+    tmp_path = "{}.{}.{}.tmp".format(
+        filepath,
+        os.getpid(),
+        threading.current_thread().ident,
+    )
+    with open(tmp_path, mode) as f:
+        f.write(data)
+
+    try:
+        os.replace(tmp_path, filepath)
+    except AttributeError:
+        # Python 2 has no os.replace
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        os.rename(tmp_path, filepath)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
 def format_size(bytesize):
     """Human readable size."""
 
@@ -205,6 +246,268 @@ def exclusive_walk(folder, excludes=None, includes=None):
         yield root, subdirs, included_files
 
 
+def list_files(folder):
+    """List the files in a folder using exclusive_walk. Symlinks are skipped.
+
+    Returns:
+        A list of (relative path, size) tuples. Relative paths use "/".
+    """
+
+    return [(rel_path, st.st_size) for rel_path, st in list_file_stats(folder)]
+
+
+def list_file_stats(folder, links=False):
+    """Like list_files but returns the os.lstat result of each file.
+
+    Arguments:
+        folder (str): Folder to list.
+        links (bool): Include symlinks with the os.stat result of the file
+            they point to, or their own os.lstat result when they are broken.
+            Defaults to False.
+
+    Returns:
+        A list of (relative path, stat_result) tuples. Relative paths use "/".
+    """
+
+    files = []
+    for root, _, names in exclusive_walk(folder):
+        rel_root = os.path.relpath(root, folder).replace("\\", "/")
+        for name in names:
+            path = os.path.join(root, name)
+            file_stat = os.lstat(path)
+            if stat.S_ISLNK(file_stat.st_mode):
+                if not links:
+                    continue
+                try:
+                    file_stat = os.stat(path)
+                except OSError:
+                    pass
+            rel_path = name if rel_root == "." else rel_root + "/" + name
+            files.append((rel_path, file_stat))
+    return files
+
+
+def remove_empty_dirs(folder, rel_paths):
+    """Remove the directories of rel_paths within folder that are empty, and
+    their parents that become empty. folder itself is never removed."""
+
+    rel_dirs = set([os.path.dirname(rel_path) for rel_path in rel_paths])
+    for rel_dir in sorted(rel_dirs, key=len, reverse=True):
+        while rel_dir:
+            try:
+                os.rmdir(os.path.join(folder, rel_dir))
+            except OSError:
+                # Not empty or already removed
+                break
+            rel_dir = os.path.dirname(rel_dir)
+
+
+def _kernel_copy(src, dst):
+    """Copy file data using os.copy_file_range or os.sendfile.
+
+    Returns False when neither is available or supported for these files, or
+    when they could not copy the whole file.
+    """
+
+    copy_file_range = getattr(os, "copy_file_range", None)
+    sendfile = getattr(os, "sendfile", None)
+    if not copy_file_range and not sendfile:
+        return False
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(in_fd).st_size
+        for method in (copy_file_range, sendfile):
+            if method is None:
+                continue
+
+            copied = 0
+            try:
+                while copied < size:
+                    count = size - copied
+                    if method is sendfile:
+                        n = sendfile(out_fd, in_fd, copied, count)
+                    else:
+                        n = copy_file_range(in_fd, out_fd, count, copied, copied)
+                    if not n:
+                        break
+                    copied += n
+            except OSError:
+                if copied:
+                    raise
+                continue
+
+            if copied == size:
+                return True
+            if copied:
+                # The source changed size while copying, let shutil copy it
+                return False
+
+    return False
+
+
+def _remove_existing(path):
+    """Remove path so it is replaced rather than written through.
+
+    Writing to an existing hardlink or symlink would modify the file it
+    points to.
+    """
+
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def copy_file(src, dst):
+    """Copy a file and its metadata like shutil.copy2.
+
+    The data is copied in kernel space when possible which allows filesystems
+    like NFS 4.2 to perform server-side copies.
+    """
+
+    _remove_existing(dst)
+    if not _kernel_copy(src, dst):
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
+def hardlink_file(src, dst):
+    """Hardlink dst to src. Both paths must be on the same filesystem."""
+
+    _remove_existing(dst)
+    os.link(src, dst)
+
+
+def reflink_file(src, dst):
+    """Create a copy-on-write clone of src. Supported on linux filesystems
+    like btrfs and xfs."""
+
+    if fcntl is None or not hasattr(fcntl, "ioctl"):
+        raise OSError("reflinks are not supported on this platform.")
+
+    _remove_existing(dst)
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except (IOError, OSError):
+        _remove_existing(dst)
+        raise
+    shutil.copystat(src, dst)
+
+
+def symlink_file(src, dst):
+    """Symlink dst to src."""
+
+    _remove_existing(dst)
+    os.symlink(src, dst)
+
+
+def _or_copy(link_function):
+    """Wrap a link function so it falls back to copy_file when it fails."""
+
+    def link_or_copy(src, dst):
+        try:
+            link_function(src, dst)
+        except (IOError, OSError, AttributeError, NotImplementedError):
+            copy_file(src, dst)
+
+    return link_or_copy
+
+
+copy_functions = {
+    "copy": copy_file,
+    "hardlink": _or_copy(hardlink_file),
+    "reflink": _or_copy(reflink_file),
+    "symlink-tree": _or_copy(symlink_file),
+}
+
+
+def get_copy_function(mode):
+    """Return the function used to place files for a copy mode.
+
+    Modes:
+        copy: Copy files.
+        hardlink: Hardlink files, falls back to copy per file.
+        reflink: Copy-on-write clone files, falls back to copy per file.
+        symlink-tree: Create real directories containing symlinks to files,
+            falls back to copy per file.
+    """
+
+    try:
+        return copy_functions[mode]
+    except KeyError:
+        raise ValueError(
+            "Invalid copy mode %r expected one of %s"
+            % (mode, ", ".join(sorted(copy_functions)))
+        )
+
+
+def copy_tree(
+    src,
+    dst,
+    files=None,
+    progress_cb=None,
+    max_workers=None,
+    copy_function=copy_file,
+):
+    """Copy the files in src to dst using a pool of threads.
+
+    All destination directories are created up front, then files are copied
+    concurrently using copy_function.
+
+    Arguments:
+        src (str): Folder to copy.
+        dst (str): Destination folder.
+        files (list): (relative path, size) tuples from list_files. Defaults
+            to all files in src.
+        progress_cb (callable): Called with the size of each copied file.
+        max_workers (int): Number of threads used to copy files. Defaults to
+            $CPENV_COPY_WORKERS or 8.
+        copy_function (callable): Called with src and dst paths of each file.
+            See get_copy_function. Defaults to copy_file.
+
+    Returns:
+        Total number of bytes copied.
+    """
+
+    if files is None:
+        files = list_files(src)
+
+    if max_workers is None:
+        max_workers = int(os.getenv("CPENV_COPY_WORKERS", 8))
+
+    dst_dirs = set([os.path.dirname(os.path.join(dst, rel)) for rel, _ in files])
+    for dst_dir in sorted(dst_dirs):
+        ensure_path_exists(dst_dir)
+
+    def copy_one(item):
+        rel_path, size = item
+        copy_function(os.path.join(src, rel_path), os.path.join(dst, rel_path))
+        return size
+
+    workers = min(max_workers, len(files))
+    if workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            sizes = pool.imap_unordered(copy_one, files, chunksize=16)
+            total = 0
+            for size in sizes:
+                total += size
+                if progress_cb:
+                    progress_cb(size)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        total = 0
+        for item in files:
+            size = copy_one(item)
+            total += size
+            if progress_cb:
+                progress_cb(size)
+
+    return total
+
+
 def get_folder_info(folder):
     """Get info about a folder and it's contents.
 
@@ -228,18 +531,262 @@ def get_folder_info(folder):
     return info
 
 
-def zip_folder_from_info(info, where, progress_cb=None):
-    """Zips a folder using info provided by `get_folder_info`."""
+def _zip_member_path(filename, where):
+    """Return the path a zip member should be extracted to.
+
+    Like ZipFile.extract, absolute paths, drive letters and ".." components
+    are removed so members can not be written outside of where.
+    """
+
+    filename = os.path.splitdrive(filename.replace("\\", "/"))[1]
+    parts = [p for p in filename.split("/") if p not in ("", ".", "..")]
+    return os.path.join(where, *parts)
+
+
+def extract_zip(archive, where, max_workers=None, progress_cb=None):
+    """Extract a zip archive using a pool of threads.
+
+    The directory tree is created up front, then members are decompressed
+    concurrently. Each thread reads from its own ZipFile handle. Unix file
+    modes stored in the archive are restored.
+
+    Arguments:
+        archive (str): Path to zip archive.
+        where (str): Folder to extract the archive to.
+        max_workers (int): Number of threads used to extract members.
+            Defaults to $CPENV_EXTRACT_WORKERS or the number of cpus up to 8.
+        progress_cb (callable): Called with the size of each extracted file.
+
+    Returns:
+        Total number of bytes extracted.
+    """
+
+    if max_workers is None:
+        max_workers = int(os.getenv("CPENV_EXTRACT_WORKERS", min(cpu_count(), 8)))
+
+    with zipfile.ZipFile(archive) as zip_file:
+        members = zip_file.infolist()
+
+    dirs = set([where])
+    files = []
+    for info in members:
+        path = _zip_member_path(info.filename, where)
+        if info.filename.endswith("/"):
+            dirs.add(path)
+        else:
+            dirs.add(os.path.dirname(path))
+            files.append((info, path))
+
+    for folder in sorted(dirs):
+        ensure_path_exists(folder)
+
+    # Start with the largest members so one big file does not finish last
+    files.sort(key=lambda item: item[0].file_size, reverse=True)
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract_one(item):
+        info, path = item
+        zip_file = getattr(local, "zip_file", None)
+        if zip_file is None:
+            zip_file = local.zip_file = zipfile.ZipFile(archive)
+            with handles_lock:
+                handles.append(zip_file)
+
+        with zip_file.open(info) as src, open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+
+        mode = (info.external_attr >> 16) & 0o7777
+        if mode:
+            os.chmod(path, mode)
+        return info.file_size
+
+    try:
+        workers = min(max_workers, len(files))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                sizes = pool.imap_unordered(extract_one, files)
+                total = 0
+                for size in sizes:
+                    total += size
+                    if progress_cb:
+                        progress_cb(size)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            total = 0
+            for item in files:
+                size = extract_one(item)
+                total += size
+                if progress_cb:
+                    progress_cb(size)
+    finally:
+        for zip_file in handles:
+            zip_file.close()
+
+    return total
+
+
+# Files that are already compressed or compress poorly. These are stored in
+# module archives as is instead of being deflated.
+store_only_patterns = [
+    "*.so",
+    "*.so.*",
+    "*.whl",
+    "*.egg",
+    "*.jar",
+    "*.zip",
+    "*.gz",
+    "*.tgz",
+    "*.bz2",
+    "*.xz",
+    "*.zst",
+    "*.7z",
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+]
+
+
+def _zip_info(path, arcname):
+    """Create a ZipInfo for a file like ZipFile.write does."""
+
+    st = os.stat(path)
+    arcname = os.path.normpath(os.path.splitdrive(arcname)[1])
+    while arcname[0] in (os.sep, os.altsep):
+        arcname = arcname[1:]
+
+    date_time = time.localtime(st.st_mtime)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+
+    zinfo = zipfile.ZipInfo(arcname, date_time)
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+def _read_zip_member(path, arcname, store, read_size):
+    """Prepare a file to be added to a zip archive.
+
+    Files up to read_size bytes are read into memory, larger files are
+    streamed from their path when the member is written.
+
+    Returns:
+        (ZipInfo, bytes or None)
+    """
+
+    zinfo = _zip_info(path, arcname)
+    zinfo.compress_type = zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED
+    if zinfo.file_size > read_size:
+        return zinfo, None
+
+    with open(path, "rb") as f:
+        return zinfo, f.read()
+
+
+def _write_zip_member(zip_file, zinfo, data, path, level):
+    """Add a member prepared by _read_zip_member to an open ZipFile."""
+
+    kwargs = {}
+    if sys.version_info >= (3, 7):
+        kwargs["compresslevel"] = level
+
+    if data is None:
+        zip_file.write(path, zinfo.filename, zinfo.compress_type, **kwargs)
+    else:
+        zip_file.writestr(zinfo, data, **kwargs)
+
+
+def zip_folder_from_info(
+    info,
+    where,
+    progress_cb=None,
+    max_workers=None,
+    store_patterns=None,
+    level=6,
+    read_size=1024 * 1024,
+):
+    """Zips a folder using info provided by `get_folder_info`.
+
+    Files are read concurrently by a pool of threads while the main thread
+    compresses them and adds them to the archive. zlib releases the GIL, so
+    reading and compressing overlap.
+
+    Arguments:
+        info (dict): Folder info from get_folder_info.
+        where (str): Path of the zip archive to create.
+        progress_cb (callable): Called with 1 for each file added.
+        max_workers (int): Number of threads used to read files.
+            Defaults to $CPENV_ZIP_WORKERS or the number of cpus up to 8.
+        store_patterns (list): Glob patterns of file names stored without
+            compression. Defaults to store_only_patterns. Use ["*"] to store
+            all files.
+        level (int): zlib compression level. Only used on python 3.7+.
+        read_size (int): Files up to this size are read ahead by the pool,
+            larger files are read by the main thread while it compresses them.
+    """
 
     parent = os.path.dirname(where)
     if not os.path.isdir(parent):
         os.makedirs(parent)
 
+    if max_workers is None:
+        max_workers = int(os.getenv("CPENV_ZIP_WORKERS", min(cpu_count(), 8)))
+
+    if store_patterns is None:
+        store_patterns = store_only_patterns
+    is_stored = exclude_patterns(store_patterns)
+
+    # Limit the number of members waiting to be written. When writing fails,
+    # aborted is set and each waiting thread passes the semaphore on to the
+    # next so the pool can be joined.
+    pending = threading.Semaphore(max_workers * 4)
+    aborted = []
+
+    def read_one(item):
+        full_path, rel_path = item
+        pending.acquire()
+        if aborted:
+            pending.release()
+            return
+        try:
+            store = is_stored(os.path.basename(full_path))
+            zinfo, data = _read_zip_member(full_path, rel_path, store, read_size)
+        except Exception:
+            pending.release()
+            raise
+        return zinfo, data, full_path
+
+    def write_members(zip_file, members):
+        try:
+            for zinfo, data, full_path in members:
+                _write_zip_member(zip_file, zinfo, data, full_path, level)
+                pending.release()
+                if progress_cb:
+                    progress_cb(1)
+        except BaseException:
+            aborted.append(True)
+            pending.release()
+            raise
+
     with zipfile.ZipFile(where, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for full_path, rel_path in info["files"]:
-            zip_file.write(full_path, arcname=rel_path)
-            if progress_cb:
-                progress_cb(1)
+        workers = min(max_workers, len(info["files"]))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                members = pool.imap_unordered(read_one, info["files"])
+                write_members(zip_file, members)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            members = (read_one(item) for item in info["files"])
+            write_members(zip_file, members)
 
 
 def zip_folder(folder, where):
@@ -1,13 +1,49 @@
+# Standard library imports
+from importlib import import_module
+
 # Local imports
+from .. import compat
 from .base import Repo
 from .filesystem import LocalRepo, RemoteRepo
-from .shotgun import ShotgunRepo
 
-registry = {
-    LocalRepo.type_name: LocalRepo,
-    RemoteRepo.type_name: RemoteRepo,
-    ShotgunRepo.type_name: ShotgunRepo,
-}
+
+class RepoRegistry(dict):
+    """Maps Repo type names to Repo classes.
+
+    Values may also be "module:ClassName" strings naming a Repo class in a
+    cpenv.repos submodule. The submodule is only imported when the type is
+    looked up, so processes that never create a Repo of that type do not
+    import its dependencies.
+    """
+
+    def __getitem__(self, type_name):
+        repo_cls = dict.__getitem__(self, type_name)
+        if isinstance(repo_cls, compat.string_types):
+            module_name, cls_name = repo_cls.split(":")
+            module = import_module("." + module_name, __name__)
+            repo_cls = getattr(module, cls_name)
+            self[type_name] = repo_cls
+        return repo_cls
+
+    def get(self, type_name, default=None):
+        if type_name in self:
+            return self[type_name]
+        return default
+
+    def values(self):
+        return [self[type_name] for type_name in self]
+
+    def items(self):
+        return [(type_name, self[type_name]) for type_name in self]
+
+
+registry = RepoRegistry(
+    [
+        (LocalRepo.type_name, LocalRepo),
+        (RemoteRepo.type_name, RemoteRepo),
+        ("shotgun", "shotgun:ShotgunRepo"),
+    ]
+)
 
 
 def register_type(repo_cls):
@@ -17,3 +53,14 @@ def register_type(repo_cls):
 
 def unregister_type(repo_cls):
     registry.pop(repo_cls.type_name, None)
+
+
+def __getattr__(name):
+    # Lazily import ShotgunRepo and its vendored shotgun_api3 dependency
+    if name == "ShotgunRepo":
+        return registry["shotgun"]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+if not compat.has_module_getattr:
+    from .shotgun import ShotgunRepo
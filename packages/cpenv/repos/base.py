@@ -37,6 +37,18 @@ class Repo(object):
 
         return NotImplemented
 
+    def find_many(self, requirements):
+        """Given a list of requirements, return a dict mapping each requirement
+        to a list of ModuleSpecs that match, like find.
+
+        Remote repos should override this to lookup all of the requirements
+        in as few requests as possible.
+        """
+
+        return dict(
+            [(requirement, self.find(requirement)) for requirement in requirements]
+        )
+
     def list(self):
         """Return a list of ModuleSpecs in this Repo."""
 
@@ -73,6 +85,16 @@ class Repo(object):
 
         return {}
 
+    def get_requires(self, module_spec):
+        """Given a module_spec, return the list of requirements of the Module.
+
+        Used by the Resolver to resolve requirements transitively. Repos
+        should override this when they can provide requirements without
+        fetching all of a Module's data.
+        """
+
+        return (self.get_data(module_spec) or {}).get("requires", [])
+
     def get_size(self, module_spec):
         """Given a module_spec, return the size of a module in the repo.
 
@@ -1,21 +1,31 @@
 # -*- coding: utf-8 -*-
 
 # Standard library imports
+import hashlib
 import logging
 import os
-import shutil
+import re
+import threading
 from fnmatch import fnmatch
 from functools import partial
 from glob import glob
 
 # Local imports
-from .. import compat, paths
+from .. import compat, manifest, paths
 from ..environment import Environment
-from ..module import Module, is_exact_match, is_partial_match, sort_modules
+from ..module import (
+    Module,
+    ModuleSpec,
+    VersionIndex,
+    read_module_header,
+    sort_modules,
+)
 from ..reporter import get_reporter
+from ..store import ObjectStore
 from ..vendor import yaml
 from ..vendor.cachetools import TTLCache, cachedmethod, keys
 from .base import Repo
+from .index import RepoIndex
 
 _log = logging.getLogger(__name__)
 
@@ -38,89 +48,215 @@ class LocalRepo(Repo):
             precedence over higher priority. Defaults to 10.
         nested (bool): When True the Repository will use the Nested hierarchy. Defaults
             to False.
+        index (bool): When True the Repository will persist an index of its modules
+            to $CPENV_HOME/cache/indexes so that listing the repo in new processes
+            only needs to parse new or modified modules. Defaults to False.
+        localize_mode (str): How files are placed when modules are downloaded from
+            this Repository. One of copy, hardlink, reflink, symlink-tree or cas. Links
+            are only possible when the destination is on the same filesystem, each
+            file falls back to a copy otherwise. Hardlinked and symlinked files are
+            shared with the Repository, so they must not be modified in place. The
+            cas mode stores each unique file once in $CPENV_HOME/cache/objects and
+            hardlinks downloaded modules to it, use "cpenv prune" to remove files
+            that are no longer used. Modules downloaded from other types of
+            Repositories, like ShotgunRepo, are extracted without using the store.
+            Defaults to $CPENV_LOCALIZE_MODE or copy.
     """
 
     type_name = "local"
     priority = 10
 
-    def __init__(self, name, path, priority=None, nested=None):
+    def __init__(
+        self,
+        name,
+        path,
+        priority=None,
+        nested=None,
+        index=None,
+        localize_mode=None,
+    ):
         super(LocalRepo, self).__init__(name, priority)
         self.path = paths.normalize(path)
-        self.cache = TTLCache(maxsize=10, ttl=60)
+        # Leave room for many find results so list and lookup aren't evicted.
+        self.cache = TTLCache(maxsize=128, ttl=60)
+        self._lock = threading.RLock()
 
         self.nested = nested
         if nested is None:
             self.nested = bool(os.getenv("CPENV_LOCALREPO_NESTED", False))
 
+        if index is None:
+            index = bool(os.getenv("CPENV_LOCALREPO_INDEX", False))
+        index_path = None
+        if index:
+            from ..api import get_cache_path
+
+            # Stored per user rather than in the repo, which may be shared
+            # or read-only.
+            digest = hashlib.sha1(self.path.encode("utf-8")).hexdigest()[:12]
+            index_path = get_cache_path(
+                "indexes",
+                "%s_%s.json" % (re.sub(r"[^\w.-]", "_", self.name), digest),
+            )
+        self.index = RepoIndex(self.path, index_path)
+
+        self.localize_mode = localize_mode or os.getenv("CPENV_LOCALIZE_MODE", "copy")
+        if self.localize_mode != "cas":
+            paths.get_copy_function(self.localize_mode)
+
     def relative_path(self, *parts):
         return paths.normalize(self.path, *parts)
 
     def clear_cache(self):
-        self.cache.clear()
-
-    @cachedmethod(lambda self: self.cache, key=partial(keys.hashkey, "find"))
+        with self._lock:
+            self.cache.clear()
+
+    @cachedmethod(
+        lambda self: self.cache,
+        key=partial(keys.hashkey, "find"),
+        lock=lambda self: self._lock,
+    )
     def find(self, requirement):
-        matches = []
-        for module_spec in self.list():
-            if is_exact_match(requirement, module_spec):
-                matches.insert(0, module_spec)
-                continue
-            if is_partial_match(requirement, module_spec):
-                matches.append(module_spec)
-
-        return matches
-
-    @cachedmethod(lambda self: self.cache, key=partial(keys.hashkey, "list"))
+        return self.lookup().find(requirement)
+
+    @cachedmethod(
+        lambda self: self.cache,
+        key=partial(keys.hashkey, "lookup"),
+        lock=lambda self: self._lock,
+    )
+    def lookup(self):
+        """Return a VersionIndex of the ModuleSpecs in this repo.
+
+        Rebuilt once each time the results of list are refreshed.
+        """
+
+        return VersionIndex(self.list())
+
+    @cachedmethod(
+        lambda self: self.cache,
+        key=partial(keys.hashkey, "list"),
+        lock=lambda self: self._lock,
+    )
     def list(self):
         module_specs = []
 
-        # Find flat module_specs
-        for module_file in glob(self.relative_path("*", "module.yml")):
-            module_path = paths.parent(module_file)
-            module = Module(module_path, repo=self)
-            module_specs.append(module.to_spec())
-
-        # Find nested module_specs
-        versions = glob(self.relative_path("*", "*", "module.yml"))
-        for version_file in versions:
-            version_dir = paths.parent(version_file)
-            module = Module(version_dir, repo=self)
-            module_specs.append(module.to_spec())
+        # Find flat and nested module_specs - only new or modified modules
+        # are read, the rest come from the repo's index.
+        with self._lock:
+            entries = self.index.update(self._read_module)
+        for rel_path, entry in entries.items():
+            module_specs.append(
+                ModuleSpec(
+                    name=entry["name"],
+                    qual_name=entry["qual_name"],
+                    version=self.index.to_version(entry),
+                    path=self.path + "/" + rel_path,
+                    repo=self,
+                )
+            )
 
         return sort_modules(module_specs, reverse=True)
 
+    def _read_module(self, module_path):
+        return read_module_header(module_path)
+
+    def get_copy_function(self, digests=None):
+        """Return the function used to place files when downloading modules.
+
+        Arguments:
+            digests (dict): Known sha256 digests of source files by path. Used
+                to skip reading files that are already in the object store.
+        """
+
+        if self.localize_mode == "cas":
+            from ..api import get_cache_path
+
+            store = ObjectStore(get_cache_path("objects"))
+            digests = digests or {}
+
+            def copy_to_store(src, dst):
+                store.copy_file(src, dst, digests.get(src))
+
+            return copy_to_store
+
+        return paths.get_copy_function(self.localize_mode)
+
+    def _sync(
+        self,
+        src,
+        dst,
+        src_manifest,
+        dst_manifest,
+        files,
+        removed,
+        progress_cb,
+        copy_function,
+    ):
+        """Apply a sync planned by manifest.plan_sync.
+
+        Files that are no longer part of the module are removed, along with
+        directories they leave empty, and the manifest is written to dst once
+        all files are in place.
+        """
+
+        for rel_path in removed:
+            os.remove(os.path.join(dst, rel_path))
+        paths.remove_empty_dirs(dst, removed)
+
+        paths.copy_tree(
+            src,
+            dst,
+            files,
+            progress_cb,
+            copy_function=copy_function,
+        )
+        manifest.write_manifest(
+            dst,
+            manifest.sync_manifest(
+                src_manifest,
+                dst,
+                dst_manifest,
+                set([rel_path for rel_path, _ in files]),
+            ),
+        )
+
     def download(self, module_spec, where, overwrite=False):
-        if os.path.isdir(where):
-            if not overwrite:
-                raise OSError("%s already exists..." % where)
-            else:
-                paths.rmtree(where)
+        if os.path.isdir(where) and not overwrite:
+            raise OSError("%s already exists..." % where)
 
         src = module_spec.path
         dst = where
+        src_manifest = manifest.load_manifest(src)
+        if self.localize_mode == "cas":
+            # Files linked to stored objects do not keep the mtime of their
+            # source, so they are compared to the source by digest.
+            src_manifest = manifest.hash_manifest(src, src_manifest)
+        digests = dict(
+            [
+                (os.path.join(src, rel_path), entry[2])
+                for rel_path, entry in src_manifest.items()
+                if entry[2]
+            ]
+        )
+        files, removed, dst_manifest = manifest.plan_sync(src_manifest, dst)
 
         reporter = get_reporter()
         progress_bar = reporter.progress_bar(
             label="Download %s" % module_spec.name,
-            max_size=self.get_size(module_spec),
+            max_size=sum([size for _, size in files]),
             data={"module_spec": module_spec},
         )
         with progress_bar as progress_bar:
-            for root, _, files in paths.exclusive_walk(src):
-                for file in files:
-                    src_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(src_path, src)
-                    dst_path = os.path.join(dst, rel_path)
-
-                    if os.path.islink(src_path):
-                        continue
-
-                    dst_dir = os.path.dirname(dst_path)
-                    if not os.path.isdir(dst_dir):
-                        os.makedirs(dst_dir)
-
-                    shutil.copy2(src_path, dst_path)
-                    progress_bar.update(os.path.getsize(src_path))
+            self._sync(
+                src,
+                dst,
+                src_manifest,
+                dst_manifest,
+                files,
+                removed,
+                progress_bar.update,
+                self.get_copy_function(digests),
+            )
 
             module = Module(where)
             progress_bar.update(
@@ -145,37 +281,31 @@ class LocalRepo(Repo):
         else:
             new_module_path = self.relative_path(module.qual_name)
 
-        if os.path.isdir(new_module_path):
-            if overwrite:
-                paths.rmtree(new_module_path)
-            else:
-                raise OSError("Module already exists in repo...")
+        if os.path.isdir(new_module_path) and not overwrite:
+            raise OSError("Module already exists in repo...")
 
         src = module.path
         dst = new_module_path
+        src_manifest = manifest.hash_manifest(src, manifest.load_manifest(src))
+        files, removed, dst_manifest = manifest.plan_sync(src_manifest, dst)
 
         reporter = get_reporter()
         progress_bar = reporter.progress_bar(
             label="Upload %s" % module.name,
-            max_size=self.get_size(module),
+            max_size=sum([size for _, size in files]),
             data={"module": module, "to_repo": self},
         )
         with progress_bar as progress_bar:
-            for root, _, files in paths.exclusive_walk(src):
-                for file in files:
-                    src_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(src_path, src)
-                    dst_path = os.path.join(dst, rel_path)
-
-                    if os.path.islink(src_path):
-                        continue
-
-                    dst_dir = os.path.dirname(dst_path)
-                    if not os.path.isdir(dst_dir):
-                        os.makedirs(dst_dir)
-
-                    shutil.copy2(src_path, dst_path)
-                    progress_bar.update(os.path.getsize(src_path))
+            self._sync(
+                src,
+                dst,
+                src_manifest,
+                dst_manifest,
+                files,
+                removed,
+                progress_bar.update,
+                paths.copy_file,
+            )
 
             module_spec = Module(new_module_path).to_spec()
             progress_bar.update(
@@ -208,6 +338,11 @@ class LocalRepo(Repo):
         module = Module(module_spec.path)
         return yaml.safe_load(module.raw_config)
 
+    def get_requires(self, module_spec):
+        """Read a modules requirements from its cached config."""
+
+        return Module.from_spec(module_spec).requires
+
     def get_size(self, module_spec):
         """Sums the size of all files in the modules directory."""
 
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import json
+import logging
+import os
+
+# Local imports
+from .. import paths
+from ..versions import Version
+
+_log = logging.getLogger(__name__)
+
+
+class RepoIndex(object):
+    """An index of the modules stored in a LocalRepo folder.
+
+    The index stores the name, version and qual_name of each module along with
+    the mtime and size of its module.yml file. Directory mtimes are stored
+    so that unchanged directories do not need to be listed again. When
+    rescanning, only new or modified module.yml files are parsed.
+
+    The index can optionally be persisted to a json file so that new
+    processes can load it in a single read.
+
+    Arguments:
+        root (str): Path to the repo folder.
+        path (str): Path of the index file. The index is only kept in memory
+            when None. Defaults to None.
+    """
+
+    format_version = 1
+
+    def __init__(self, root, path=None):
+        self.root = root
+        self.path = path
+        self.persist = path is not None
+        self.dirs = {}
+        self.modules = {}
+        self._file_mtime = None
+
+    def load(self):
+        """Load the index file if it was modified since it was last loaded."""
+
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+
+        if mtime == self._file_mtime:
+            return
+
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            _log.debug("Failed to read index %s: %s", self.path, e)
+            return
+
+        if data.get("format_version") != self.format_version:
+            return
+
+        self.dirs = data["dirs"]
+        self.modules = data["modules"]
+        self._file_mtime = mtime
+
+    def save(self):
+        """Write the index file. Failures are logged and otherwise ignored."""
+
+        data = json.dumps(
+            {
+                "format_version": self.format_version,
+                "dirs": self.dirs,
+                "modules": self.modules,
+            },
+            separators=(",", ":"),
+        )
+        try:
+            paths.ensure_path_exists(os.path.dirname(self.path))
+            paths.atomic_write(self.path, data)
+            self._file_mtime = os.path.getmtime(self.path)
+        except (IOError, OSError) as e:
+            _log.debug("Failed to write index %s: %s", self.path, e)
+
+    def _listdir(self, rel_dir):
+        """List the children of a directory, reusing the previous listing when
+        the directory's mtime is unchanged."""
+
+        dir_path = os.path.join(self.root, rel_dir)
+        try:
+            mtime = os.stat(dir_path).st_mtime
+        except OSError:
+            return None, False
+
+        cached = self.dirs.get(rel_dir)
+        if cached and cached[0] == mtime:
+            return cached[1], False
+
+        try:
+            children = sorted(
+                [name for name in os.listdir(dir_path) if not name.startswith(".")]
+            )
+        except OSError:
+            return None, False
+
+        self.dirs[rel_dir] = [mtime, children]
+        return children, True
+
+    def _update_module(self, rel_path, modules, read_module):
+        """Add the module at rel_path to modules, reading it only if its
+        module.yml file changed. Returns True if the entry was (re)read."""
+
+        module_path = paths.normalize(self.root, rel_path)
+        try:
+            stat = os.stat(os.path.join(module_path, "module.yml"))
+        except OSError:
+            return False
+
+        entry = self.modules.get(rel_path)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            modules[rel_path] = entry
+            return False
+
+        name, version = read_module(module_path)
+        modules[rel_path] = {
+            "name": name,
+            "version": list(version),
+            "qual_name": name + "-" + version.string,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+        }
+        return True
+
+    def update(self, read_module):
+        """Rescan the repo folder and return the updated module entries.
+
+        Arguments:
+            read_module (callable): Called with the path of a new or modified
+                module. Must return a (name, Version) tuple.
+
+        Returns:
+            dict mapping module paths relative to root to index entries.
+        """
+
+        if self.persist:
+            self.load()
+
+        changed = False
+        modules = {}
+        dirs = {}
+
+        children, listed = self._listdir("")
+        changed = changed or listed
+        if children is not None:
+            dirs[""] = self.dirs[""]
+
+        for child in children or []:
+            # Flat hierarchy <root>/<name>-<version>/module.yml
+            changed = self._update_module(child, modules, read_module) or changed
+
+            # Nested hierarchy <root>/<name>/<version>/module.yml
+            grandchildren, listed = self._listdir(child)
+            changed = changed or listed
+            if grandchildren is None:
+                continue
+
+            dirs[child] = self.dirs[child]
+            for grandchild in grandchildren:
+                rel_path = child + "/" + grandchild
+                changed = self._update_module(rel_path, modules, read_module) or changed
+
+        changed = changed or len(modules) != len(self.modules)
+        self.dirs = dirs
+        self.modules = modules
+
+        if changed and self.persist:
+            self.save()
+
+        return modules
+
+    def to_version(self, entry):
+        """Return the Version of an index entry."""
+
+        return Version(*entry["version"])
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# Standard library imports
+import calendar
+import datetime
+import json
+import logging
+import os
+import time
+
+# Local imports
+from .. import paths
+
+_log = logging.getLogger(__name__)
+
+
+class ShotgunMirror(object):
+    """An on-disk mirror of a ShotgunRepo's Module entities.
+
+    The mirror stores the code, version, id, archive size and updated_at of
+    each Module entity in a json file. At most once every interval seconds
+    the mirror is refreshed by querying only the entities updated since the
+    newest updated_at it has seen, and the entities retired since then. A
+    full sync is made every full_sync_interval seconds to reconcile anything
+    a delta query could miss.
+
+    The file is shared by all processes on a machine, so most processes can
+    serve lookups without querying ShotGrid at all. When a refresh fails the
+    previous contents of the mirror are used.
+
+    Arguments:
+        path (str): Path to the mirror json file.
+        module_entity (str): Name of the Module entity.
+        interval (int): Seconds between delta refreshes. Defaults to 60.
+        full_sync_interval (int): Seconds between full syncs. Defaults to 3600.
+    """
+
+    format_version = 1
+    fields = ["code", "sg_version", "sg_archive_size", "updated_at"]
+
+    # Overlap delta queries to catch entities updated within the same second
+    # as the newest entity seen by the previous query.
+    overlap = 1
+
+    def __init__(self, path, module_entity, interval=60, full_sync_interval=3600):
+        self.path = path
+        self.module_entity = module_entity
+        self.interval = interval
+        self.full_sync_interval = full_sync_interval
+        self.entities = {}
+        self.updated_at = 0
+        self.checked_at = 0
+        self.full_synced_at = 0
+        self._file_mtime = None
+
+    def load(self):
+        """Load the mirror file if it was modified since it was last loaded."""
+
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+
+        if mtime == self._file_mtime:
+            return
+
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            _log.debug("Failed to read mirror %s: %s", self.path, e)
+            return
+
+        if data.get("format_version") != self.format_version:
+            return
+
+        self.entities = data["entities"]
+        self.updated_at = data["updated_at"]
+        self.checked_at = data["checked_at"]
+        self.full_synced_at = data["full_synced_at"]
+        self._file_mtime = mtime
+
+    def save(self):
+        """Write the mirror file. Failures are logged and otherwise ignored."""
+
+        data = json.dumps(
+            {
+                "format_version": self.format_version,
+                "entities": self.entities,
+                "updated_at": self.updated_at,
+                "checked_at": self.checked_at,
+                "full_synced_at": self.full_synced_at,
+            },
+            separators=(",", ":"),
+        )
+        try:
+            paths.ensure_path_exists(os.path.dirname(self.path))
+            paths.atomic_write(self.path, data)
+            self._file_mtime = os.path.getmtime(self.path)
+        except (IOError, OSError) as e:
+            _log.debug("Failed to write mirror %s: %s", self.path, e)
+
+    def invalidate(self):
+        """Refresh the mirror on the next call to update."""
+
+        self.checked_at = 0
+
+    def _add_entity(self, entity):
+        updated_at = to_timestamp(entity["updated_at"])
+        self.entities[str(entity["id"])] = {
+            "id": entity["id"],
+            "code": entity["code"],
+            "sg_version": entity["sg_version"],
+            "sg_archive_size": entity["sg_archive_size"],
+            "updated_at": updated_at,
+        }
+        self.updated_at = max(self.updated_at, updated_at)
+
+    def full_sync(self, shotgun):
+        """Replace the contents of the mirror with all Module entities."""
+
+        entities = shotgun.find(self.module_entity, filters=[], fields=self.fields)
+        self.entities = {}
+        self.updated_at = 0
+        for entity in entities:
+            self._add_entity(entity)
+        self.full_synced_at = time.time()
+
+    def delta_sync(self, shotgun):
+        """Update the mirror with entities updated or retired since the last
+        sync."""
+
+        filters = [
+            [
+                "updated_at",
+                "greater_than",
+                to_datetime(self.updated_at - self.overlap),
+            ],
+        ]
+        for entity in shotgun.find(self.module_entity, filters, self.fields):
+            self._add_entity(entity)
+
+        retired = shotgun.find(self.module_entity, filters, ["id"], retired_only=True)
+        for entity in retired:
+            self.entities.pop(str(entity["id"]), None)
+
+    def update(self, shotgun):
+        """Refresh the mirror if it is older than interval seconds.
+
+        Returns:
+            dict mapping entity ids to entities.
+        """
+
+        self.load()
+
+        now = time.time()
+        if now - self.checked_at < self.interval:
+            return self.entities
+
+        full_sync_due = now - self.full_synced_at >= self.full_sync_interval
+        try:
+            if not self.entities or full_sync_due:
+                self.full_sync(shotgun)
+            else:
+                self.delta_sync(shotgun)
+        except Exception as e:
+            if not self.full_synced_at:
+                raise
+            _log.warning("Failed to refresh mirror %s: %s", self.path, e)
+            return self.entities
+
+        self.checked_at = now
+        self.save()
+        return self.entities
+
+
+def to_timestamp(value):
+    """Convert a datetime returned by the ShotGrid api to a unix timestamp."""
+
+    if value is None:
+        return 0
+    if value.tzinfo is not None:
+        return calendar.timegm(value.utctimetuple())
+    return time.mktime(value.timetuple())
+
+
+def to_datetime(timestamp):
+    """Convert a unix timestamp to a datetime for use in ShotGrid filters."""
+
+    return datetime.datetime.fromtimestamp(max(timestamp, 0))
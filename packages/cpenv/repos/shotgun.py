@@ -1,19 +1,28 @@
 # -*- coding: utf-8 -*-
 # Standard library imports
-import io
+import contextlib
 import os
-import zipfile
+import re
+import threading
 from functools import partial
 
 # Local imports
 from .. import http, paths
-from ..module import Module, ModuleSpec, parse_module_requirement, sort_modules
+from ..module import (
+    Module,
+    ModuleSpec,
+    parse_module_constraint,
+    parse_module_requirement,
+    sort_modules,
+)
 from ..reporter import get_reporter
 from ..vendor import yaml
 from ..vendor.cachetools import TTLCache, cachedmethod, keys
+from ..vendor.fasteners import InterProcessLock
 from ..vendor.shotgun_api3 import Shotgun
 from ..versions import parse_version
 from .base import Repo
+from .mirror import ShotgunMirror
 
 MODULE_SIZE_UNSUPPORTED = (
     "Module is too large ({}) for your ShotGrid site's configuration. Your Module "
@@ -23,10 +32,56 @@ MODULE_SIZE_UNSUPPORTED = (
 )
 
 
+_shotgun_clients = {}
+_shotgun_clients_lock = threading.Lock()
+_archive_locks = {}
+_archive_locks_lock = threading.Lock()
+
+
 class UploadError(Exception):
     pass
 
 
+class SharedShotgun(object):
+    """A Shotgun client shared by all ShotgunRepos using the same site and
+    api script, so they reuse its keep-alive connection.
+
+    The Shotgun api is not thread-safe so method calls are serialized.
+    """
+
+    def __init__(self, shotgun):
+        self._shotgun = shotgun
+        self.lock = threading.RLock()
+
+    def __getattr__(self, attr):
+        value = getattr(self._shotgun, attr)
+        if not callable(value):
+            return value
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                return value(*args, **kwargs)
+
+        return locked
+
+
+def get_shotgun(base_url, script_name, api_key):
+    """Get a SharedShotgun client for a site and api script."""
+
+    key = (base_url, script_name, api_key)
+    with _shotgun_clients_lock:
+        if key not in _shotgun_clients:
+            _shotgun_clients[key] = SharedShotgun(
+                Shotgun(
+                    base_url=base_url,
+                    script_name=script_name,
+                    api_key=api_key,
+                    ca_certs=http.ca_certs(),
+                )
+            )
+        return _shotgun_clients[key]
+
+
 class ShotgunRepo(Repo):
     """Use Shotgun's database as a Repo for modules.
 
@@ -77,6 +132,8 @@ class ShotgunRepo(Repo):
         api=None,
         module_entity="CustomNonProjectEntity01",
         priority=None,
+        mirror=None,
+        mirror_interval=60,
     ):
         super(ShotgunRepo, self).__init__(name, priority)
         if api:
@@ -84,12 +141,7 @@ class ShotgunRepo(Repo):
             # This will be done via the tk-cpenv shotgun app
             self._api = api
         else:
-            self._api = Shotgun(
-                base_url=base_url,
-                script_name=script_name,
-                api_key=api_key,
-                ca_certs=http.ca_certs(),
-            )
+            self._api = get_shotgun(base_url, script_name, api_key)
 
         self.base_url = self._api.base_url
         self.path = self._api.base_url
@@ -105,7 +157,27 @@ class ShotgunRepo(Repo):
         ]
         self.archive_fields = ["sg_archive", "sg_archive_size"]
         self._supports_large_modules = None
-        self.cache = TTLCache(maxsize=10, ttl=60)
+        self.cache = TTLCache(maxsize=128, ttl=60)
+
+        # The Shotgun api is not thread-safe. Serialize requests so modules
+        # can be downloaded concurrently by a Localizer.
+        if isinstance(self._api, SharedShotgun):
+            self._lock = self._api.lock
+        else:
+            self._lock = threading.RLock()
+
+        if mirror is None:
+            mirror = bool(os.getenv("CPENV_SHOTGUNREPO_MIRROR", False))
+        self.mirror = None
+        if mirror:
+            from .. import api
+
+            site = re.sub(r"[^\w.-]", "_", self.base_url.split("://")[-1])
+            self.mirror = ShotgunMirror(
+                api.get_cache_path("shotgun", "%s_%s.json" % (site, module_entity)),
+                module_entity,
+                interval=mirror_interval,
+            )
 
     @property
     def shotgun(self):
@@ -113,9 +185,32 @@ class ShotgunRepo(Repo):
 
     def clear_cache(self):
         self.cache.clear()
+        if self.mirror:
+            self.mirror.invalidate()
+
+    def _find_entities(self, names=None, fields=None):
+        """Find Module entities by code, or all Module entities when names is
+        None. Entities are served from the mirror when it is enabled."""
+
+        if self.mirror:
+            with self._lock:
+                entities = list(self.mirror.update(self.shotgun).values())
+            if names is not None:
+                names = set(names)
+                entities = [entity for entity in entities if entity["code"] in names]
+            return entities
+
+        return self.shotgun.find(
+            self.module_entity,
+            filters=[] if names is None else [["code", "in", names]],
+            fields=fields or self.resolve_fields,
+        )
 
     @cachedmethod(lambda self: self.cache, key=partial(keys.hashkey, "find"))
     def find(self, requirement):
+        if self.mirror:
+            return self.find_many([requirement])[requirement]
+
         name, version = parse_module_requirement(requirement)
 
         # Build filters
@@ -142,15 +237,65 @@ class ShotgunRepo(Repo):
         for entity in entities:
             module_specs.append(entity_to_module_spec(entity, self))
 
+        _, constraint = parse_module_constraint(requirement)
+        if constraint:
+            module_specs = [m for m in module_specs if m.version in constraint]
+
         return sort_modules(module_specs, reverse=True)
 
+    def find_many(self, requirements):
+        """Find ModuleSpecs for many requirements using a single query.
+
+        The archive fields of the matching entities are cached along with the
+        results so that find, get_size and download do not need to query
+        ShotGrid again for these modules.
+        """
+
+        results = {}
+        parsed = []
+        for requirement in requirements:
+            try:
+                results[requirement] = self.cache[keys.hashkey("find", requirement)]
+            except KeyError:
+                parsed.append((requirement, parse_module_requirement(requirement)))
+
+        if not parsed:
+            return results
+
+        names = sorted(set([name for _, (name, _) in parsed]))
+        entities = self._find_entities(names, self.resolve_fields + self.archive_fields)
+        module_specs = {}
+        for entity in entities:
+            module_spec = entity_to_module_spec(entity, self)
+            module_specs.setdefault(module_spec.name, []).append(module_spec)
+            if "sg_archive" in entity:
+                self.cache[keys.hashkey("archive", module_spec.qual_name)] = entity
+
+        for requirement, (name, version) in parsed:
+            matches = module_specs.get(name, [])
+
+            _, constraint = parse_module_constraint(requirement)
+            if constraint:
+                matches = [m for m in matches if m.version in constraint]
+
+            # Prefer exact matches like find
+            if version:
+                exact_matches = [
+                    module_spec
+                    for module_spec in matches
+                    if module_spec.version.string == version.string
+                ]
+                matches = exact_matches or matches
+
+            matches = sort_modules(matches, reverse=True)
+            self.cache[keys.hashkey("find", requirement)] = matches
+            results[requirement] = matches
+
+        return results
+
     @cachedmethod(lambda self: self.cache, key=partial(keys.hashkey, "list"))
     def list(self):
-        entities = self.shotgun.find(
-            self.module_entity,
-            filters=[],
-            fields=self.resolve_fields,
-        )
+        entities = self._find_entities()
         module_specs = []
         for entity in entities:
             module_specs.append(entity_to_module_spec(entity, self))
@@ -158,58 +303,63 @@ class ShotgunRepo(Repo):
         return sort_modules(module_specs, reverse=True)
 
     def download(self, module_spec, where, overwrite=False):
+        from .. import api
 
-        entity = self.shotgun.find_one(
-            self.module_entity,
-            filters=module_spec_to_filters(module_spec),
-            fields=self.archive_fields,
-        )
+        with self._lock:
+            entity = self.get_archive_entity(module_spec)
+            archive_size = self.get_size(module_spec)
         archive = entity["sg_archive"]
 
         if not archive:
             print("Module entity has no associated archive.")
             return
 
-        if os.path.isdir(where):
-            if overwrite:
-                paths.rmtree(where)
-            else:
-                raise Exception("Module already exists in download location.")
-
-        # Download archive data - we add a chunk to download_size for zip
-        # progress reporting.
-        reporter = get_reporter()
-        chunk_size = 8192
-        download_size = kb(self.get_size(module_spec))
-        progress_bar = reporter.progress_bar(
-            label="Download %s" % module_spec.name,
-            max_size=download_size,
-            data={
-                "module_spec": module_spec,
-                "unit_divisor": 1024,
-            },
-        )
-        with progress_bar as progress_bar:
-            response = http.get(archive["url"])
-            data = io.BytesIO()
-            while True:
-                chunk = response.read(chunk_size)
-                if not chunk:
-                    break
-                progress_bar.update(kb(len(chunk)))
-                data.write(chunk)
-
-            # Construct and extract in-memory zip archive
-            zip_file = zipfile.ZipFile(data)
-            zip_file.extractall(where)
-
-            module = Module(where)
-            progress_bar.update(
+        # Download archive to a file in the cache and extract it from there
+        # so memory use does not grow with the size of the module. A partial
+        # download is left in place to be resumed by the next attempt, the
+        # archive is locked so only one thread or process writes to it.
+        archive_path = api.get_cache_path("tmp", module_spec.qual_name + ".zip")
+        paths.ensure_path_exists(os.path.dirname(archive_path))
+
+        with archive_lock(archive_path):
+            if os.path.isdir(where):
+                if overwrite:
+                    paths.rmtree(where)
+                else:
+                    raise Exception("Module already exists in download location.")
+
+            reporter = get_reporter()
+            progress_bar = reporter.progress_bar(
+                label="Download %s" % module_spec.name,
+                max_size=kb(archive_size),
                 data={
                     "module_spec": module_spec,
-                    "module": module,
-                }
+                    "unit_divisor": 1024,
+                },
             )
+            with progress_bar as progress_bar:
+                http.download(
+                    archive["url"],
+                    archive_path,
+                    progress_cb=lambda size: progress_bar.update(kb(size)),
+                )
+                try:
+                    if archive_size and os.path.getsize(archive_path) != archive_size:
+                        raise Exception(
+                            "Downloaded archive size does not match %s."
+                            % module_spec.qual_name
+                        )
+                    paths.extract_zip(archive_path, where)
+                finally:
+                    os.unlink(archive_path)
+
+                module = Module(where)
+                progress_bar.update(
+                    data={
+                        "module_spec": module_spec,
+                        "module": module,
+                    }
+                )
 
         return module
 
@@ -340,6 +490,10 @@ class ShotgunRepo(Repo):
 
         return data
 
+    @cachedmethod(lambda self: self.cache, key=partial(keys.hashkey, "requires"))
+    def get_requires(self, module_spec):
+        return self.get_data(module_spec)["requires"]
+
     def get_thumbnail(self, module_spec):
         from .. import api
 
@@ -358,7 +512,15 @@ class ShotgunRepo(Repo):
         icon_path = api.get_cache_path("icons", module_spec.qual_name + "_icon.png")
         if not os.path.isfile(icon_path):
             try:
-                data = self.shotgun.download_attachment({"url": thumbnail_url})
+                session_token = self.shotgun.get_session_token()
+                response = http.get(
+                    thumbnail_url,
+                    headers={"Cookie": "_session_id=" + session_token},
+                )
+                try:
+                    data = response.read()
+                finally:
+                    response.close()
                 with open(icon_path, "wb") as f:
                     f.write(data)
             except Exception:
@@ -409,20 +571,37 @@ class ShotgunRepo(Repo):
 
         return int(value)
 
+    def get_archive_entity(self, module_spec):
+        """Return a module's entity with its archive fields. Entities are
+        cached by find_many."""
+
+        key = keys.hashkey("archive", module_spec.qual_name)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+
+        entity = self.shotgun.find_one(
+            self.module_entity,
+            filters=module_spec_to_filters(module_spec),
+            fields=self.archive_fields,
+        )
+        if entity:
+            self.cache[key] = entity
+        return entity
+
     def get_size(self, spec):
         """Query Shotgun for archive size."""
 
-        return self._decode_archive_size(
-            self.shotgun.find_one(
-                self.module_entity,
-                filters=[
-                    ["code", "is", spec.name],
-                    ["sg_version", "is", spec.version.string],
-                ],
-                fields=["sg_archive_size"],
-            )["sg_archive_size"]
-            or 0
-        )
+        entity = None
+        if self.mirror:
+            for mirrored_entity in self._find_entities([spec.name]):
+                if mirrored_entity["sg_version"] == spec.version.string:
+                    entity = mirrored_entity
+                    break
+
+        entity = entity or self.get_archive_entity(spec)
+        return self._decode_archive_size(entity["sg_archive_size"] or 0)
 
 
 def entity_to_module_spec(entity, repo):
@@ -466,6 +645,19 @@ def module_to_entity(module, **fields):
     return fields
 
 
+@contextlib.contextmanager
+def archive_lock(archive_path):
+    """Lock archive_path against other threads and processes.
+
+    InterProcessLock alone does not exclude threads of the same process.
+    """
+
+    with _archive_locks_lock:
+        thread_lock = _archive_locks.setdefault(archive_path, threading.Lock())
+    with thread_lock, InterProcessLock(archive_path + ".lock"):
+        yield
+
+
 def kb(bytes):
     """Convert bytes value to kilobytes."""
 
@@ -4,10 +4,21 @@
 import contextlib
 import os
 import shlex
+from collections import OrderedDict
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 # Local imports
 from . import mappings, paths
-from .module import Module, best_match, is_exact_match, is_module
+from .module import (
+    Module,
+    best_match,
+    has_exact_match,
+    is_exact_match,
+    is_module,
+    parse_module_constraint,
+    parse_module_requirement,
+)
 from .reporter import get_reporter
 from .repos import LocalRepo
 from .vendor.fasteners import InterProcessLock
@@ -21,6 +32,8 @@ __all__ = [
     "module_resolvers",
     "is_redirecting",
     "redirect_to_modules",
+    "satisfies",
+    "sort_dependencies",
     "parse_redirect",
 ]
 
@@ -43,12 +56,23 @@ class Resolver(object):
     If there are still unresolved modules, fallback to the old algorithm
     for module lookups using the resolve functions in the
     cpenv.resolver.module_resolvers list.
+
+    When transitive is True the requirements of resolved modules are
+    resolved as well, see resolve_requires. Defaults to
+    $CPENV_RESOLVE_REQUIRES or False.
     """
 
-    def __init__(self, repos):
+    # Maximum number of times resolve_requires chooses versions
+    max_passes = 50
+
+    def __init__(self, repos, transitive=None):
         self.repos = repos
         self.reporter = get_reporter()
 
+        if transitive is None:
+            transitive = bool(os.getenv("CPENV_RESOLVE_REQUIRES", False))
+        self.transitive = transitive
+
     def resolve(self, requirements, ignore_unresolved=False):
         """Given a list of requirement strings, resolve ModuleSpecs.
 
@@ -65,31 +89,31 @@ class Resolver(object):
 
         # Try the old resolution alogirthm for backwards compatability
         resolved.extend(old_resolve_algorithm(self, unresolved))
+        requested = [(spec.qual_name, spec) for spec in resolved]
 
-        for requirement in list(unresolved):
+        for requirement in unresolved:
             self.reporter.find_requirement(requirement)
-            # TODO: handle more complex requirements.
-            #       possibly use the new resolvelib being developed by pypa
-
-            match_gen = (
-                module_spec
-                for repo in self.repos
-                for module_spec in repo.find(requirement)
-            )
 
+        candidates = {}
+        self.find_candidates(unresolved, candidates)
+        for requirement in list(unresolved):
             # best_match returns the first ModuleSpec that matches
             # both name and version or the ModuleSpec with the
             # highest version > the required version
-            match = best_match(requirement, match_gen)
+            match = best_match(requirement, candidates[requirement])
             if match:
                 self.reporter.resolve_requirement(requirement, match)
                 unresolved.remove(requirement)
                 resolved.append(match)
+                requested.append((requirement, match))
             else:
                 # TODO: once old resolve algorithm is removed
                 # report a module resolution failure here.
                 pass
 
+        if self.transitive and (ignore_unresolved or not unresolved):
+            resolved = self.resolve_requires(requested, unresolved, candidates)
+
         self.reporter.end_resolve(resolved, unresolved)
 
         if unresolved and not ignore_unresolved:
@@ -97,6 +121,362 @@ class Resolver(object):
 
         return resolved
 
+    def find_candidates(self, requirements, candidates):
+        """Find the ModuleSpecs matching each requirement not already in
+        candidates.
+
+        Lookup all requirements in each repo at once so remote repos can
+        batch their queries. Like best_match, stop looking in lower priority
+        repos once a requirement has an exact match.
+
+        Arguments:
+            requirements (list): Requirements to lookup.
+            candidates (dict): Maps requirements to lists of ModuleSpecs in
+                repo order. Updated in place.
+        """
+
+        remaining = [r for r in unique(requirements) if r not in candidates]
+        for requirement in remaining:
+            candidates[requirement] = []
+
+        last_repo = self.repos[-1] if self.repos else None
+        for repo in self.repos:
+            if not remaining:
+                break
+
+            results = repo.find_many(remaining)
+            for requirement in list(remaining):
+                module_specs = results.get(requirement, [])
+                candidates[requirement].extend(module_specs)
+
+            # Exact matches only matter when there are more repos to search
+            if repo is last_repo:
+                break
+
+            for requirement in list(remaining):
+                if has_exact_match(requirement, results.get(requirement, [])):
+                    remaining.remove(requirement)
+
+    def resolve_requires(self, requested, unresolved=None, candidates=None):
+        """Resolve the requirements of requested modules recursively.
+
+        Every requirement of a module name is collected, then the highest
+        version that satisfies all of them is chosen. Choosing a different
+        version changes which requirements are collected, so this is
+        repeated until the chosen versions stop changing.
+
+        Requirements are collected level by level so each level is looked
+        up in a single batch, and each module's requirements are read once.
+
+        Arguments:
+            requested (list): (requirement, ModuleSpec) tuples resolved from
+                the requested requirements.
+            unresolved (list): Unresolved requirements are appended to this.
+            candidates (dict): ModuleSpecs already found for requirements,
+                see find_candidates.
+
+        Returns:
+            One ModuleSpec for each module name ordered so that modules come
+            after the modules they require.
+
+        Raises:
+            ResolveError when requirements conflict or are cyclic.
+        """
+
+        if unresolved is None:
+            unresolved = []
+        if candidates is None:
+            candidates = {}
+        for requirement, module_spec in requested:
+            candidates.setdefault(requirement, [module_spec])
+
+        requires = {}
+        matches = {}
+        checked = {}
+        chosen = {}
+        for _ in range(self.max_passes):
+            result = self._collect_requires(
+                requested,
+                chosen,
+                candidates,
+                requires,
+                matches,
+                checked,
+            )
+            constraints, used, graph, missing = result
+
+            selected = {}
+            conflicts = []
+            for name, name_constraints in constraints.items():
+                selected[name] = self._select(
+                    name_constraints,
+                    candidates,
+                    matches,
+                    checked,
+                )
+                if selected[name] is None:
+                    conflicts.append(name)
+                    selected[name] = used[name]
+
+            if selected != used:
+                chosen = selected
+                continue
+
+            if conflicts:
+                raise ResolveError(self._format_conflict(constraints[conflicts[0]]))
+            break
+        else:
+            raise ResolveError(
+                "Could not find compatible versions in %d passes." % self.max_passes
+            )
+
+        for requirement in missing:
+            if requirement not in unresolved:
+                unresolved.append(requirement)
+
+        for requirement, module_spec in requested:
+            if used[module_spec.name] != module_spec:
+                # Another version was chosen to satisfy other requirements
+                self.reporter.resolve_requirement(requirement, used[module_spec.name])
+
+        for name, name_constraints in constraints.items():
+            for requirement, parent in name_constraints:
+                if parent is not None:
+                    self.reporter.find_requirement(requirement)
+                    self.reporter.resolve_requirement(requirement, used[name])
+
+        top_level = [module_spec.name for _, module_spec in requested]
+
+        return sort_dependencies(unique([used[name] for name in top_level]), graph)
+
+    def _collect_requires(
+        self,
+        requested,
+        chosen,
+        candidates,
+        requires,
+        matches,
+        checked,
+    ):
+        """Walk the requirements of the requested modules breadth first.
+
+        The ModuleSpec used for each name is chosen[name], or for names not
+        in chosen, the best ModuleSpec for the requirements collected before
+        the name was first reached.
+
+        requires, matches and checked store the requirements of ModuleSpecs,
+        the best match of requirements and the results of satisfies so they
+        are computed once per resolve.
+
+        Returns:
+            (constraints, used, graph, missing) where constraints maps names
+            to lists of (requirement, parent ModuleSpec) tuples, used maps
+            names to the ModuleSpec used, graph maps ModuleSpecs to the
+            ModuleSpecs they require and missing lists requirements without
+            any candidates.
+        """
+
+        constraints = OrderedDict()
+        used = {}
+        graph = {}
+        missing = []
+
+        level = []
+        for requirement, module_spec in requested:
+            constraints.setdefault(module_spec.name, []).append((requirement, None))
+            level.append(module_spec.name)
+
+        while level:
+            level_specs = []
+            for name in unique(level):
+                module_spec = chosen.get(name)
+                if module_spec is None:
+                    module_spec = self._select(
+                        constraints[name],
+                        candidates,
+                        matches,
+                        checked,
+                    )
+                if module_spec is None:
+                    # Conflicting requirements, use the first requirement
+                    # and report the conflict once all have been collected
+                    requirement = constraints[name][0][0]
+                    module_spec = best_match(requirement, candidates[requirement])
+                used[name] = module_spec
+                level_specs.append(module_spec)
+                if module_spec not in requires:
+                    requires[module_spec] = get_requires(module_spec)
+
+            self.find_candidates(
+                [r for spec in level_specs for r in requires[spec]],
+                candidates,
+            )
+
+            next_level = []
+            for module_spec in level_specs:
+                graph[module_spec] = []
+                for requirement in requires[module_spec]:
+                    if requirement not in matches:
+                        matches[requirement] = best_match(
+                            requirement,
+                            candidates[requirement],
+                        )
+                    match = matches[requirement]
+                    if not match:
+                        missing.append(requirement)
+                        continue
+
+                    constraints.setdefault(match.name, []).append(
+                        (requirement, module_spec)
+                    )
+                    if match.name not in used:
+                        next_level.append(match.name)
+                    graph[module_spec].append(match.name)
+            level = [name for name in unique(next_level) if name not in used]
+
+        for module_spec, names in graph.items():
+            graph[module_spec] = unique([used[name] for name in names])
+        return constraints, used, graph, missing
+
+    def _select(self, constraints, candidates, matches, checked):
+        """Return the highest ModuleSpec satisfying all constraints, or None.
+
+        ModuleSpecs found earlier are preferred when versions are equal.
+        See _collect_requires for matches and checked.
+        """
+
+        if len(constraints) == 1:
+            # The best match is the highest ModuleSpec satisfying requirement
+            requirement = constraints[0][0]
+            if requirement not in matches:
+                matches[requirement] = best_match(requirement, candidates[requirement])
+            return matches[requirement]
+
+        module_specs = unique(
+            [spec for requirement, _ in constraints for spec in candidates[requirement]]
+        )
+        module_specs.sort(key=lambda spec: spec.version.sort_key, reverse=True)
+
+        for module_spec in module_specs:
+            for requirement, _ in constraints:
+                key = (requirement, module_spec)
+                if key not in checked:
+                    checked[key] = satisfies(
+                        requirement,
+                        module_spec,
+                        candidates[requirement],
+                    )
+                if not checked[key]:
+                    break
+            else:
+                return module_spec
+
+    def _format_conflict(self, constraints):
+        return "Conflicting requirements: " + ", ".join(
+            [
+                "%s requires %s"
+                % (parent.qual_name if parent else "<requirements>", requirement)
+                for requirement, parent in constraints
+            ]
+        )
+
+
+def get_requires(module_spec):
+    """Return the requirements of a ModuleSpec."""
+
+    if module_spec.repo is None:
+        return Module.from_spec(module_spec).requires
+    return module_spec.repo.get_requires(module_spec)
+
+
+def satisfies(requirement, module_spec, candidates=None):
+    """Check if module_spec's version satisfies a requirement.
+
+    Like best_match, requirements without a version are satisfied by any
+    version. Requirements with a version are satisfied by that exact version
+    when it is available, otherwise by any higher version. Requirements with
+    a version constraint are satisfied by any version within it.
+
+    Names are not compared, module_spec should be a match for requirement.
+
+    Arguments:
+        requirement (str): Requirement to check.
+        module_spec (ModuleSpec): ModuleSpec to check.
+        candidates (list): ModuleSpecs found for requirement, used to check
+            if an exact version is available.
+    """
+
+    _, constraint = parse_module_constraint(requirement)
+    if constraint:
+        return module_spec.version in constraint
+
+    if is_exact_match(requirement, module_spec):
+        return True
+
+    if has_exact_match(requirement, candidates or []):
+        return False
+
+    _, version = parse_module_requirement(requirement)
+    return not version or version < module_spec.version
+
+
+def sort_dependencies(module_specs, graph):
+    """Order module_specs and the modules they require so that modules come
+    after the modules they require.
+
+    Arguments:
+        module_specs (list): ModuleSpecs in the order they were requested.
+        graph (dict): Maps ModuleSpecs to the ModuleSpecs they require.
+
+    Raises:
+        ResolveError when the requirements are cyclic.
+    """
+
+    ordered = []
+    visited = set()
+    for module_spec in module_specs:
+        if module_spec in visited:
+            continue
+
+        # Iterative depth first search, stack holds (module_spec, requires)
+        # for each module_spec on the current path.
+        visiting = set([module_spec])
+        stack = [(module_spec, iter(graph.get(module_spec, [])))]
+        visited.add(module_spec)
+        while stack:
+            parent, requires = stack[-1]
+            for required in requires:
+                if required in visiting:
+                    path = [spec for spec, _ in stack]
+                    cycle = path[path.index(required) :] + [required]
+                    raise ResolveError(
+                        "Cyclic requirements: "
+                        + " -> ".join([spec.qual_name for spec in cycle])
+                    )
+                if required not in visited:
+                    visited.add(required)
+                    visiting.add(required)
+                    stack.append((required, iter(graph.get(required, []))))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(parent)
+                ordered.append(parent)
+
+    return ordered
+
+
+def unique(items):
+    """Return items without duplicates, preserving their order."""
+
+    seen = set()
+    results = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            results.append(item)
+    return results
+
 
 class Activator(object):
     """Responsible for activating modules."""
@@ -147,7 +527,7 @@ class Copier(object):
             with ModuleInterProcessLock(self.to_repo, module_spec):
 
                 # Check if module_spec can be resolved in to_repo
-                if self._is_in_repo(module_spec):
+                if self._is_in_repo(module_spec, overwrite):
                     continue
 
                 # Get local module or download module from repo
@@ -189,9 +569,14 @@ class Localizer(object):
     This is similar to a copy operation, but skips all module_specs that are
     already in LocalRepos. If they are in LocalRepos then they are already
     available to be activated.
+
+    Arguments:
+        to_repo (str or LocalRepo): Repo to localize modules to.
+        max_workers (int): Number of modules to localize concurrently.
+            Defaults to $CPENV_LOCALIZE_WORKERS or 1.
     """
 
-    def __init__(self, to_repo="home"):
+    def __init__(self, to_repo="home", max_workers=None):
         from .api import get_repo
 
         self.to_repo = get_repo(to_repo)
@@ -200,6 +585,10 @@ class Localizer(object):
         if not isinstance(self.to_repo, LocalRepo):
             raise ValueError("Localizer expected LocalRepo got %s" % type(to_repo))
 
+        if max_workers is None:
+            max_workers = int(os.getenv("CPENV_LOCALIZE_WORKERS", 1))
+        self.max_workers = max(1, max_workers)
+
     def _resolve_local_module(self, module_spec, overwrite=False):
         """Resolves the module_spec as a Module object in a LocalRepo if one exists."""
 
@@ -213,37 +602,53 @@ class Localizer(object):
             if is_exact_match(module_spec.qual_name, match) and not overwrite:
                 return Module(match.path)
 
-    def localize(self, module_specs, overwrite=False):
-        """Given ModuleSpecs, download them to this Localizers repo."""
-
-        self.reporter.start_localize(module_specs)
-        localized = []
-        for module_spec in module_specs:
-            self.reporter.localize_module(module_spec, None)
+    def _localize_module(self, module_spec, overwrite=False):
+        """Download a single ModuleSpec to this Localizers repo."""
 
-            with ModuleInterProcessLock(self.to_repo, module_spec):
+        self.reporter.localize_module(module_spec, None)
 
-                # Resolve the module_spec in a LocalRepo if possible. Any repo will do.
-                module = self._resolve_local_module(module_spec, overwrite)
-                if module:
-                    localized.append(module)
-                    continue
+        with ModuleInterProcessLock(self.to_repo, module_spec):
 
-                # Generate a new module path in to_repo
-                if self.to_repo.nested:
-                    new_module_path = self.to_repo.relative_path(
-                        module_spec.name,
-                        module_spec.version.string,
-                    )
-                else:
-                    new_module_path = self.to_repo.relative_path(module_spec.qual_name)
+            # Resolve the module_spec in a LocalRepo if possible. Any repo will do.
+            module = self._resolve_local_module(module_spec, overwrite)
+            if module:
+                return module
 
-                module = module_spec.repo.download(
-                    module_spec,
-                    where=new_module_path,
-                    overwrite=overwrite,
+            # Generate a new module path in to_repo
+            if self.to_repo.nested:
+                new_module_path = self.to_repo.relative_path(
+                    module_spec.name,
+                    module_spec.version.string,
                 )
-                localized.append(module)
+            else:
+                new_module_path = self.to_repo.relative_path(module_spec.qual_name)
+
+            return module_spec.repo.download(
+                module_spec,
+                where=new_module_path,
+                overwrite=overwrite,
+            )
+
+    def localize(self, module_specs, overwrite=False):
+        """Given ModuleSpecs, download them to this Localizers repo.
+
+        When max_workers is greater than 1 modules are localized concurrently.
+        The returned Modules are always in the same order as module_specs.
+        """
+
+        self.reporter.start_localize(module_specs)
+
+        localize_module = partial(self._localize_module, overwrite=overwrite)
+        workers = min(self.max_workers, len(module_specs))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            try:
+                localized = pool.map(localize_module, module_specs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            localized = [localize_module(spec) for spec in module_specs]
 
         self.reporter.end_localize(localized)
 
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Content addressable storage for module files.
+"""
+
+# Standard library imports
+import hashlib
+import os
+import shutil
+import stat
+import uuid
+
+# Local imports
+from . import paths
+
+__all__ = [
+    "ObjectStore",
+]
+
+
+class ObjectStore(object):
+    """Stores each unique file once, keyed by the hash of its contents.
+
+    Objects are stored at <root>/<digest[:2]>/<digest[2:]>. Executable files
+    are stored separately from identical non-executable files by appending
+    ".x" to their key because hardlinks share permissions.
+
+    Files are materialized from the store using hardlinks so modules that
+    share most of their files, like consecutive versions of a module, only
+    store the files that changed. Materialized files must not be modified in
+    place as that would modify the stored object. Objects remain in the store
+    after the files linked to them are removed until prune is called, see
+    "cpenv prune".
+
+    The store is used by LocalRepos with the cas localize_mode. Archives
+    downloaded from a ShotgunRepo are extracted without it.
+
+    Arguments:
+        root (str): Path to the store. Usually cpenv.get_cache_path("objects").
+    """
+
+    def __init__(self, root):
+        self.root = paths.normalize(root)
+
+    def __repr__(self):
+        return "<{}>(root={!r})".format(type(self).__name__, self.root)
+
+    def object_key(self, digest, mode=0):
+        """Return the key of an object given its digest and file mode."""
+
+        if mode & (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH):
+            return digest + ".x"
+        return digest
+
+    def object_path(self, key):
+        """Return the path to an object in the store."""
+
+        return paths.normalize(self.root, key[:2], key[2:])
+
+    def has(self, key):
+        """Returns True if the object is in the store."""
+
+        return os.path.isfile(self.object_path(key))
+
+    def add(self, path, digest=None):
+        """Add a file to the store and return its key.
+
+        The file is hashed while it is copied so it is only read once. When
+        the digest is already known and the object is in the store the file
+        is not read at all.
+        """
+
+        mode = os.stat(path).st_mode
+        if digest and self.has(self.object_key(digest, mode)):
+            return self.object_key(digest, mode)
+
+        paths.ensure_path_exists(self.root)
+        tmp_name = "tmp-%s-%s" % (os.getpid(), uuid.uuid4().hex)
+        tmp_path = paths.normalize(self.root, tmp_name)
+        hasher = hashlib.sha256()
+        try:
+            with open(path, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+                while True:
+                    chunk = fsrc.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    fdst.write(chunk)
+            shutil.copystat(path, tmp_path)
+
+            key = self.object_key(hasher.hexdigest(), mode)
+            object_path = self.object_path(key)
+            if os.path.isfile(object_path):
+                os.remove(tmp_path)
+            else:
+                paths.ensure_path_exists(os.path.dirname(object_path))
+                try:
+                    os.rename(tmp_path, object_path)
+                except OSError:
+                    # Another process added the same object first
+                    if not os.path.isfile(object_path):
+                        raise
+                    os.remove(tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return key
+
+    def materialize(self, key, dst):
+        """Place an object at dst using a hardlink, falling back to a copy."""
+
+        object_path = self.object_path(key)
+        try:
+            paths.hardlink_file(object_path, dst)
+        except (IOError, OSError):
+            paths.copy_file(object_path, dst)
+
+    def copy_file(self, src, dst, digest=None):
+        """Add src to the store and materialize it at dst.
+
+        Can be used as the copy_function of paths.copy_tree.
+        """
+
+        self.materialize(self.add(src, digest), dst)
+
+    def prune(self):
+        """Remove objects that are no longer used by any materialized file.
+
+        Returns:
+            Number of objects removed.
+        """
+
+        removed = 0
+        for root, _, files in os.walk(self.root):
+            for file in files:
+                if file.startswith("tmp-"):
+                    continue
+                path = os.path.join(root, file)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+        return removed
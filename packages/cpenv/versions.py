@@ -2,16 +2,20 @@
 
 # Standard library imports
 import re
+from bisect import bisect_left, bisect_right
 from collections import namedtuple
 from functools import total_ordering
 
 # Local imports
 from . import compat
+from .vendor.cachetools import LRUCache, cached
 
 __all__ = [
     "ParseError",
     "Version",
+    "VersionConstraint",
     "parse_version",
+    "parse_constraint",
     "default_version",
 ]
 
@@ -40,6 +44,14 @@ semver_version_pattern = (
     r"(?:\+(?P<buildmetadata>[0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?$"
 )
 simplever_pattern = r"(?:v)?(?P<version>(\d+\.?)+)$"
+
+# Compiled patterns in the order they are tried by parse_version
+nuke_version_re = re.compile(nuke_version_pattern)
+four_version_re = re.compile(four_version_pattern)
+semver_version_re = re.compile(semver_version_pattern)
+simplever_re = re.compile(simplever_pattern)
+constraint_re = re.compile(r"^\s*(?P<op>~=|==|!=|<=|>=|<|>)\s*(?P<version>\S+?)\s*$")
+release_re = re.compile(r"^v?(?P<release>\d+(?:\.\d+)*)")
 VersionBase = namedtuple(
     "Version", ["major", "minor", "patch", "prerelease", "buildmetadata", "string"]
 )
@@ -47,6 +59,13 @@ VersionBase = namedtuple(
 
 @total_ordering
 class Version(VersionBase):
+    """A parsed version.
+
+    Equal Versions usually share a single instance, and each instance
+    computes its sort_key once when it's created. Repos contain many modules
+    with the same versions, so this keeps large listings small and cheap to
+    sort. At most _interned_maxsize Versions are kept for sharing.
+    """
 
     _defaults = {
         "major": 0,
@@ -55,6 +74,31 @@ class Version(VersionBase):
         "prerelease": None,
         "buildmetadata": None,
     }
+    _interned = {}
+    _interned_maxsize = 16384
+
+    def __new__(cls, major, minor, patch, prerelease, buildmetadata, string):
+        fields = (major, minor, patch, prerelease, buildmetadata, string)
+        key = (cls,) + fields
+        version = cls._interned.get(key)
+        if version is None:
+            version = super(Version, cls).__new__(cls, *fields)
+            version._sort_key = (
+                major,
+                minor,
+                patch,
+                cls._comparable_value(prerelease),
+                cls._comparable_value(buildmetadata),
+            )
+            if len(cls._interned) >= cls._interned_maxsize:
+                cls._interned.clear()
+            version = cls._interned.setdefault(key, version)
+        return version
+
+    @classmethod
+    def _make(cls, iterable):
+        # namedtuple's _make and _replace skip __new__
+        return cls(*iterable)
 
     def __str__(self):
         return self.string
@@ -62,56 +106,53 @@ class Version(VersionBase):
     def __hash__(self):
         return super(Version, self).__hash__()
 
-    def _comparable_value(self, value, other):
-        """Return a value that will be comparable with other."""
+    @staticmethod
+    def _comparable_value(value):
+        """Return a value that will be comparable with any other value.
 
-        types_match = type(value) is type(other)
-        if types_match or isinstance(value, compat.numeric_types):
-            return value
-
-        if other is None:
-            return value
+        Strings sort before None and None sorts before numbers.
+        """
 
-        if value is None and isinstance(other, compat.string_types):
-            return "zzzzzzzz"
+        if value is None:
+            return (1, 0)
 
-        if isinstance(other, compat.numeric_types):
-            return -float("inf")
+        if isinstance(value, compat.numeric_types):
+            return (2, value)
 
-        return value
+        return (0, value)
 
-    def _comparable(self, other):
-        """Generate a comparison key for a Version object.
+    @property
+    def sort_key(self):
+        """A comparison key for this Version object.
 
         Coerces types of prerelease and buildmeta to ensure that the Version
         objects are comparable. This is required because Python 3 now raises
         a TypeError when attempting to compare str and int.
         """
-        return (
-            self.major,
-            self.minor,
-            self.patch,
-            self._comparable_value(self.prerelease, other.prerelease),
-            self._comparable_value(self.buildmetadata, other.buildmetadata),
-        )
+
+        return self._sort_key
+
+    def _comparable(self, other=None):
+        return self._sort_key
 
     def __lt__(self, other):
         if not isinstance(other, Version):
             raise ValueError("Can only compare two Version objects.")
 
-        return self._comparable(other) < other._comparable(self)
+        return self._sort_key < other._sort_key
 
     def __eq__(self, other):
         if not isinstance(other, Version):
             raise ValueError("Can only compare two Version objects.")
 
-        return tuple(other) == tuple(self)
+        return self is other or tuple.__eq__(self, other)
 
 
 class ParseError(Exception):
     """Raised when a parse method fails."""
 
 
+@cached(LRUCache(maxsize=4096))
 def parse_version(string):
     """Parse and return a Version from the provided string.
 
@@ -127,9 +168,11 @@ def parse_version(string):
 
     Raises:
         ParseError when a version can not be parsed.
+
+    Results are memoized, the same Version is returned for the same string.
     """
     # Parse weird nuke versioning
-    match = re.search(nuke_version_pattern, string)
+    match = nuke_version_re.search(string)
     if match:
         return Version(
             major=int(match.group("major")),
@@ -141,7 +184,7 @@ def parse_version(string):
         )
 
     # Parse four_version - four digit version
-    match = re.search(four_version_pattern, string)
+    match = four_version_re.search(string)
     if match:
         return Version(
             major=int(match.group("major")),
@@ -153,7 +196,7 @@ def parse_version(string):
         )
 
     # Parse Semver / Calver
-    match = re.search(semver_version_pattern, string)
+    match = semver_version_re.search(string)
     if match:
         return Version(
             major=int(match.group("major")),
@@ -165,7 +208,7 @@ def parse_version(string):
         )
 
     # Parse Simple version
-    match = re.search(simplever_pattern, string)
+    match = simplever_re.search(string)
     if match:
         kwargs = dict(Version._defaults)
         kwargs["string"] = match.group(0)
@@ -177,6 +220,182 @@ def parse_version(string):
     raise ParseError("Could not parse version from %s" % string)
 
 
+class VersionConstraint(object):
+    """A compiled version constraint like ">=1.2,<2", "~=3.1" or "==1.*".
+
+    Clauses are separated by commas and must all be satisfied. Supported
+    operators are ==, !=, <, <=, >, >= and ~=. == and != accept a trailing
+    .* to match all versions starting with a prefix. ~=3.1 is equivalent to
+    >=3.1,==3.*.
+
+    Like PEP 440, <2 does not match prereleases of 2 such as 2.0.0-beta, unless
+    the clause names a prerelease itself like <2.0.0-rc1.
+
+    Clauses are compiled into a lower and upper bound on Version.sort_key and
+    a list of excluded ranges. The bounds of a sorted list of sort keys can
+    then be found with bisect, see bounds.
+
+    Use parse_constraint to create VersionConstraints.
+
+    Raises:
+        ParseError when the constraint is invalid.
+    """
+
+    def __init__(self, string):
+        self.string = string
+        self.lower = None
+        self.upper = None
+        self.excluded = []
+
+        for clause in string.split(","):
+            match = constraint_re.match(clause)
+            if not match:
+                raise ParseError("Invalid version constraint %s" % string)
+            self._add_clause(match.group("op"), match.group("version"))
+
+    def __repr__(self):
+        return "VersionConstraint(%r)" % self.string
+
+    def __str__(self):
+        return self.string
+
+    def _add_clause(self, op, string):
+        if string.endswith(".*"):
+            if op not in ("==", "!="):
+                raise ParseError("Only == and != support .* in %s" % self.string)
+            lower, upper = _prefix_range(string[:-2], len(string[:-2].split(".")))
+            if op == "==":
+                self._add_lower(lower, True)
+                self._add_upper(upper, False)
+            else:
+                self.excluded.append(((lower, True), (upper, False)))
+            return
+
+        version = parse_version(string)
+        if version.string != string:
+            raise ParseError("Invalid version %s in %s" % (string, self.string))
+
+        key = version.sort_key
+        if op == "==":
+            self._add_lower(key, True)
+            self._add_upper(key, True)
+        elif op == "!=":
+            self.excluded.append(((key, True), (key, True)))
+        elif op == ">=":
+            self._add_lower(key, True)
+        elif op == ">":
+            self._add_lower(key, False)
+        elif op == "<=":
+            self._add_upper(key, True)
+        elif op == "<":
+            # Prereleases and builds of a release sort below it, but are not
+            # less than it. Bound the release's key prefix instead, unless the
+            # version names a prerelease or build itself.
+            if version.buildmetadata is not None:
+                self._add_upper(key, False)
+            elif version.prerelease is None:
+                self._add_upper(key[:3], False)
+            elif isinstance(version.prerelease, compat.numeric_types):
+                # Fourth part of a four part version
+                self._add_upper(key[:4], False)
+            else:
+                self._add_upper(key, False)
+        elif op == "~=":
+            release = release_re.match(string).group("release").split(".")
+            if len(release) < 2:
+                raise ParseError("~= requires at least two parts in %s" % self.string)
+            self._add_lower(key, True)
+            self._add_upper(_prefix_range(string, len(release) - 1)[1], False)
+
+    def _add_lower(self, key, inclusive):
+        if (
+            self.lower is None
+            or key > self.lower[0]
+            or (key == self.lower[0] and not inclusive)
+        ):
+            self.lower = (key, inclusive)
+
+    def _add_upper(self, key, inclusive):
+        if (
+            self.upper is None
+            or key < self.upper[0]
+            or (key == self.upper[0] and not inclusive)
+        ):
+            self.upper = (key, inclusive)
+
+    def __contains__(self, version):
+        key = version.sort_key
+        if not _above(key, self.lower) or not _below(key, self.upper):
+            return False
+
+        for lower, upper in self.excluded:
+            if _above(key, lower) and _below(key, upper):
+                return False
+
+        return True
+
+    def bounds(self, sort_keys):
+        """Given a sorted list of sort keys, return the start and stop index
+        of the keys between this constraint's lower and upper bound.
+
+        Keys in the returned range may still be excluded by != clauses.
+        """
+
+        start, stop = 0, len(sort_keys)
+        if self.lower is not None:
+            key, inclusive = self.lower
+            bisect = bisect_left if inclusive else bisect_right
+            start = bisect(sort_keys, key)
+        if self.upper is not None:
+            key, inclusive = self.upper
+            bisect = bisect_right if inclusive else bisect_left
+            stop = bisect(sort_keys, key, start)
+        return start, max(start, stop)
+
+
+def _above(key, bound):
+    if bound is None:
+        return True
+    return key > bound[0] or (bound[1] and key == bound[0])
+
+
+def _below(key, bound):
+    if bound is None:
+        return True
+    return key < bound[0] or (bound[1] and key == bound[0])
+
+
+def _prefix_range(string, size):
+    """Return the range of sort keys of versions starting with the first size
+    parts of a version string."""
+
+    key = parse_version(string).sort_key[:size]
+    if not key:
+        raise ParseError("Invalid version prefix %s" % string)
+
+    last = key[-1]
+    if isinstance(last, tuple):
+        # Fourth part of a four part version is stored as a comparable value
+        upper = key[:-1] + ((last[0], last[1] + 1),)
+    else:
+        upper = key[:-1] + (last + 1,)
+    return key, upper
+
+
+@cached(LRUCache(maxsize=4096))
+def parse_constraint(string):
+    """Parse and return a VersionConstraint from the provided string.
+
+    Results are memoized, the same VersionConstraint is returned for the same
+    string.
+
+    Raises:
+        ParseError when the constraint is invalid.
+    """
+
+    return VersionConstraint(string)
+
+
 def default_version():
     return Version(
         major=0,
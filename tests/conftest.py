@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import sys
+
+# Make the vendored cpenv package importable
+packages = os.path.join(os.path.dirname(os.path.dirname(__file__)), "packages")
+if packages not in sys.path:
+    sys.path.insert(0, packages)
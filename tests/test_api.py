@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+
+# Local imports
+from cpenv import api
+
+from .utils import TempDirTestCase, make_module
+
+
+class TestActiveModules(TempDirTestCase):
+    def test_active_modules_with_requires(self):
+        repo = os.path.join(self.tmp, "repo")
+        make_module(repo, "lib", "1.0.0")
+        make_module(repo, "app", "1.0.0", requires=["lib-1.0.0"])
+        os.environ["CPENV_MODULES"] = repo
+        os.environ["CPENV_RESOLVE_REQUIRES"] = "1"
+        os.environ["CPENV_ACTIVE_MODULES"] = os.pathsep.join(
+            ["lib-1.0.0", "app-1.0.0"]
+        )
+
+        active = [spec.qual_name for spec in api.get_active_modules()]
+        self.assertEqual(active, ["lib-1.0.0", "app-1.0.0"])
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import json
+import os
+import sys
+import types
+
+# Local imports
+import cpenv
+
+from .utils import TempDirTestCase, make_module, reset_api
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_autocpenv():
+    """Import autocpenv.py with stand-ins for the Deadline and .Net modules
+    it imports, which are only available within Deadline."""
+
+    if "autocpenv" in sys.modules:
+        return sys.modules["autocpenv"]
+
+    class RepositoryUtils(object):
+        @staticmethod
+        def GetEventPluginDirectory(name):
+            return root
+
+    stand_ins = {}
+    for name in [
+        "Deadline",
+        "Deadline.Events",
+        "Deadline.Scripting",
+        "System",
+        "System.Diagnostics",
+        "System.IO",
+    ]:
+        stand_ins[name] = types.ModuleType(name)
+    stand_ins["Deadline.Events"].DeadlineEventListener = object
+    stand_ins["Deadline.Scripting"].RepositoryUtils = RepositoryUtils
+
+    previous = dict([(name, sys.modules.get(name)) for name in stand_ins])
+    sys.modules.update(stand_ins)
+    sys.path.insert(0, root)
+    try:
+        import autocpenv
+    finally:
+        sys.path.remove(root)
+        for name, module in previous.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    return autocpenv
+
+
+class TestPinning(TempDirTestCase):
+    def setUp(self):
+        super(TestPinning, self).setUp()
+        self.autocpenv = import_autocpenv()
+        self.repo_path = os.path.join(self.tmp, "repo")
+        make_module(self.repo_path, "app", "1.0.0")
+        make_module(self.repo_path, "app", "1.1.0")
+        self.project = make_module(os.path.join(self.tmp, "project"), "tool", "2.0.0")
+        os.environ["CPENV_MODULES"] = self.repo_path
+
+    def pin(self, requirements):
+        pinned = self.autocpenv.pin_module_specs(cpenv.resolve(requirements))
+
+        # Unpin like a worker would, in a new process
+        reset_api()
+        return pinned
+
+    def test_round_trip(self):
+        pinned = self.pin(["app-1.0.0", self.project])
+        module_specs = self.autocpenv.unpin_module_specs(pinned)
+        self.assertEqual(
+            sorted([(spec.qual_name, spec.path) for spec in module_specs]),
+            [
+                ("app-1.0.0", cpenv.paths.normalize(self.repo_path, "app-1.0.0")),
+                ("tool-2.0.0", cpenv.paths.normalize(self.project)),
+            ],
+        )
+        self.assertIn(
+            os.environ["CPENV_MODULES"],
+            [spec.repo.path for spec in module_specs],
+        )
+
+    def test_missing_path(self):
+        pinned = self.pin([self.project])
+        cpenv.paths.rmtree(self.project)
+
+        with self.assertRaises(cpenv.ResolveError):
+            self.autocpenv.unpin_module_specs(pinned)
+        self.assertEqual(self.autocpenv.unpin_module_specs(pinned, True), [])
+
+    def test_replaced_path(self):
+        pinned = self.pin([self.project])
+        with open(os.path.join(self.project, "module.yml"), "w") as f:
+            f.write("name: tool\nversion: 3.0.0\n")
+
+        with self.assertRaises(cpenv.ResolveError):
+            self.autocpenv.unpin_module_specs(pinned)
+
+    def test_repo_moved(self):
+        pinned = self.pin(["app-1.0.0"])
+        moved = os.path.join(self.tmp, "moved")
+        os.rename(self.repo_path, moved)
+        os.environ["CPENV_MODULES"] = moved
+
+        module_specs = self.autocpenv.unpin_module_specs(pinned)
+        self.assertEqual(
+            [spec.path for spec in module_specs],
+            [cpenv.paths.normalize(moved, "app-1.0.0")],
+        )
+
+        # Only exact versions are used
+        cpenv.paths.rmtree(os.path.join(moved, "app-1.0.0"))
+        reset_api()
+        with self.assertRaises(cpenv.ResolveError):
+            self.autocpenv.unpin_module_specs(pinned)
+
+
+class TestEnvironmentCache(TempDirTestCase):
+    def setUp(self):
+        super(TestEnvironmentCache, self).setUp()
+        self.autocpenv = import_autocpenv()
+        self.config = {"home_path": None, "repos": [], "ignore_missing": False}
+        self.modules = []
+        for name, version in [("app", "1.0.0"), ("tool", "2.0.0")]:
+            path = make_module(self.tmp, name, version)
+            with open(os.path.join(path, "module.yml"), "w") as f:
+                f.write(
+                    "name: %s\nversion: %s\nenvironment:\n  PATH: [$MODULE/bin]\n"
+                    % (name, version)
+                )
+            self.modules.append(cpenv.Module(path))
+        self.environment = cpenv.Activator().combine_modules(self.modules)
+        self.assertEqual(len(self.environment["PATH"]), 2)
+        self.key = self.get_key(["app", "tool"])
+
+    def get_key(self, requirements, config=None, worker_groups=("gpu",), **kwargs):
+        return self.autocpenv.get_environment_cache_key(
+            requirements,
+            config or self.config,
+            list(worker_groups),
+            **kwargs
+        )
+
+    def test_cache_key(self):
+        self.assertEqual(self.get_key(["app", "tool"]), self.key)
+        self.assertEqual(self.get_key(["app", "tool"], worker_groups=["gpu"]), self.key)
+        for key in [
+            self.get_key(["tool", "app"]),
+            self.get_key(["app", "tool"], worker_groups=["cpu"]),
+            self.get_key(["app", "tool"], pinned='[["app"]]'),
+            self.get_key(["app", "tool"], dict(self.config, ignore_missing=True)),
+        ]:
+            self.assertNotEqual(key, self.key)
+
+    def test_round_trip(self):
+        self.assertIsNone(self.autocpenv.read_cached_environment(self.key, 60))
+        self.autocpenv.write_cached_environment(
+            self.key,
+            self.environment,
+            self.modules,
+        )
+        self.assertEqual(
+            self.autocpenv.read_cached_environment(self.key, 60),
+            self.environment,
+        )
+
+    def test_expired(self):
+        self.autocpenv.write_cached_environment(
+            self.key,
+            self.environment,
+            self.modules,
+        )
+        cache_path = self.autocpenv.get_environment_cache_path(self.key)
+        with open(cache_path, "r") as f:
+            data = json.load(f)
+        data["created"] -= 120
+        with open(cache_path, "w") as f:
+            json.dump(data, f)
+
+        self.assertIsNone(self.autocpenv.read_cached_environment(self.key, 60))
+
+    def test_modified_module(self):
+        self.autocpenv.write_cached_environment(
+            self.key,
+            self.environment,
+            self.modules,
+        )
+        config_path = self.modules[1].config_path
+        mtime = os.path.getmtime(config_path)
+        os.utime(config_path, (mtime + 10, mtime + 10))
+        self.assertIsNone(self.autocpenv.read_cached_environment(self.key, 60))
+
+    def test_removed_module(self):
+        self.autocpenv.write_cached_environment(
+            self.key,
+            self.environment,
+            self.modules,
+        )
+        cpenv.paths.rmtree(self.modules[0].path)
+        self.assertIsNone(self.autocpenv.read_cached_environment(self.key, 60))
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Time and memory budgets for hot paths. Time budgets allow about twice the
+measured time, and all budgets stay below the measurements from before the
+optimization they protect.
+"""
+
+# Standard library imports
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import unittest
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Local imports
+from cpenv.module import ModuleSpec, parse_module_requirement
+from cpenv.reporter import Reporter
+from cpenv.repos import LocalRepo
+from cpenv.repos.base import Repo
+from cpenv.resolver import Resolver
+from cpenv.versions import parse_version
+
+from .utils import TempDirTestCase
+
+packages_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "packages")
+list_script = """
+import gc
+import json
+import resource
+import sys
+
+from cpenv.repos import LocalRepo
+
+repo = LocalRepo("big", sys.argv[1], index=True)
+gc.collect()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+module_specs = repo.list()
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"count": len(module_specs), "before": before, "after": after}))
+"""
+
+
+def best_time(func, repeat=3):
+    """Return the best time of repeat calls to func in seconds."""
+
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+class MemoryRepo(Repo):
+    """Keeps ModuleSpecs and their requirements in memory."""
+
+    def __init__(self, name):
+        super(MemoryRepo, self).__init__(name)
+        self.module_specs = {}
+        self.requires = {}
+        self.find_many_calls = 0
+        self.get_requires_calls = 0
+
+    def add(self, name, version, requires=()):
+        module_spec = ModuleSpec(
+            name=name,
+            qual_name=name + "-" + version,
+            version=parse_version(version),
+            path="/" + self.name + "/" + name + "-" + version,
+            repo=self,
+        )
+        self.module_specs.setdefault(name, []).append(module_spec)
+        self.requires[module_spec.qual_name] = list(requires)
+
+    def find(self, requirement):
+        name, _ = parse_module_requirement(requirement)
+        return self.module_specs.get(name, [])
+
+    def find_many(self, requirements):
+        self.find_many_calls += 1
+        return super(MemoryRepo, self).find_many(requirements)
+
+    def get_requires(self, module_spec):
+        self.get_requires_calls += 1
+        return self.requires[module_spec.qual_name]
+
+
+class TestResolveBenchmark(unittest.TestCase):
+    # Measured around 0.22s, and 0.64s before version parsing was
+    # precompiled and memoized.
+    budget = 0.5
+
+    def test_resolve_10k_specs(self):
+        rng = random.Random(1)
+        repo = MemoryRepo("memory")
+        for i in range(10000):
+            repo.add("tool", "%d.%d.%d" % (i // 100, i % 100, rng.randint(0, 9)))
+        requirements = [
+            "tool-%d.%d" % (rng.randint(0, 99), rng.randint(0, 99)) for _ in range(20)
+        ]
+        resolver = Resolver([repo])
+        resolver.reporter = Reporter()
+
+        resolved = resolver.resolve(requirements)
+        self.assertEqual(len(resolved), 20)
+        self.assertLess(best_time(lambda: resolver.resolve(requirements)), self.budget)
+
+
+class TestTransitiveResolveBenchmark(unittest.TestCase):
+    # Measured around 0.25s for the graph and 0.14s for the chain
+    graph_budget = 0.6
+    chain_budget = 0.4
+
+    def resolve(self, repo, requirements):
+        resolver = Resolver([repo], transitive=True)
+        resolver.reporter = Reporter()
+        return resolver.resolve(requirements)
+
+    def test_resolve_graph(self):
+        # 3000 modules with 3 versions, each requiring up to 3 of the next 60
+        rng = random.Random(1)
+        repo = MemoryRepo("memory")
+        count = 3000
+        for i in range(count):
+            for version in ["1.0.0", "1.1.0", "2.0.0"]:
+                dependencies = range(i + 1, min(count, i + 60))
+                requires = rng.sample(dependencies, min(3, len(dependencies)))
+                repo.add("p%05dx" % i, version, ["p%05dx" % j for j in requires])
+        requirements = ["p%05dx" % i for i in range(50)]
+
+        start = time.time()
+        resolved = self.resolve(repo, requirements)
+        elapsed = time.time() - start
+
+        position = dict([(spec.name, i) for i, spec in enumerate(resolved)])
+        for spec in resolved:
+            for name in repo.requires[spec.qual_name]:
+                self.assertLess(position[name], position[spec.name])
+
+        # Each level of requirements is looked up in one batch and each
+        # module's requirements are read once.
+        self.assertLess(repo.find_many_calls, 200)
+        self.assertEqual(repo.get_requires_calls, len(resolved))
+        self.assertLess(elapsed, self.graph_budget)
+
+    def test_resolve_deep_chain(self):
+        repo = MemoryRepo("memory")
+        depth = 3000
+        for i in range(depth):
+            requires = ["c%05dx>=1.0" % (i + 1)] if i + 1 < depth else []
+            repo.add("c%05dx" % i, "1.0.0", requires)
+            repo.add("c%05dx" % i, "1.1.0", requires)
+
+        start = time.time()
+        resolved = self.resolve(repo, ["c00000x"])
+        elapsed = time.time() - start
+
+        self.assertEqual(len(resolved), depth)
+        self.assertEqual(resolved[0].qual_name, "c02999x-1.1.0")
+        self.assertEqual(resolved[-1].qual_name, "c00000x-1.1.0")
+        self.assertLess(elapsed, self.chain_budget)
+
+
+@unittest.skipIf(resource is None, "requires unix")
+class TestListMemoryBenchmark(TempDirTestCase):
+    """Lists a synthetic repo of 50k modules, 500 names with 100 versions."""
+
+    # Peak memory may grow by at most this many kilobytes while listing the
+    # repo from its index. Measured around 64MB, and 84MB before Versions
+    # were shared and ModuleSpecs were slotted.
+    rss_ceiling_kb = 75 * 1024
+
+    def make_repo(self):
+        repo_path = os.path.join(self.tmp, "repo")
+        os.makedirs(repo_path)
+        for i in range(50000):
+            name = "module%03d" % (i % 500)
+            version = "%d.%d.0" % (i // 5000, i // 500 % 10)
+            path = os.path.join(repo_path, name + "-" + version)
+            os.mkdir(path)
+            with open(os.path.join(path, "module.yml"), "w") as f:
+                f.write("name: %s\nversion: %s\n" % (name, version))
+        return repo_path
+
+    def test_list_memory(self):
+        repo_path = self.make_repo()
+
+        # Write the repo's index, new processes list the repo from it
+        LocalRepo("big", repo_path, index=True).list()
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = packages_path
+        output = subprocess.check_output(
+            [sys.executable, "-c", list_script, repo_path],
+            env=env,
+        )
+        rss = json.loads(output.decode().strip().splitlines()[-1])
+
+        self.assertEqual(rss["count"], 50000)
+        self.assertLess(rss["after"] - rss["before"], self.rss_ceiling_kb)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import socket
+import unittest
+
+# Local imports
+from cpenv import api, daemon, paths
+from cpenv.repos import LocalRepo
+
+from .utils import TempDirTestCase, make_module
+
+
+@unittest.skipIf(not hasattr(socket, "AF_UNIX"), "unix sockets are not available")
+class TestDaemon(TempDirTestCase):
+    def setUp(self):
+        super(TestDaemon, self).setUp()
+        self.server = daemon.DaemonServer(os.path.join(self.tmp, "cpenv.sock"))
+
+    def tearDown(self):
+        self.server.server_close()
+        super(TestDaemon, self).tearDown()
+
+    def request(self, cwd=None, **params):
+        cwd = paths.normalize(cwd or os.getcwd())
+        context = daemon.get_context()
+        context["repos"] = [
+            repo if repo[0] != "cwd" else ["cwd", "LocalRepo", cwd]
+            for repo in context["repos"]
+        ]
+        return self.server.handle_request_data(
+            {
+                "method": "resolve",
+                "params": params,
+                "context": context,
+                "cwd": cwd,
+            }
+        )
+
+    def test_is_enabled(self):
+        for value, enabled in [
+            ("1", True),
+            ("yes", True),
+            ("0", False),
+            ("false", False),
+            ("", False),
+        ]:
+            os.environ["CPENV_DAEMON"] = value
+            self.assertEqual(daemon.is_enabled(), enabled, value)
+
+    def test_resolve_in_client_cwd(self):
+        project = os.path.join(self.tmp, "project")
+        make_module(project, "app", "1.0.0")
+        result = self.request(cwd=project, requirements=["./app-1.0.0"])
+        self.assertEqual(
+            [spec["qual_name"] for spec in result["resolved"]],
+            ["app-1.0.0"],
+        )
+        self.assertEqual(os.getcwd(), os.path.join(self.tmp, "cwd"))
+
+    def test_repos_registered_by_client(self):
+        repo = LocalRepo("runtime", os.path.join(self.tmp, "runtime"))
+        context = daemon.get_context()
+        context["repos"].append(daemon.describe_repos([repo])[0])
+        with self.assertRaises(daemon.DaemonError):
+            self.server.handle_request_data(
+                {
+                    "method": "resolve",
+                    "params": {"requirements": ["app"]},
+                    "context": context,
+                    "cwd": paths.normalize(os.getcwd()),
+                }
+            )
+
+    def test_matching_repos(self):
+        make_module(os.path.join(self.tmp, "cwd"), "app", "1.0.0")
+        result = self.request(requirements=["app"])
+        self.assertEqual(result["resolved"][0]["qual_name"], "app-1.0.0")
+        self.assertEqual(api.get_repo("cwd").path, paths.normalize(os.getcwd()))
+
+
+@unittest.skipIf(not hasattr(socket, "AF_UNIX"), "unix sockets are not available")
+class TestDaemonSocket(TempDirTestCase):
+    def listen(self, socket_path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(socket_path)
+        sock.listen(1)
+        self.addCleanup(sock.close)
+        return sock
+
+    def test_socket_path(self):
+        os.environ["XDG_RUNTIME_DIR"] = os.path.join(self.tmp, "run")
+        self.assertEqual(
+            daemon.get_socket_path(),
+            paths.normalize(self.tmp, "run", "cpenv", "daemon.sock"),
+        )
+
+        del os.environ["XDG_RUNTIME_DIR"]
+        self.assertTrue(daemon.get_socket_path().startswith(api.get_home_path()))
+
+    def test_server_creates_private_dir(self):
+        socket_path = os.path.join(self.tmp, "run", "daemon.sock")
+        server = daemon.DaemonServer(socket_path)
+        self.addCleanup(server.server_close)
+
+        self.assertEqual(os.stat(os.path.dirname(socket_path)).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(socket_path).st_mode & 0o777, 0o600)
+        daemon.check_socket(socket_path)
+
+    def test_refuse_shared_dir(self):
+        shared = os.path.join(self.tmp, "shared")
+        os.makedirs(shared)
+        os.chmod(shared, 0o777)
+        socket_path = os.path.join(shared, "daemon.sock")
+        sock = self.listen(socket_path)
+        os.chmod(socket_path, 0o600)
+
+        # The client must not connect, and the server must not give up
+        # because another socket answers.
+        sock.settimeout(0.1)
+        self.assertIsNone(daemon.request("ping", socket_path=socket_path))
+        self.assertRaises(socket.timeout, sock.accept)
+        self.assertRaises(daemon.DaemonError, daemon.check_socket, socket_path)
+        self.assertRaises(daemon.DaemonError, daemon.DaemonServer, socket_path)
+
+    def test_refuse_shared_socket(self):
+        socket_path = os.path.join(self.tmp, "daemon.sock")
+        self.listen(socket_path)
+        os.chmod(socket_path, 0o666)
+
+        self.assertIsNone(daemon.request("ping", socket_path=socket_path))
+        self.assertRaises(daemon.DaemonError, daemon.DaemonServer, socket_path)
+
+    @unittest.skipIf(not hasattr(os, "getuid"), "uids are not available")
+    def test_refuse_other_owner(self):
+        stat_result = os.stat(self.tmp)
+        other = type(stat_result)(
+            stat_result[:4] + (os.getuid() + 1,) + stat_result[5:]
+        )
+        with self.assertRaises(daemon.DaemonError):
+            daemon._check_private(self.tmp, other)
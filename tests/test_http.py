@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import json
+import os
+import socket
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Local imports
+from cpenv import http
+
+from .utils import TempDirTestCase
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves server.content with Range and If-Range support."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        content, etag = server.content, server.etag
+        byte_range = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if byte_range and (not if_range or if_range == etag):
+            start, end = [int(v) for v in byte_range.split("=")[1].split("-")]
+            end = min(end, len(content) - 1)
+            body = content[start : end + 1]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes %d-%d/%d" % (start, end, len(content))
+            )
+        else:
+            body = content
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if server.on_request:
+            server.on_request(server)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRangedDownload(TempDirTestCase):
+    def setUp(self):
+        super(TestRangedDownload, self).setUp()
+        self.server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+        self.server.content = os.urandom(64 * 1024)
+        self.server.etag = '"v1"'
+        self.server.requests = []
+        self.server.on_request = None
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = "http://127.0.0.1:%d/archive.zip" % self.server.server_port
+        self.path = os.path.join(self.tmp, "archive.zip")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        http.pool.clear()
+        super(TestRangedDownload, self).tearDown()
+
+    def download(self):
+        return http.download(self.url, self.path, max_workers=2, range_size=8192)
+
+    def test_ranged_download(self):
+        self.assertEqual(self.download(), len(self.server.content))
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.server.content)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+        ranged = [r for r in self.server.requests if "If-Range" in r]
+        self.assertEqual(len(ranged), 8)
+        self.assertTrue(all(r["If-Range"] == '"v1"' for r in ranged))
+
+    def test_content_changed(self):
+        def change_content(server):
+            if len(server.requests) == 3:
+                server.content = os.urandom(64 * 1024)
+                server.etag = '"v2"'
+
+        self.server.on_request = change_content
+        with self.assertRaises(http.ContentChanged):
+            self.download()
+
+        # The next attempt starts over instead of resuming mixed content
+        self.server.on_request = None
+        self.download()
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.server.content)
+
+    def write_partial_download(self, validator):
+        """Write a partial download of the current content with 4 ranges done."""
+
+        with open(self.path, "wb") as f:
+            f.write(self.server.content[: 4 * 8192])
+            f.truncate(len(self.server.content))
+        state = {
+            "size": len(self.server.content),
+            "validator": validator,
+            "range_size": 8192,
+            "done": [0, 8192, 16384, 24576],
+        }
+        with open(self.path + ".part", "w") as f:
+            json.dump(state, f)
+
+    def test_resume(self):
+        self.write_partial_download('"v1"')
+        self.download()
+        ranged = [r for r in self.server.requests if "If-Range" in r]
+        self.assertEqual(len(ranged), 4)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.server.content)
+
+    def test_resume_after_content_changed(self):
+        self.write_partial_download('"v1"')
+        self.server.content = os.urandom(64 * 1024)
+        self.server.etag = '"v2"'
+        self.download()
+        ranged = [r for r in self.server.requests if "If-Range" in r]
+        self.assertEqual(len(ranged), 8)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), self.server.content)
+
+
+class TestTimeout(TempDirTestCase):
+    def setUp(self):
+        super(TestTimeout, self).setUp()
+        # Accepts connections but never responds
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(8)
+        self.url = "http://127.0.0.1:%d/" % self.server.getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        http.pool.clear()
+        super(TestTimeout, self).tearDown()
+
+    def test_timeout(self):
+        start = time.time()
+        self.assertRaises(socket.timeout, http.get, self.url, timeout=0.2)
+        self.assertLess(time.time() - start, 2)
+
+    def test_timeout_from_env(self):
+        os.environ["CPENV_HTTP_TIMEOUT"] = "0.2"
+        self.addCleanup(os.environ.pop, "CPENV_HTTP_TIMEOUT")
+        self.assertEqual(http.get_timeout(), 0.2)
+        self.assertRaises(socket.timeout, http.get, self.url)
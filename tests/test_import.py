@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import re
+import subprocess
+import sys
+
+# Local imports
+from .utils import TempDirTestCase
+
+packages_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "packages")
+check_import = """
+import sys
+import cpenv
+from cpenv import api
+
+assert not any(api._initialized.values()), api._initialized
+assert not [m for m in sys.modules if "shotgun" in m]
+"""
+check_eager_import = """
+import cpenv
+from cpenv import compat, repos
+
+try:
+    from importlib import reload
+except ImportError:
+    pass
+
+# Import cpenv like python versions without module level __getattr__ do
+compat.has_module_getattr = False
+del repos.__getattr__, cpenv.__getattr__
+reload(repos)
+reload(cpenv)
+
+assert vars(repos)["ShotgunRepo"] is repos.registry["shotgun"]
+assert vars(cpenv)["ShotgunRepo"] is repos.registry["shotgun"]
+"""
+
+
+class TestImport(TempDirTestCase):
+    """import cpenv must not initialize repos or touch CPENV_HOME."""
+
+    # Budget for the cumulative time of import cpenv reported by
+    # python -X importtime. Measured around 100ms, and 280ms when cpenv was
+    # initialized on import.
+    budget_us = 250000
+
+    def import_cpenv(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = packages_path
+        env["CPENV_HOME"] = os.path.join(self.tmp, "home")
+        output = subprocess.check_output(
+            [sys.executable, "-X", "importtime", "-c", check_import],
+            env=env,
+            stderr=subprocess.STDOUT,
+        ).decode()
+        match = re.search(r"^import time:\s+\d+ \|\s+(\d+) \| cpenv$", output, re.M)
+        return int(match.group(1))
+
+    def test_eager_import(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = packages_path
+        subprocess.check_call([sys.executable, "-c", check_eager_import], env=env)
+
+    def test_import_is_lazy(self):
+        self.import_cpenv()
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "home")))
+
+    def test_import_time(self):
+        # Best of 3 to ignore a slow first run with cold caches
+        import_time = min([self.import_cpenv() for _ in range(3)])
+        self.assertLess(import_time, self.budget_us)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import stat
+import threading
+
+# Local imports
+from cpenv import api, paths
+from cpenv.repos import LocalRepo
+
+from .utils import TempDirTestCase, make_module
+
+
+class TestRepoIndex(TempDirTestCase):
+    def setUp(self):
+        super(TestRepoIndex, self).setUp()
+        self.repo_path = os.path.join(self.tmp, "repo")
+        make_module(self.repo_path, "app", "1.0.0")
+        make_module(self.repo_path, "app", "1.1.0")
+
+    def tearDown(self):
+        os.chmod(self.repo_path, stat.S_IRWXU)
+        super(TestRepoIndex, self).tearDown()
+
+    def test_index_is_stored_in_cpenv_home(self):
+        os.chmod(self.repo_path, stat.S_IRUSR | stat.S_IXUSR)
+
+        repo = LocalRepo("repo", self.repo_path, index=True)
+        qual_names = [spec.qual_name for spec in repo.list()]
+        self.assertEqual(qual_names, ["app-1.1.0", "app-1.0.0"])
+        self.assertEqual(os.listdir(self.repo_path), ["app-1.0.0", "app-1.1.0"])
+        index_dir = os.path.dirname(repo.index.path)
+        self.assertEqual(index_dir, api.get_cache_path("indexes"))
+        self.assertTrue(os.path.isfile(repo.index.path))
+
+        # A new repo loads the persisted index instead of reading modules
+        repo = LocalRepo("repo", self.repo_path, index=True)
+        repo._read_module = None
+        self.assertEqual([spec.qual_name for spec in repo.list()], qual_names)
+
+    def test_index_in_memory(self):
+        repo = LocalRepo("repo", self.repo_path, index=False)
+        self.assertEqual(len(repo.list()), 2)
+        self.assertIsNone(repo.index.path)
+        self.assertFalse(os.path.exists(api.get_cache_path("indexes")))
+
+
+class TestAtomicWrite(TempDirTestCase):
+    def test_concurrent_writers(self):
+        path = os.path.join(self.tmp, "data.txt")
+        barrier = threading.Barrier(8)
+        errors = []
+
+        def write(i):
+            try:
+                barrier.wait()
+                for _ in range(50):
+                    paths.atomic_write(path, str(i) * 4096)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with open(path) as f:
+            data = f.read()
+        self.assertEqual(len(set(data)), 1)
+        self.assertEqual(os.listdir(self.tmp).count("data.txt"), 1)
+        self.assertEqual([n for n in os.listdir(self.tmp) if n.endswith(".tmp")], [])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+from stat import S_ISDIR
+
+# Local imports
+from cpenv import manifest
+from cpenv.repos import LocalRepo
+
+from .utils import TempDirTestCase, make_module
+
+
+class TestManifest(TempDirTestCase):
+    def setUp(self):
+        super(TestManifest, self).setUp()
+        self.repo = LocalRepo("repo", os.path.join(self.tmp, "repo"))
+        self.src = make_module(self.repo.path, "app", "1.0.0")
+        os.makedirs(os.path.join(self.src, "lib", "pkg"))
+        for rel_path in ["bin.txt", "lib/pkg/a.txt", "lib/pkg/b.txt"]:
+            with open(os.path.join(self.src, rel_path), "w") as f:
+                f.write(rel_path)
+
+    def test_build_manifest_stats_each_file_once(self):
+        calls = []
+        lstat, stat = os.lstat, os.stat
+
+        def counting(func):
+            def wrapper(path, *args, **kwargs):
+                if not S_ISDIR(lstat(path).st_mode):
+                    calls.append((func.__name__, path))
+                return func(path, *args, **kwargs)
+
+            return wrapper
+
+        os.lstat, os.stat = counting(lstat), counting(stat)
+        try:
+            result = manifest.build_manifest(self.src, hashes=False)
+        finally:
+            os.lstat, os.stat = lstat, stat
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(
+            sorted(calls),
+            sorted([("lstat", os.path.join(self.src, p)) for p in result]),
+        )
+        self.assertEqual(
+            result["lib/pkg/a.txt"][:2],
+            [6 + 7, os.path.getmtime(os.path.join(self.src, "lib/pkg/a.txt"))],
+        )
+
+    def test_sync_removes_empty_dirs(self):
+        where = os.path.join(self.tmp, "dst", "app-1.0.0")
+        module_spec = self.repo.find("app-1.0.0")[0]
+        self.repo.download(module_spec, where)
+        self.assertTrue(os.path.isfile(os.path.join(where, "lib/pkg/a.txt")))
+
+        os.remove(os.path.join(self.src, "lib/pkg/a.txt"))
+        os.remove(os.path.join(self.src, "lib/pkg/b.txt"))
+        self.repo.download(module_spec, where, overwrite=True)
+        self.assertFalse(os.path.exists(os.path.join(where, "lib")))
+        self.assertTrue(os.path.isfile(os.path.join(where, "bin.txt")))
+
+    def test_symlink_tree_sync(self):
+        self.repo.localize_mode = "symlink-tree"
+        where = os.path.join(self.tmp, "dst", "app-1.0.0")
+        module_spec = self.repo.find("app-1.0.0")[0]
+        self.repo.download(module_spec, where)
+        a_path = os.path.join(where, "lib/pkg/a.txt")
+        self.assertTrue(os.path.islink(a_path))
+
+        # Unchanged files are not linked again
+        files, removed, _ = manifest.plan_sync(manifest.load_manifest(self.src), where)
+        self.assertEqual((files, removed), ([], []))
+
+        # Files removed from the source do not leave broken links
+        os.remove(os.path.join(self.src, "lib/pkg/a.txt"))
+        self.repo.download(module_spec, where, overwrite=True)
+        self.assertFalse(os.path.lexists(a_path))
+        self.assertTrue(os.path.islink(os.path.join(where, "lib/pkg/b.txt")))
+
+    def test_plan_sync_replaces_broken_links(self):
+        where = os.path.join(self.tmp, "dst")
+        os.makedirs(where)
+        os.symlink(os.path.join(self.tmp, "missing"), os.path.join(where, "bin.txt"))
+        os.symlink(os.path.join(self.tmp, "missing"), os.path.join(where, "old.txt"))
+
+        files, removed, _ = manifest.plan_sync(manifest.load_manifest(self.src), where)
+        self.assertIn("bin.txt", [rel_path for rel_path, _ in files])
+        self.assertEqual(removed, ["old.txt"])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import json
+import os
+import unittest
+from functools import partial
+
+# Local imports
+from cpenv.module import ModuleSpec, load_config
+from cpenv.repos import LocalRepo
+from cpenv.vendor import yaml
+
+from .utils import TempDirTestCase, make_module
+
+
+class TestModuleSpec(TempDirTestCase):
+    def test_local_spec_is_a_plain_namedtuple(self):
+        repo_path = os.path.join(self.tmp, "repo")
+        make_module(repo_path, "app", "1.0.0")
+        repo = LocalRepo("repo", repo_path)
+        module_spec = repo.find("app-1.0.0")[0]
+
+        path = repo.path + "/app-1.0.0"
+        name, qual_name, version, spec_path, spec_repo = module_spec
+        self.assertEqual(spec_path, path)
+        self.assertEqual(module_spec[3], path)
+        self.assertEqual(module_spec.path, path)
+        self.assertEqual(module_spec._asdict()["path"], path)
+        self.assertEqual(json.loads(json.dumps(module_spec, default=str))[3], path)
+        self.assertEqual(
+            module_spec,
+            ModuleSpec(name, qual_name, version, path, spec_repo),
+        )
+        self.assertEqual(
+            tuple(module_spec),
+            (name, qual_name, version, path, spec_repo),
+        )
+
+
+class TestLoadConfig(unittest.TestCase):
+    document = """
+name: app
+version: 1.0.0
+requires: [python-3.9, "tool>=2"]
+environment:
+    PATH: [$MODULE/bin]
+    COUNT: 3
+    ENABLED: yes
+    RATIO: 0.5
+    EMPTY:
+"""
+
+    def test_matches_vendored_yaml(self):
+        self.assertEqual(load_config(self.document), yaml.safe_load(self.document))
+
+    def test_vendored_yaml_is_unmodified(self):
+        self.assertNotIsInstance(yaml.safe_load, partial)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import zipfile
+
+# Local imports
+from cpenv import paths
+from cpenv.repos import LocalRepo
+
+from .utils import TempDirTestCase, make_module
+
+
+class TestCopyFile(TempDirTestCase):
+    def setUp(self):
+        super(TestCopyFile, self).setUp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dst = os.path.join(self.tmp, "dst")
+        with open(self.src, "wb") as f:
+            f.write(b"0123456789" * 1000)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_copy_file(self):
+        paths.copy_file(self.src, self.dst)
+        self.assertEqual(self.read(self.dst), self.read(self.src))
+
+    def test_short_kernel_copy_falls_back(self):
+        def short_copy(in_fd, out_fd, count, offset_src=None, offset_dst=None):
+            # Copy part of the file then report end of file
+            if offset_src:
+                return 0
+            data = os.pread(in_fd, count // 2, 0)
+            return os.pwrite(out_fd, data, 0)
+
+        original = getattr(os, "copy_file_range", None)
+        os.copy_file_range = short_copy
+        try:
+            self.assertFalse(paths._kernel_copy(self.src, self.dst))
+            paths.copy_file(self.src, self.dst)
+        finally:
+            if original is None:
+                del os.copy_file_range
+            else:
+                os.copy_file_range = original
+        self.assertEqual(self.read(self.dst), self.read(self.src))
+
+
+class TestZipFolder(TempDirTestCase):
+    def setUp(self):
+        super(TestZipFolder, self).setUp()
+        self.src = os.path.join(self.tmp, "src")
+        self.files = {
+            "module.yml": b"name: app\nversion: 1.0.0\n",
+            "bin/run": b"#!/bin/sh\necho run\n" * 50,
+            "lib/big.txt": b"0123456789" * 300000,
+            "lib/lib.so": os.urandom(4096),
+            "empty.txt": b"",
+        }
+        for rel_path, data in self.files.items():
+            path = os.path.join(self.src, rel_path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write(data)
+        os.chmod(os.path.join(self.src, "bin/run"), 0o755)
+        self.archive = os.path.join(self.tmp, "app-1.0.0.zip")
+
+    def zip_folder(self, **kwargs):
+        progress = []
+        paths.zip_folder_from_info(
+            paths.get_folder_info(self.src),
+            self.archive,
+            progress_cb=progress.append,
+            **kwargs
+        )
+        self.assertEqual(sum(progress), len(self.files))
+
+        with zipfile.ZipFile(self.archive) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            infos = dict([(i.filename, i) for i in zip_file.infolist()])
+            for rel_path, data in self.files.items():
+                self.assertEqual(zip_file.read(rel_path), data)
+        return infos
+
+    def test_zip_folder(self):
+        # big.txt is larger than read_size and is streamed from its path
+        for max_workers in [1, 4]:
+            infos = self.zip_folder(max_workers=max_workers, read_size=1024 * 1024)
+            self.assertEqual(infos["lib/big.txt"].compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(infos["lib/lib.so"].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(infos["bin/run"].external_attr >> 16 & 0o777, 0o755)
+
+    def test_store_all(self):
+        infos = self.zip_folder(max_workers=4, store_patterns=["*"])
+        for info in infos.values():
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+
+    def test_read_error(self):
+        info = paths.get_folder_info(self.src)
+        info["files"].append((os.path.join(self.src, "missing"), "missing"))
+        with self.assertRaises(IOError):
+            paths.zip_folder_from_info(info, self.archive, max_workers=4)
+
+
+class TestExtractZip(TempDirTestCase):
+    def setUp(self):
+        super(TestExtractZip, self).setUp()
+        self.archive = os.path.join(self.tmp, "app-1.0.0.zip")
+        self.where = os.path.join(self.tmp, "app-1.0.0")
+        self.files = dict(
+            [
+                ("lib/pkg%d/file%d.py" % (i % 4, i), os.urandom(i * 100))
+                for i in range(40)
+            ]
+        )
+        self.files["module.yml"] = b"name: app\nversion: 1.0.0\n"
+        with zipfile.ZipFile(self.archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("empty/", b"")
+            for rel_path, data in self.files.items():
+                zip_file.writestr(rel_path, data)
+            run = zipfile.ZipInfo("bin/run")
+            run.external_attr = 0o755 << 16
+            zip_file.writestr(run, b"#!/bin/sh\n")
+        self.files["bin/run"] = b"#!/bin/sh\n"
+
+    def read(self, rel_path):
+        with open(os.path.join(self.where, rel_path), "rb") as f:
+            return f.read()
+
+    def test_extract_zip(self):
+        for max_workers in [1, 4]:
+            progress = []
+            total = paths.extract_zip(
+                self.archive,
+                self.where,
+                max_workers=max_workers,
+                progress_cb=progress.append,
+            )
+            size = sum([len(data) for data in self.files.values()])
+            self.assertEqual(total, size)
+            self.assertEqual(sum(progress), size)
+            for rel_path, data in self.files.items():
+                self.assertEqual(self.read(rel_path), data)
+            self.assertTrue(os.path.isdir(os.path.join(self.where, "empty")))
+            mode = os.stat(os.path.join(self.where, "bin/run")).st_mode
+            self.assertEqual(mode & 0o777, 0o755)
+            paths.rmtree(self.where)
+
+    def test_unsafe_member_paths(self):
+        with zipfile.ZipFile(self.archive, "w") as zip_file:
+            zip_file.writestr("../outside.txt", b"outside")
+            zip_file.writestr("/abs/path.txt", b"absolute")
+
+        paths.extract_zip(self.archive, self.where, max_workers=2)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "outside.txt")))
+        self.assertEqual(self.read("outside.txt"), b"outside")
+        self.assertEqual(self.read("abs/path.txt"), b"absolute")
+
+
+class TestLinkModes(TempDirTestCase):
+    def setUp(self):
+        super(TestLinkModes, self).setUp()
+        self.repo = LocalRepo("repo", os.path.join(self.tmp, "repo"))
+        self.src = make_module(self.repo.path, "app", "1.0.0")
+        os.makedirs(os.path.join(self.src, "lib"))
+        with open(os.path.join(self.src, "lib", "lib.py"), "w") as f:
+            f.write("lib")
+        self.where = os.path.join(self.tmp, "home_modules", "app-1.0.0")
+
+    def download(self, localize_mode):
+        self.repo.localize_mode = localize_mode
+        module_spec = self.repo.find("app-1.0.0")[0]
+        self.repo.download(module_spec, self.where)
+        return (
+            os.path.join(self.src, "lib", "lib.py"),
+            os.path.join(self.where, "lib", "lib.py"),
+        )
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, paths.get_copy_function, "teleport")
+        self.assertRaises(
+            ValueError,
+            LocalRepo,
+            "repo",
+            self.repo.path,
+            localize_mode="teleport",
+        )
+
+    def test_copy(self):
+        src, dst = self.download("copy")
+        self.assertFalse(os.path.samefile(src, dst))
+        self.assertEqual(os.path.getmtime(src), os.path.getmtime(dst))
+
+    def test_hardlink(self):
+        src, dst = self.download("hardlink")
+        self.assertTrue(os.path.samefile(src, dst))
+        self.assertFalse(os.path.islink(dst))
+
+    def test_symlink_tree(self):
+        src, dst = self.download("symlink-tree")
+        self.assertTrue(os.path.islink(dst))
+        self.assertFalse(os.path.islink(os.path.dirname(dst)))
+        self.assertEqual(os.path.realpath(dst), os.path.realpath(src))
+
+    def test_reflink(self):
+        # Clones when the filesystem supports it and copies otherwise, either
+        # way the destination is an independent file.
+        src, dst = self.download("reflink")
+        self.assertFalse(os.path.samefile(src, dst))
+        with open(dst, "r") as f:
+            self.assertEqual(f.read(), "lib")
+
+    def test_link_falls_back_to_copy(self):
+        def fail(src, dst):
+            raise OSError("Invalid cross-device link")
+
+        link = os.link
+        os.link = fail
+        try:
+            src, dst = self.download("hardlink")
+        finally:
+            os.link = link
+        self.assertFalse(os.path.samefile(src, dst))
+        with open(dst, "r") as f:
+            self.assertEqual(f.read(), "lib")
+
+    def test_replace_linked_file(self):
+        # Placing a file over a hardlink must not write through to the source
+        src, dst = self.download("hardlink")
+        other = os.path.join(self.tmp, "other.py")
+        with open(other, "w") as f:
+            f.write("other")
+
+        paths.copy_file(other, dst)
+        with open(src, "r") as f:
+            self.assertEqual(f.read(), "lib")
+        with open(dst, "r") as f:
+            self.assertEqual(f.read(), "other")
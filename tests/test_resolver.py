@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import threading
+import time
+
+# Local imports
+from cpenv.reporter import Reporter
+from cpenv.repos import LocalRepo, RemoteRepo
+from cpenv.resolver import Localizer, ResolveError, Resolver
+
+from .utils import TempDirTestCase, make_module
+
+
+class TestTransitiveResolve(TempDirTestCase):
+    def setUp(self):
+        super(TestTransitiveResolve, self).setUp()
+        self.repo_path = os.path.join(self.tmp, "repo")
+        os.makedirs(self.repo_path)
+
+    def module(self, name, version, *requires):
+        make_module(self.repo_path, name, version, requires)
+
+    def resolve(self, requirements, **kwargs):
+        resolver = Resolver([LocalRepo("repo", self.repo_path)], transitive=True)
+        resolver.reporter = Reporter()
+        return [spec.qual_name for spec in resolver.resolve(requirements, **kwargs)]
+
+    def test_non_transitive(self):
+        self.module("lib", "1.0.0")
+        self.module("app", "1.0.0", "lib-1.0.0")
+        resolver = Resolver([LocalRepo("repo", self.repo_path)], transitive=False)
+        resolver.reporter = Reporter()
+        resolved = resolver.resolve(["app-1.0.0"])
+        self.assertEqual([spec.qual_name for spec in resolved], ["app-1.0.0"])
+
+    def test_requires_come_first(self):
+        self.module("lib", "1.0.0")
+        self.module("app", "1.0.0", "lib-1.0.0")
+        self.assertEqual(self.resolve(["app"]), ["lib-1.0.0", "app-1.0.0"])
+
+    def test_diamond(self):
+        self.module("core", "1.0.0")
+        self.module("core", "1.5.0")
+        self.module("core", "2.0.0")
+        self.module("liba", "1.0.0", "core>=1.1")
+        self.module("libb", "1.0.0", "core<2")
+        self.module("app", "1.0.0", "liba", "libb")
+        self.assertEqual(
+            self.resolve(["app"]),
+            ["core-1.5.0", "liba-1.0.0", "libb-1.0.0", "app-1.0.0"],
+        )
+
+    def test_shared_constraint(self):
+        for version in ("1.0.0", "2.0.0", "3.0.0"):
+            self.module("lib", version)
+        self.module("app", "1.0.0", "lib<3")
+        self.assertEqual(self.resolve(["lib", "app"]), ["lib-2.0.0", "app-1.0.0"])
+
+    def test_shared_exact_version(self):
+        self.module("lib", "1.0.0")
+        self.module("lib", "2.0.0")
+        self.module("app", "1.0.0", "lib-1.0.0")
+        self.assertEqual(self.resolve(["lib", "app"]), ["lib-1.0.0", "app-1.0.0"])
+
+    def test_same_name_twice(self):
+        for version in ("1.0.0", "2.0.0", "3.0.0", "4.0.0"):
+            self.module("lib", version)
+        self.assertEqual(self.resolve(["lib", "lib>=2,<4"]), ["lib-3.0.0"])
+
+    def test_reselect_after_new_constraint(self):
+        self.module("lib", "1.0.0")
+        self.module("lib", "2.0.0")
+        self.module("app", "1.0.0", "lib>=2")
+        self.module("app", "2.0.0", "lib==1.*")
+        self.module("tool", "1.0.0", "app<2")
+        self.assertEqual(
+            self.resolve(["app", "tool"]),
+            ["lib-2.0.0", "app-1.0.0", "tool-1.0.0"],
+        )
+
+    def test_conflict(self):
+        self.module("lib", "1.0.0")
+        self.module("lib", "2.0.0")
+        self.module("app", "1.0.0", "lib>=2")
+        with self.assertRaises(ResolveError) as context:
+            self.resolve(["lib==1.*", "app"])
+        self.assertIn("app-1.0.0 requires lib>=2", str(context.exception))
+        self.assertIn("<requirements> requires lib==1.*", str(context.exception))
+
+    def test_cycle(self):
+        self.module("liba", "1.0.0", "libb")
+        self.module("libb", "1.0.0", "liba")
+        with self.assertRaises(ResolveError) as context:
+            self.resolve(["liba"])
+        self.assertIn("liba-1.0.0 -> libb-1.0.0 -> liba-1.0.0", str(context.exception))
+
+    def test_unresolved_requires(self):
+        self.module("app", "1.0.0", "missing-1.0.0")
+        with self.assertRaises(ResolveError):
+            self.resolve(["app"])
+        self.assertEqual(self.resolve(["app"], ignore_unresolved=True), ["app-1.0.0"])
+
+
+class CountingRepo(LocalRepo):
+    """Records the requirements looked up with find_many."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingRepo, self).__init__(*args, **kwargs)
+        self.lookups = []
+
+    def find_many(self, requirements):
+        self.lookups.append(list(requirements))
+        return super(CountingRepo, self).find_many(requirements)
+
+
+class TestFindCandidates(TempDirTestCase):
+    def setUp(self):
+        super(TestFindCandidates, self).setUp()
+        self.first = CountingRepo("first", os.path.join(self.tmp, "first"))
+        self.second = CountingRepo("second", os.path.join(self.tmp, "second"))
+        make_module(self.first.path, "app", "1.0.0")
+        make_module(self.first.path, "lib", "1.0.0")
+        make_module(self.second.path, "app", "1.1.0")
+        make_module(self.second.path, "lib", "2.0.0")
+
+    def test_exact_matches_stop_lookups(self):
+        resolver = Resolver([self.first, self.second])
+        resolver.reporter = Reporter()
+        resolved = resolver.resolve(["app-1.0.0", "lib-1.5"])
+        self.assertEqual(
+            [(spec.qual_name, spec.repo.name) for spec in resolved],
+            [("app-1.0.0", "first"), ("lib-2.0.0", "second")],
+        )
+        self.assertEqual(self.first.lookups, [["app-1.0.0", "lib-1.5"]])
+        self.assertEqual(self.second.lookups, [["lib-1.5"]])
+
+
+class SlowRemoteRepo(RemoteRepo):
+    """Records how many downloads run at the same time."""
+
+    def __init__(self, *args, **kwargs):
+        super(SlowRemoteRepo, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.downloads = []
+
+    def download(self, module_spec, where, overwrite=False):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.downloads.append(module_spec.qual_name)
+        try:
+            time.sleep(0.05)
+            return super(SlowRemoteRepo, self).download(module_spec, where, overwrite)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class TestLocalizer(TempDirTestCase):
+    def setUp(self):
+        super(TestLocalizer, self).setUp()
+        self.remote = SlowRemoteRepo("remote", os.path.join(self.tmp, "remote"))
+        self.home = LocalRepo("home", os.path.join(self.tmp, "home_modules"))
+        self.local = LocalRepo("local", os.path.join(self.tmp, "local"))
+        for i in range(6):
+            make_module(self.remote.path, "app%d" % i, "1.0.0")
+        make_module(self.local.path, "tool", "1.0.0")
+
+    def localize(self, module_specs, max_workers):
+        localizer = Localizer(self.home, max_workers=max_workers)
+        localizer.reporter = Reporter()
+        return localizer.localize(module_specs)
+
+    def test_localize_concurrently(self):
+        remote_specs = self.remote.list()
+        module_specs = remote_specs[:3] + self.local.list() + remote_specs[3:]
+        modules = self.localize(module_specs, max_workers=4)
+
+        # Modules keep the order of module_specs
+        self.assertEqual(
+            [module.qual_name for module in modules],
+            [spec.qual_name for spec in module_specs],
+        )
+        for module in modules:
+            if module.name == "tool":
+                self.assertEqual(module.path, self.local.list()[0].path)
+            else:
+                self.assertTrue(module.path.startswith(self.home.path))
+                self.assertTrue(os.path.isfile(module.config_path))
+        self.assertEqual(len(self.remote.downloads), 6)
+        self.assertGreater(self.remote.max_running, 1)
+
+        # Localized modules are found in the home repo
+        self.localize(self.remote.list(), max_workers=4)
+        self.assertEqual(len(self.remote.downloads), 6)
+
+    def test_localize_serially(self):
+        modules = self.localize(self.remote.list(), max_workers=1)
+        self.assertEqual(len(modules), 6)
+        self.assertEqual(self.remote.max_running, 1)
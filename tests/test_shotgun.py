@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import datetime
+import json
+import os
+import subprocess
+import sys
+import unittest
+import zipfile
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Local imports
+from cpenv.repos import mirror
+
+from .utils import TempDirTestCase
+
+try:
+    utc = datetime.timezone.utc
+except AttributeError:
+    utc = None
+
+packages_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "packages")
+download_script = """
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from cpenv.repos.shotgun import ShotgunRepo
+
+archive, where = sys.argv[1:3]
+
+
+class Handler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class FakeShotgun(object):
+    base_url = "https://shotgun.local"
+
+    def __init__(self, entity):
+        self.entity = entity
+
+    def find(self, entity_type, filters, fields=None, **kwargs):
+        return [dict(self.entity)]
+
+    def find_one(self, entity_type, filters, fields=None, **kwargs):
+        return dict(self.entity)
+
+
+server = ThreadingHTTPServer(
+    ("127.0.0.1", 0),
+    functools.partial(Handler, directory=os.path.dirname(archive)),
+)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+url = "http://127.0.0.1:%d/%s" % (server.server_port, os.path.basename(archive))
+entity = {
+    "type": "CustomNonProjectEntity01",
+    "id": 1,
+    "code": "big",
+    "sg_version": "1.0.0",
+    "sg_archive": {"url": url},
+    "sg_archive_size": os.path.getsize(archive),
+}
+repo = ShotgunRepo("shotgun", api=FakeShotgun(entity))
+module_spec = repo.find("big-1.0.0")[0]
+
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+repo.download(module_spec, where)
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"before": before, "after": after}))
+"""
+
+
+@unittest.skipIf(resource is None or sys.version_info < (3, 7), "requires unix")
+class TestShotgunDownload(TempDirTestCase):
+    """Downloads from a local HTTP server standing in for ShotGrid."""
+
+    archive_size = 128 * 1024 * 1024
+
+    # Peak memory may grow by at most this many kilobytes while downloading
+    # and extracting the archive. Reading it into memory grows it by more
+    # than the archive size.
+    rss_ceiling_kb = 48 * 1024
+
+    def make_archive(self):
+        archive = os.path.join(self.tmp, "server", "big-1.0.0.zip")
+        os.makedirs(os.path.dirname(archive))
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zip_file:
+            zip_file.writestr(
+                "module.yml",
+                "name: big\nversion: 1.0.0\nrequires: []\nenvironment: {}\n",
+            )
+            with zip_file.open("data.bin", "w", force_zip64=True) as f:
+                chunk = os.urandom(1024 * 1024)
+                for _ in range(self.archive_size // len(chunk)):
+                    f.write(chunk)
+        return archive
+
+    def test_download_memory(self):
+        archive = self.make_archive()
+        where = os.path.join(self.tmp, "modules", "big-1.0.0")
+        env = dict(os.environ)
+        env["PYTHONPATH"] = packages_path
+        output = subprocess.check_output(
+            [sys.executable, "-c", download_script, archive, where],
+            env=env,
+        )
+        rss = json.loads(output.decode().strip().splitlines()[-1])
+
+        data_path = os.path.join(where, "data.bin")
+        self.assertEqual(os.path.getsize(data_path), self.archive_size)
+        self.assertLess(rss["after"] - rss["before"], self.rss_ceiling_kb)
+
+
+class FakeShotgun(object):
+    """Serves Module entities like the ShotGrid api and records queries."""
+
+    base_url = "https://shotgun.local"
+
+    def __init__(self):
+        self.entities = {}
+        self.retired = {}
+        self.queries = []
+        self.error = None
+
+    def add(self, id, code, version, updated_at):
+        self.entities[id] = {
+            "type": "CustomNonProjectEntity01",
+            "id": id,
+            "code": code,
+            "sg_version": version,
+            "sg_archive_size": None,
+            "updated_at": datetime.datetime.fromtimestamp(updated_at, utc),
+        }
+
+    def retire(self, id, updated_at):
+        self.retired[id] = self.entities.pop(id)
+        self.retired[id]["updated_at"] = datetime.datetime.fromtimestamp(
+            updated_at, utc
+        )
+
+    def find(self, entity_type, filters, fields=None, retired_only=False, **kwargs):
+        if self.error:
+            raise self.error
+        self.queries.append((filters, retired_only))
+        entities = self.retired if retired_only else self.entities
+        results = []
+        for entity in entities.values():
+            if filters and filters[0][0] == "updated_at":
+                since = mirror.to_timestamp(filters[0][2])
+                if mirror.to_timestamp(entity["updated_at"]) <= since:
+                    continue
+            elif filters:
+                field, op, value = filters[0]
+                if entity[field] not in (value if op == "in" else [value]):
+                    continue
+            results.append(dict(entity))
+        return results
+
+
+class TestShotgunMirror(TempDirTestCase):
+    def setUp(self):
+        super(TestShotgunMirror, self).setUp()
+        self.shotgun = FakeShotgun()
+        self.shotgun.add(1, "app", "1.0.0", 1000)
+        self.shotgun.add(2, "app", "1.1.0", 2000)
+        self.shotgun.add(3, "tool", "2.0.0", 3000)
+        self.path = os.path.join(self.tmp, "mirror.json")
+
+    def make_mirror(self, **kwargs):
+        return mirror.ShotgunMirror(self.path, "CustomNonProjectEntity01", **kwargs)
+
+    def versions(self, entities):
+        return sorted([(e["code"], e["sg_version"]) for e in entities.values()])
+
+    def test_full_sync(self):
+        entities = self.make_mirror().update(self.shotgun)
+        self.assertEqual(self.shotgun.queries, [([], False)])
+        self.assertEqual(
+            self.versions(entities),
+            [("app", "1.0.0"), ("app", "1.1.0"), ("tool", "2.0.0")],
+        )
+        self.assertEqual(entities["3"]["updated_at"], 3000)
+
+        # Fresh mirrors in other processes are served from the shared file
+        entities = self.make_mirror().update(self.shotgun)
+        self.assertEqual(len(self.shotgun.queries), 1)
+        self.assertEqual(len(entities), 3)
+
+    def test_delta_sync(self):
+        shotgun_mirror = self.make_mirror()
+        shotgun_mirror.update(self.shotgun)
+
+        self.shotgun.add(4, "app", "1.2.0", 4000)
+        self.shotgun.add(3, "tool", "2.0.1", 4000)
+        self.shotgun.retire(1, 4000)
+        shotgun_mirror.invalidate()
+        entities = shotgun_mirror.update(self.shotgun)
+
+        # Only entities updated since the newest one seen are queried
+        since = 3000 - mirror.ShotgunMirror.overlap
+        self.assertEqual(len(self.shotgun.queries), 3)
+        for filters, _ in self.shotgun.queries[1:]:
+            field, op, value = filters[0]
+            self.assertEqual((field, op), ("updated_at", "greater_than"))
+            self.assertEqual(mirror.to_timestamp(value), since)
+        self.assertEqual(
+            self.versions(entities),
+            [("app", "1.1.0"), ("app", "1.2.0"), ("tool", "2.0.1")],
+        )
+        self.assertEqual(shotgun_mirror.updated_at, 4000)
+
+    def test_full_sync_interval(self):
+        shotgun_mirror = self.make_mirror(interval=0, full_sync_interval=0)
+        shotgun_mirror.update(self.shotgun)
+
+        # Deleted entities are only dropped by a full sync
+        del self.shotgun.entities[1]
+        entities = shotgun_mirror.update(self.shotgun)
+        self.assertEqual(self.shotgun.queries, [([], False), ([], False)])
+        self.assertEqual(
+            self.versions(entities),
+            [("app", "1.1.0"), ("tool", "2.0.0")],
+        )
+
+    def test_refresh_failure(self):
+        self.shotgun.error = RuntimeError("ShotGrid is down")
+        shotgun_mirror = self.make_mirror(interval=0)
+        self.assertRaises(RuntimeError, shotgun_mirror.update, self.shotgun)
+
+        self.shotgun.error = None
+        shotgun_mirror.update(self.shotgun)
+
+        # Use the previous contents of the mirror when a refresh fails
+        self.shotgun.error = RuntimeError("ShotGrid is down")
+        self.assertEqual(len(shotgun_mirror.update(self.shotgun)), 3)
+
+    def test_repo(self):
+        from cpenv.repos.shotgun import ShotgunRepo
+
+        repo = ShotgunRepo("shotgun", api=self.shotgun, mirror=True)
+        module_specs = repo.find("app")
+        self.assertEqual(
+            [spec.qual_name for spec in module_specs],
+            ["app-1.1.0", "app-1.0.0"],
+        )
+        self.assertEqual(self.shotgun.queries, [([], False)])
+
+        repo = ShotgunRepo("shotgun", api=self.shotgun, mirror=True)
+        self.assertEqual(repo.find("tool-2.0.0")[0].qual_name, "tool-2.0.0")
+        self.assertEqual(len(self.shotgun.queries), 1)
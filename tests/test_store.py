@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import time
+
+# Local imports
+from cpenv import api, manifest
+from cpenv.repos import LocalRepo
+from cpenv.store import ObjectStore
+
+from .utils import TempDirTestCase, make_module
+
+
+class TestObjectStore(TempDirTestCase):
+    def setUp(self):
+        super(TestObjectStore, self).setUp()
+        self.src_repo = LocalRepo(
+            "src",
+            os.path.join(self.tmp, "src"),
+            localize_mode="cas",
+        )
+        self.src = make_module(self.src_repo.path, "app", "1.0.0")
+        with open(os.path.join(self.src, "data.txt"), "w") as f:
+            f.write("data")
+
+        # A second module with the same data added later
+        self.other_src = make_module(self.src_repo.path, "other", "1.0.0")
+        with open(os.path.join(self.other_src, "data.txt"), "w") as f:
+            f.write("data")
+        past = time.time() - 100
+        os.utime(os.path.join(self.src, "data.txt"), (past, past))
+
+        self.dst_repo = LocalRepo("dst", os.path.join(self.tmp, "dst"))
+        self.store = ObjectStore(api.get_cache_path("objects"))
+
+    def download(self, qual_name):
+        module_spec = self.src_repo.find(qual_name)[0]
+        where = self.dst_repo.relative_path(qual_name)
+        return self.src_repo.download(module_spec, where, overwrite=True)
+
+    def test_shared_objects(self):
+        app = self.download("app-1.0.0")
+        other = self.download("other-1.0.0")
+        app_data = os.stat(os.path.join(app.path, "data.txt"))
+        other_data = os.stat(os.path.join(other.path, "data.txt"))
+        self.assertEqual(app_data.st_ino, other_data.st_ino)
+
+    def test_resync_copies_nothing(self):
+        self.download("app-1.0.0")
+        other = self.download("other-1.0.0")
+
+        # other's data.txt is linked to the object stored from app, so its
+        # mtime differs from the source
+        src_manifest = manifest.hash_manifest(
+            self.other_src,
+            manifest.load_manifest(self.other_src),
+        )
+        files, removed, _ = manifest.plan_sync(src_manifest, other.path)
+        self.assertEqual(files, [])
+        self.assertEqual(removed, [])
+
+    def test_prune(self):
+        app = self.download("app-1.0.0")
+        self.assertEqual(self.store.prune(), 0)
+        self.dst_repo.remove(self.dst_repo.find("app-1.0.0")[0])
+        self.assertFalse(os.path.exists(app.path))
+        self.assertEqual(self.store.prune(), 2)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import gc
+import unittest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Local imports
+from cpenv.versions import Version, parse_constraint, parse_version
+
+
+class TestVersion(unittest.TestCase):
+    def test_replace(self):
+        version = parse_version("1.2.3")
+        replaced = version._replace(patch=4)
+        self.assertEqual(replaced.patch, 4)
+        self.assertEqual(replaced.sort_key, (1, 2, 4, (1, 0), (1, 0)))
+        self.assertTrue(version < replaced)
+
+    def test_make(self):
+        version = parse_version("1.2.3")
+        self.assertIs(Version._make(tuple(version)), version)
+
+    def test_interned_is_bounded(self):
+        maxsize = Version._interned_maxsize
+        for i in range(maxsize + 10):
+            Version(i, 0, 0, None, None, "%d.0.0" % i)
+            self.assertLessEqual(len(Version._interned), maxsize)
+
+    @unittest.skipIf(tracemalloc is None, "tracemalloc is not available")
+    def test_equal_versions_are_shared(self):
+        count = 20000
+        fields = [
+            (i % 4, i % 5, 0, None, None, "%d.%d.0" % (i % 4, i % 5))
+            for i in range(count)
+        ]
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            versions = [Version(*version_fields) for version_fields in fields]
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+
+        # Only the list of references should be retained. A Version per
+        # item would retain more than 100 bytes each.
+        self.assertEqual(len(set(map(id, versions))), 20)
+        self.assertLess(retained, count * 8 + 64 * 1024)
+
+
+class TestVersionConstraint(unittest.TestCase):
+    versions = [
+        "1.9.9-rc1",
+        "1.9.9",
+        "2.0.0-beta",
+        "2.0.0-rc1",
+        "2.0.0",
+        "2.0.0+build",
+        "2.1.0",
+        "3.0.0-beta",
+        "3.0.0",
+        "1.2.3.3",
+        "1.2.3.4-meta",
+        "1.2.3.4",
+    ]
+
+    def matches(self, constraint):
+        constraint = parse_constraint(constraint)
+        versions = sorted([parse_version(v) for v in self.versions])
+        matches = [v.string for v in versions if v in constraint]
+
+        # Versions outside of bounds must never match
+        start, stop = constraint.bounds([v.sort_key for v in versions])
+        self.assertEqual(
+            [v.string for v in versions[start:stop] if v in constraint],
+            matches,
+        )
+        return set(matches)
+
+    def test_less_than_excludes_prereleases(self):
+        matches = self.matches("<2")
+        self.assertIn("1.9.9", matches)
+        self.assertIn("1.9.9-rc1", matches)
+        self.assertNotIn("2.0.0-beta", matches)
+        self.assertNotIn("2.0.0-rc1", matches)
+        self.assertNotIn("2.0.0", matches)
+        self.assertNotIn("2.0.0+build", matches)
+
+        self.assertEqual(self.matches("<2.0.0"), self.matches("<2"))
+
+    def test_less_than_prerelease(self):
+        matches = self.matches("<2.0.0-rc1")
+        self.assertIn("1.9.9", matches)
+        self.assertIn("2.0.0-beta", matches)
+        self.assertNotIn("2.0.0-rc1", matches)
+        self.assertNotIn("2.0.0", matches)
+
+    def test_less_than_four_part_version(self):
+        matches = self.matches("<1.2.3.4")
+        self.assertIn("1.2.3.3", matches)
+        self.assertNotIn("1.2.3.4-meta", matches)
+        self.assertNotIn("1.2.3.4", matches)
+
+    def test_less_equal_includes_bound(self):
+        matches = self.matches("<=2")
+        self.assertIn("2.0.0", matches)
+        self.assertIn("2.0.0-beta", matches)
+        self.assertNotIn("2.1.0", matches)
+
+    def test_range(self):
+        matches = self.matches(">=2.0.0-beta,<3")
+        self.assertEqual(
+            matches,
+            set(["2.0.0-beta", "2.0.0-rc1", "2.0.0", "2.0.0+build", "2.1.0"]),
+        )
+
+    def test_prefix(self):
+        matches = self.matches("==2.*")
+        self.assertIn("2.0.0-beta", matches)
+        self.assertIn("2.1.0", matches)
+        self.assertNotIn("3.0.0-beta", matches)
+
+        matches = self.matches("!=2.*")
+        self.assertIn("1.9.9", matches)
+        self.assertIn("3.0.0-beta", matches)
+        self.assertNotIn("2.0.0-beta", matches)
+        self.assertNotIn("2.1.0", matches)
+
+    def test_compatible_release(self):
+        matches = self.matches("~=2.1")
+        self.assertEqual(matches, set(["2.1.0"]))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Standard library imports
+import os
+import shutil
+import tempfile
+import unittest
+
+module_yml = """name: {name}
+version: {version}
+description: ''
+author: ''
+email: ''
+requires: [{requires}]
+environment: {{}}
+"""
+
+
+def make_module(root, name, version, requires=()):
+    """Create a module folder named <name>-<version> in root."""
+
+    path = os.path.join(root, "%s-%s" % (name, version))
+    os.makedirs(path)
+    with open(os.path.join(path, "module.yml"), "w") as f:
+        f.write(
+            module_yml.format(
+                name=name,
+                version=version,
+                requires=", ".join(['"%s"' % r for r in requires]),
+            )
+        )
+    return path
+
+
+def reset_api():
+    """Reset cpenv's registered repos and active modules."""
+
+    from cpenv import api
+
+    api._registry["repos"].clear()
+    del api._active_modules[:]
+    for key in api._initialized:
+        api._initialized[key] = False
+
+
+class TempDirTestCase(unittest.TestCase):
+    """Creates self.tmp, and points CPENV_HOME, the user path and cwd into it."""
+
+    env_vars = (
+        "CPENV_HOME",
+        "CPENV_MODULES",
+        "CPENV_ACTIVE_MODULES",
+        "CPENV_RESOLVE_REQUIRES",
+        "CPENV_DAEMON",
+        "CPENV_DAEMON_SOCKET",
+        "XDG_RUNTIME_DIR",
+        "XDG_DATA_HOME",
+    )
+
+    def setUp(self):
+        self.tmp = os.path.realpath(tempfile.mkdtemp())
+        self.cwd = os.getcwd()
+        self.environ = dict([(k, os.environ.get(k)) for k in self.env_vars])
+        os.environ["CPENV_HOME"] = os.path.join(self.tmp, "home")
+        os.environ["XDG_DATA_HOME"] = os.path.join(self.tmp, "user")
+        for key in self.env_vars[1:-1]:
+            os.environ.pop(key, None)
+        os.makedirs(os.path.join(self.tmp, "cwd"))
+        os.chdir(os.path.join(self.tmp, "cwd"))
+        reset_api()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        for key, value in self.environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        reset_api()
+        shutil.rmtree(self.tmp, ignore_errors=True)